@@ -0,0 +1,76 @@
+"""Micro-benchmark: legacy filter_ansi vs the streaming AnsiStripper.
+
+    python3 benchmarks/bench_ansi_filter.py [--transcript FILE ...] [--repeat 20]
+
+Without --transcript a few real transcripts are recorded on a PTY first (coloured ls,
+coloured grep, a \\r progress bar, an xterm title/prompt loop). Recordings made with
+`script -q FILE` work as --transcript input too. Transcripts are fed in 4096-byte chunks,
+the reader's default read size.
+"""
+import argparse, os, pty, re, string, subprocess, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from notesshell import AnsiStripper
+
+RECORD_COMMANDS = {
+    "ls-color": "ls -la --color=always /usr/bin /usr/lib 2>/dev/null",
+    "grep-color": "grep -rn --color=always 'def ' /usr/lib/python3* 2>/dev/null | head -n 20000",
+    "progress-bar": "i=0; while [ $i -le 3000 ]; do printf '\\r\\033[32m%5d\\033[0m [%-50s]' $i $(printf '#%.0s' $(seq 1 $((i % 50 + 1)))); i=$((i+1)); done; echo",
+    "prompt-loop": "for i in $(seq 1 5000); do printf '\\033]0;user@host: ~/dir %d\\007\\033[01;32muser@host\\033[00m:\\033[01;34m~/dir\\033[00m$ ls f%d.txt \\303\\251t\\303\\251\\r\\n' $i $i; done",
+}
+
+
+def legacy_filter_ansi(data):
+    # the pre-AnsiStripper NoteShellApp.filter_ansi
+    clear_detected = False; ansi_escape_pattern = re.compile(r'\x1b\[[0-?]*[ -/]*[\@-~]'); osc_escape_pattern = re.compile(r'\x1b\].*?(\x07|\x1b\\)'); other_escape_pattern = re.compile(r'\x1b[<=>NM78HPZ=c()]')
+    if '\x1b[2J' in data: clear_detected = True; data = data.replace('\x1b[H\x1b[2J', '').replace('\x1b[2J\x1b[H', '').replace('\x1b[H', '').replace('\x1b[2J', '')
+    data = data.replace('\r', ''); data = ansi_escape_pattern.sub('', data); data = osc_escape_pattern.sub('', data); data = other_escape_pattern.sub('', data); data = data.replace('\x1b', '')
+    allowed_chars = set(string.printable); allowed_chars.discard('\r'); final_filtered_data = ''.join(c for c in data if c in allowed_chars)
+    return final_filtered_data, clear_detected
+
+
+def record(cmd):
+    master_fd, slave_fd = pty.openpty()
+    proc = subprocess.Popen(["sh", "-c", cmd], stdin=slave_fd, stdout=slave_fd, stderr=slave_fd, close_fds=True)
+    os.close(slave_fd)
+    out = bytearray()
+    while True:
+        try: data = os.read(master_fd, 65536)
+        except OSError: break
+        if not data: break
+        out += data
+    proc.wait(); os.close(master_fd)
+    return bytes(out)
+
+
+def chunks(text, size=4096):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def bench(fn, pieces, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for piece in pieces: fn(piece)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcript", action="append", default=[])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    if args.transcript: transcripts = {os.path.basename(p): open(p, "rb").read() for p in args.transcript}
+    else: transcripts = {name: record(cmd) for name, cmd in RECORD_COMMANDS.items()}
+    for name, raw in transcripts.items():
+        pieces = chunks(raw.decode("utf-8", errors="replace"))
+        stripper = AnsiStripper()
+        legacy = bench(legacy_filter_ansi, pieces, args.repeat)
+        streaming = bench(stripper.feed, pieces, args.repeat)
+        mib = len(raw) / (1 << 20)
+        print(f"{name:14s} {len(raw):>10d} B  legacy {mib / legacy:8.1f} MiB/s  streaming {mib / streaming:8.1f} MiB/s  speedup {legacy / streaming:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Preview render latency: whole-document markdown2 vs the incremental MarkdownPreviewEngine.
+
+    python3 benchmarks/bench_preview.py [--size 1M] [--repeat 5]
+
+The note is built from the bundled notes/ samples, repeated until it reaches --size.
+Each copy's prose blocks are tagged with the copy number so the copies are not identical
+(tables and code blocks repeat verbatim, as they tend to in real logs).
+"""
+import argparse, glob, os, sys, time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import markdown2
+from notesshell import MARKDOWN_EXTRAS, MarkdownPreviewEngine
+
+
+def build_note(size):
+    engine = MarkdownPreviewEngine()
+    samples = [open(p, encoding="utf-8").read().strip() for p in sorted(glob.glob(os.path.join(ROOT, "notes", "*.md")))]
+    copies = []; total = 0; n = 0
+    while total < size:
+        for sample in samples:
+            blocks = []
+            for block in engine.split_blocks(sample):
+                first, _, rest = block.partition("\n")
+                if first[:1].isalpha() or first.startswith(("#", "*")): first += f" [{n}]"
+                blocks.append(first + ("\n" + rest if rest else ""))
+            text = "\n\n".join(blocks); copies.append(text); total += len(text) + 2; n += 1
+    return "\n\n".join(copies)
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def parse_size(text):
+    units = {"K": 1 << 10, "M": 1 << 20}
+    return int(float(text[:-1]) * units[text[-1].upper()]) if text[-1].upper() in units else int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="1M")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    note = build_note(parse_size(args.size))
+    middle = note.rfind("\n\n", 0, len(note) // 2) + 2
+
+    full_md = markdown2.Markdown(extras=MARKDOWN_EXTRAS)
+    print(f"note: {len(note)} chars")
+    print(f"whole-document convert:         {best_of(lambda: full_md.convert(note), args.repeat):9.1f} ms")
+    print(f"incremental, cold cache:        {best_of(lambda: MarkdownPreviewEngine().render(note), args.repeat):9.1f} ms")
+    engine = MarkdownPreviewEngine(); engine.render(note)
+    # every timed edit is new text, so the touched block is never already cached
+    edits = iter(range(10 ** 9))
+    def edit_middle(): i = next(edits); engine.render(note[:middle] + f"x{i} " + note[middle:])
+    t = best_of(edit_middle, args.repeat)
+    print(f"incremental, edit in middle:    {t:9.1f} ms ({engine.last_stats['rendered']} of {engine.last_stats['blocks']} blocks rendered)")
+    def append_end(): i = next(edits); engine.render(note + f"\n\nA new paragraph typed at the end {i}.")
+    t = best_of(append_end, args.repeat)
+    print(f"incremental, append at end:     {t:9.1f} ms ({engine.last_stats['rendered']} of {engine.last_stats['blocks']} blocks rendered)")
+
+if __name__ == "__main__":
+    main()
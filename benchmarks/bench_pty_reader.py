@@ -0,0 +1,156 @@
+"""Idle CPU and throughput of the PTY reader loop: legacy select/sleep spin, PtyReader, and the shared PtyIOLoop.
+
+    python3 benchmarks/bench_pty_reader.py [--bytes 200M] [--idle-seconds 3]
+
+Throughput is measured on `yes | head -c BYTES` running on a fresh PTY; idle CPU on a
+PTY whose shell just sleeps. Only the read loop is measured: the legacy loop hands over
+raw bytes, while PtyReader and PtyIOLoop also decode UTF-8 incrementally, as the app
+needs. Nothing is filtered, and the chunks are only counted.
+"""
+import argparse, codecs, errno, os, pty, select, selectors, subprocess, sys, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from notesshell import PtyIOLoop
+
+
+class PtyReader:
+    """Blocking, selector-driven reader for one PTY master fd, on a thread of its own.
+    The per-session reader that preceded PtyIOLoop, kept here for comparison."""
+    MIN_CHUNK = 4096
+    MAX_CHUNK = 1 << 16
+
+    def __init__(self, fd, on_data, on_eof=None, encoding="utf-8"):
+        self.fd = fd
+        self.on_data = on_data # called from the reader thread with each chunk of decoded text
+        self.on_eof = on_eof # called from the reader thread once the shell side is gone
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._buffer = bytearray(self.MAX_CHUNK)
+        self._view = memoryview(self._buffer)
+        self._stopping = False
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False); os.set_blocking(self._wake_w, False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.fd, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+
+    def stop(self):
+        """Asks the reader loop to exit. Safe to call from any thread, returns immediately."""
+        self._stopping = True
+        wake_w = self._wake_w
+        if wake_w < 0: return
+        try: os.write(wake_w, b"x")
+        except OSError: pass # pipe full (already woken) or already closed
+
+    def run(self):
+        chunk = self.MIN_CHUNK
+        eof = False
+        try:
+            while not self._stopping:
+                for key, _ in self._selector.select():
+                    if key.fd == self._wake_r:
+                        try:
+                            while os.read(self._wake_r, 512): pass
+                        except OSError: pass
+                        continue
+                    try: n = os.readv(self.fd, [self._view[:chunk]])
+                    except BlockingIOError: continue
+                    except OSError as e:
+                        if e.errno == errno.EIO: print("PTY master got EIO. Shell likely exited.")
+                        elif e.errno == errno.EBADF: print("Reader thread got EBADF.")
+                        else: print(f"OSError during read in reader: {e}")
+                        eof = True; break
+                    if not n: print("Shell process likely exited (EOF on read)."); eof = True; break
+                    self.bytes_read += n
+                    text = self._decoder.decode(self._view[:n])
+                    if text: self.on_data(text)
+                    # adapt the read size to the output rate
+                    if n == chunk and chunk < self.MAX_CHUNK: chunk <<= 1
+                    elif n < chunk >> 2 and chunk > self.MIN_CHUNK: chunk >>= 1
+                if eof: break
+        finally:
+            self.close()
+        tail = self._decoder.decode(b"", final=True) # a truncated character at EOF becomes U+FFFD
+        if tail: self.on_data(tail)
+        if eof and not self._stopping and self.on_eof: self.on_eof()
+
+    def close(self):
+        """Releases the selector and self-pipe. The PTY fd itself is owned by the caller."""
+        try: self._selector.close()
+        except Exception: pass
+        fds = (self._wake_r, self._wake_w); self._wake_r = self._wake_w = -1 # stop() must not write to a recycled fd
+        for fd in fds:
+            if fd < 0: continue
+            try: os.close(fd)
+            except OSError: pass
+
+
+def spawn(cmd):
+    master_fd, slave_fd = pty.openpty()
+    os.set_blocking(master_fd, False)
+    proc = subprocess.Popen(cmd, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd, preexec_fn=os.setsid, close_fds=True)
+    os.close(slave_fd)
+    return proc, master_fd
+
+
+def legacy_loop(fd, on_data, stop):
+    # the pre-PtyReader loop from NoteShellApp.read_shell_output
+    while not stop.is_set():
+        data = b""
+        r, _, _ = select.select([fd], [], [], 0.005)
+        if r:
+            try: data = os.read(fd, 4096)
+            except OSError as e:
+                if e.errno == errno.EIO: break
+                raise
+            if not data: break
+            on_data(data)
+        if not data: time.sleep(0.0005)
+
+
+def pty_reader_loop(fd, on_data, stop):
+    reader = PtyReader(fd, on_data)
+    watcher = threading.Thread(target=lambda: (stop.wait(), reader.stop()), daemon=True); watcher.start()
+    reader.run()
+
+
+def pty_io_loop(fd, on_data, stop):
+    loop = PtyIOLoop(); done = threading.Event()
+    loop.add(fd, on_data, on_eof=done.set)
+    while not (done.is_set() or stop.is_set()): done.wait(0.05)
+    loop.close()
+
+
+def measure(loop, cmd, duration=None):
+    proc, fd = spawn(cmd)
+    total = [0]
+    def on_data(data): total[0] += len(data) # bytes for the legacy loop, decoded chars for PtyReader (equal for yes output)
+    stop = threading.Event()
+    if duration: threading.Timer(duration, stop.set).start()
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    loop(fd, on_data, stop)
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+    stop.set(); proc.kill(); proc.wait(); os.close(fd)
+    return total[0], wall, cpu
+
+
+def parse_size(text):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    return int(text[:-1]) * units[text[-1].upper()] if text[-1].upper() in units else int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bytes", default="200M")
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+    nbytes = parse_size(args.bytes)
+    for name, loop in (("legacy select/sleep", legacy_loop), ("PtyReader", pty_reader_loop), ("PtyIOLoop", pty_io_loop)):
+        _, wall, cpu = measure(loop, ["sleep", str(args.idle_seconds + 5)], duration=args.idle_seconds)
+        print(f"{name:22s} idle:       {100.0 * cpu / wall:6.2f}% of a core over {wall:.1f}s")
+        got, wall, cpu = measure(loop, ["sh", "-c", f"yes | head -c {nbytes}"])
+        print(f"{name:22s} throughput: {got / wall / (1 << 20):8.1f} MiB/s ({got} bytes in {wall:.2f}s, cpu {cpu:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
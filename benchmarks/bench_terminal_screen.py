@@ -0,0 +1,54 @@
+"""Throughput of the terminal output paths: AnsiStripper (plain mode) vs TerminalScreen (emulation).
+
+    python3 benchmarks/bench_terminal_screen.py [--transcript FILE ...] [--repeat 10] [--size 40x120] [--chunk 4096]
+
+Uses the same recorded transcripts as bench_ansi_filter.py, plus a full-screen redraw loop
+(cursor addressing, colours, alternate screen, like top/htop). Transcripts are fed in
+4096-character chunks. "damage" is the average number of rows a renderer would redraw per
+chunk if it took the screen's damage after each one; "scrolled" is the rows it would move
+instead. Once a chunk scrolls a whole screen every row is new, so use a smaller --chunk to
+see the per-frame damage of streaming output.
+"""
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from notesshell import AnsiStripper, TerminalScreen
+from bench_ansi_filter import RECORD_COMMANDS, record, chunks
+
+SCREEN_COMMANDS = dict(RECORD_COMMANDS, **{
+    "full-screen": "printf '\\033[?1049h'; for i in $(seq 1 300); do printf '\\033[H\\033[1;7m top - %5d \\033[0m\\033[K\\r\\n' $i; for r in $(seq 2 38); do printf '\\033[%d;1H\\033[3%dm%6d\\033[0m  user  %5d.%d  \\033[1mcmd-%d\\033[0m\\033[K' $r $((r % 7 + 1)) $((r * i)) $((i % 100)) $r $r; done; done; printf '\\033[?1049l'",
+})
+
+
+def bench(fn, pieces, repeat, make):
+    best = float("inf")
+    for _ in range(repeat):
+        target = make()
+        t0 = time.perf_counter()
+        for piece in pieces: fn(target, piece)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcript", action="append", default=[])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--size", default="40x120")
+    parser.add_argument("--chunk", type=int, default=4096)
+    args = parser.parse_args()
+    rows, cols = (int(v) for v in args.size.lower().split("x"))
+    if args.transcript: transcripts = {os.path.basename(p): open(p, "rb").read() for p in args.transcript}
+    else: transcripts = {name: record(cmd) for name, cmd in SCREEN_COMMANDS.items()}
+    for name, raw in transcripts.items():
+        pieces = chunks(raw.decode("utf-8", errors="replace"), args.chunk)
+        plain = bench(lambda stripper, piece: stripper.feed(piece), pieces, args.repeat, AnsiStripper)
+        screen = bench(lambda screen, piece: screen.feed(piece), pieces, args.repeat, lambda: TerminalScreen(rows, cols))
+        damaged = TerminalScreen(rows, cols); redrawn = moved = 0
+        for piece in pieces: damaged.feed(piece); full, scrolled, damage, cursor = damaged.take_damage(); redrawn += len(damage); moved += scrolled
+        mib = len(raw) / (1 << 20)
+        print(f"{name:14s} {len(raw):>10d} B  strip {mib / plain:8.1f} MiB/s  screen {mib / screen:8.1f} MiB/s  damage {redrawn / max(len(pieces), 1):5.1f} of {rows} rows/chunk  scrolled {moved / max(len(pieces), 1):5.1f}")
+
+
+if __name__ == "__main__":
+    main()
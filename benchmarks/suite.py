@@ -0,0 +1,386 @@
+"""Reproducible benchmark suite: preview, sidebar, note loading and terminal throughput, as JSON.
+
+    python3 benchmarks/suite.py [--quick] [--only NAME ...] [--out FILE] [--compare BASELINE.json]
+    xvfb-run -a python3 benchmarks/suite.py ...     # adds the benchmarks that drive NoteShellApp
+
+Two tiers. "logic" benchmarks call the code under test directly and run anywhere. "app"
+benchmarks build a real NoteShellApp under a throwaway HOME (so ~/.notesshell is never
+touched) and drive it through its own methods, Tk redraws included; without a display
+they are listed under "skipped". The fixture is --notes synthetic notes (names and bodies
+drawn from the notes/ samples, fixed seed) plus one note per --sizes entry built like
+bench_preview.py's, from 1 KB to 10 MB.
+
+The JSON document goes to stdout (or --out); progress and the app's own log go to stderr.
+Timings are {"median_ms", "min_ms", "max_ms", "runs"}; throughputs end in "_per_s".
+--compare prints how every shared number moved against an earlier run and exits 1 when
+one got worse by more than --threshold.
+"""
+import argparse, contextlib, glob, itertools, json, os, platform, random, re, shutil, subprocess, sys, tempfile, threading, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path[:0] = [ROOT, HERE]
+import notesshell
+from notesshell import MarkdownPreviewEngine, NoteIndex, NotesDirectoryCache, OutputBuffer, PtyIOLoop, ScrollbackBuffer, TerminalScreen, AnsiStripper
+from bench_preview import build_note, parse_size
+from bench_pty_reader import spawn
+
+SIZES = "1K,10K,100K,1M,10M"
+QUICK = {"sizes": "1K,10K,100K", "notes": 10000, "stream": "8M", "repeat": 3}
+
+
+def log(msg): print(msg, file=sys.stderr, flush=True)
+
+
+def stats(samples):
+    """Summary of a list of durations in seconds."""
+    ordered = sorted(samples)
+    return {"median_ms": round(1000 * ordered[len(ordered) // 2], 3), "min_ms": round(1000 * ordered[0], 3), "max_ms": round(1000 * ordered[-1], 3), "runs": len(ordered)}
+
+
+def timed(fn, repeat, budget_s):
+    """Runs fn up to repeat times (at least once, fewer if they take longer than budget_s in total)."""
+    samples = []; deadline = time.perf_counter() + budget_s
+    while len(samples) < repeat and (not samples or time.perf_counter() < deadline):
+        t0 = time.perf_counter(); fn(); samples.append(time.perf_counter() - t0)
+    return stats(samples)
+
+
+# fixture
+def sample_texts():
+    return [open(p, encoding="utf-8").read() for p in sorted(glob.glob(os.path.join(ROOT, "notes", "*.md")))]
+
+
+def sized_note(size):
+    """bench_preview's note, cut back to size at a block boundary (it builds whole copies of the samples)."""
+    note = build_note(size)
+    if len(note) > size: cut = note.rfind("\n\n", 0, size); note = note[:cut if cut > 0 else size]
+    return note
+
+
+def make_fixture(ctx):
+    """Writes the synthetic notes and the sized notes into ctx.notes_dir."""
+    os.makedirs(ctx.notes_dir, exist_ok=True)
+    texts = sample_texts()
+    words = sorted({w.lower() for text in texts for w in re.findall(r"[A-Za-z]{4,12}", text)})
+    paragraphs = [p.strip() for text in texts for p in text.split("\n\n") if len(p.strip()) > 40]
+    rng = random.Random(20240601)
+    t0 = time.perf_counter()
+    for i in range(ctx.args.notes):
+        a, b = rng.choice(words), rng.choice(words)
+        with open(os.path.join(ctx.notes_dir, f"{a}-{b}-{i:06d}.md"), "w", encoding="utf-8") as f: f.write(f"# {a.title()} {b} {i}\n\n{rng.choice(paragraphs)[:400]}\n")
+    ctx.query = rng.choice([w for w in words if len(w) >= 6])
+    ctx.sized_notes = []
+    for label in ctx.sizes:
+        name = f"zz-bench-{label}.md"; note = sized_note(parse_size(label))
+        with open(os.path.join(ctx.notes_dir, name), "w", encoding="utf-8") as f: f.write(note + "\n")
+        ctx.sized_notes.append((label, name, len(note)))
+    log(f"fixture: {ctx.args.notes} notes + {len(ctx.sizes)} sized notes in {time.perf_counter() - t0:.1f}s")
+
+
+# logic tier
+def bench_preview_engine(ctx):
+    """MarkdownPreviewEngine: cold render, an edit in the middle and an appended paragraph, per note size."""
+    out = {}
+    for label, name, _ in ctx.sized_notes:
+        with open(os.path.join(ctx.notes_dir, name), encoding="utf-8") as f: note = f.read().strip()
+        middle = note.rfind("\n\n", 0, len(note) // 2) + 2
+        cold = timed(lambda: MarkdownPreviewEngine().render(note), ctx.args.repeat, ctx.args.budget)
+        engine = MarkdownPreviewEngine(); engine.render(note); edits = itertools.count() # every edit is new text, never a cache hit
+        edit = timed(lambda: engine.render(note[:middle] + f"x{next(edits)} " + note[middle:]), ctx.args.repeat, ctx.args.budget)
+        append = timed(lambda: engine.render(note + f"\n\nA new paragraph typed at the end {next(edits)}."), ctx.args.repeat, ctx.args.budget)
+        out[label] = {"chars": len(note), "blocks": engine.last_stats["blocks"], "cold": cold, "edit_middle": edit, "append": append}
+        log(f"  preview {label}: cold {cold['median_ms']:.1f} ms, edit {edit['median_ms']:.1f} ms")
+    return out
+
+
+def bench_notes_scan(ctx):
+    """NotesDirectoryCache.scan of the fixture: a fresh listing and the unchanged-directory fast path."""
+    def cold(): NotesDirectoryCache(ctx.notes_dir).scan()
+    cache = NotesDirectoryCache(ctx.notes_dir); cache.scan()
+    return {"notes": len(cache.names), "cold": timed(cold, ctx.args.repeat, ctx.args.budget), "warm": timed(cache.scan, ctx.args.repeat, ctx.args.budget)}
+
+
+def bench_index_search(ctx):
+    """Builds the full-text index of the fixture (also used by the app tier), then times each keystroke's search."""
+    index = NoteIndex(ctx.index_path)
+    try:
+        t0 = time.perf_counter(); index._sync(ctx.notes_dir); build = time.perf_counter() - t0 # on this thread, so it can be timed
+        if not index.available: return {"notes": ctx.args.notes, "build": stats([build]), "keystroke": None, "note": "SQLite without FTS5"}
+        prefixes = [ctx.query[:n] for n in range(2, len(ctx.query) + 1)]
+        per_key = []
+        for _ in range(ctx.args.repeat):
+            for prefix in prefixes: t0 = time.perf_counter(); index.search(prefix); per_key.append(time.perf_counter() - t0)
+        return {"notes": ctx.args.notes, "query": ctx.query, "build": stats([build]), "keystroke": stats(per_key)}
+    finally: index.close()
+
+
+class _Pipeline:
+    """The I/O-thread half of the terminal path (decode, filter or screen feed, output queue) without Tk."""
+
+    def __init__(self, emulation):
+        self.screen = TerminalScreen(24, 80) if emulation else None
+        self.stripper = AnsiStripper()
+        self.buffer = OutputBuffer(ScrollbackBuffer(1 << 20), 4 << 20)
+        self.marker = None; self.tail = ""; self.found = threading.Event()
+
+    def on_data(self, text):
+        for item in (self.screen.feed(text) if self.screen is not None else self.stripper.feed(text)): self.buffer.put(item)
+        self.buffer.take(None) # stands in for the render frame draining the queue
+        if self.marker is not None:
+            self.tail = self.tail[-64:] + text
+            if self.marker in self.tail: self.marker = None; self.found.set()
+
+    def expect(self, marker): self.tail = ""; self.found.clear(); self.marker = marker
+
+
+def bench_terminal_pipeline(ctx):
+    """PTY -> PtyIOLoop -> AnsiStripper or TerminalScreen -> OutputBuffer: stream throughput and line echo latency."""
+    nbytes = parse_size(ctx.args.stream); out = {}
+    loop = PtyIOLoop()
+    try:
+        for mode in ("emulation", "plain"):
+            pipe = _Pipeline(mode == "emulation")
+            pipe.expect("DONE-42")
+            t0 = time.perf_counter(); proc, fd = spawn(["sh", "-c", f"yes | head -c {nbytes}; echo DONE-$((6*7))"])
+            loop.add(fd, pipe.on_data)
+            if not pipe.found.wait(120): raise TimeoutError(f"{mode}: stream did not finish")
+            wall = time.perf_counter() - t0
+            loop.remove(fd, lambda fd=fd: os.close(fd)); proc.wait()
+            pipe = _Pipeline(mode == "emulation")
+            proc, fd = spawn(["sh", "-c", "while IFS= read -r line; do echo \"got:$line\"; done"])
+            loop.add(fd, pipe.on_data); samples = []
+            for i in range(ctx.args.echoes):
+                pipe.expect(f"got:e{i}\r"); t0 = time.perf_counter(); os.write(fd, f"e{i}\n".encode())
+                if not pipe.found.wait(10): raise TimeoutError(f"{mode}: no echo for line {i}")
+                samples.append(time.perf_counter() - t0)
+            loop.remove(fd, lambda fd=fd: os.close(fd)); proc.kill(); proc.wait()
+            out[mode] = {"stream_bytes": nbytes, "stream_mib_per_s": round(nbytes / wall / (1 << 20), 2), "echo": stats(samples)}
+            log(f"  terminal pipeline {mode}: {out[mode]['stream_mib_per_s']} MiB/s, echo {out[mode]['echo']['median_ms']:.2f} ms")
+    finally: loop.close()
+    return out
+
+
+# app tier
+def pump(root, until, timeout, what):
+    """Runs the Tk event loop until until() is true; returns the seconds it took."""
+    t0 = time.perf_counter(); deadline = t0 + timeout
+    while not until():
+        if time.perf_counter() > deadline: raise TimeoutError(f"timed out after {timeout}s waiting for {what}")
+        root.update(); time.sleep(0.0005)
+    return time.perf_counter() - t0
+
+
+def settle(root, seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end: root.update(); time.sleep(0.005)
+
+
+def start_app(ctx):
+    """A real NoteShellApp on the fixture. Raises tk.TclError when there is no display."""
+    import tkinter as tk
+    root = tk.Tk()
+    t0 = time.perf_counter(); app = notesshell.NoteShellApp(root); built = time.perf_counter() - t0
+    ready = pump(root, lambda: not app._startup_pending, 60, "startup (preview and shell)")
+    settle(root, 1.0) # let the startup index sync and the notes watcher go quiet
+    ctx.app_startup = {"construct": stats([built]), "until_ready": stats([built + ready])}
+    return root, app
+
+
+def bench_app_startup(ctx, root, app): return ctx.app_startup
+
+
+def bench_app_sidebar(ctx, root, app):
+    """load_notes (rescan and cached) and filter_notes per keystroke, typing the query and deleting it again."""
+    def rescan(): app._notes_dir_cache.invalidate(); app.load_notes(); root.update_idletasks()
+    def cached(): app.load_notes(); root.update_idletasks()
+    out = {"notes": len(app._all_notes), "load_notes_rescan": timed(rescan, ctx.args.repeat, ctx.args.budget), "load_notes_cached": timed(cached, ctx.args.repeat, ctx.args.budget)}
+    entry = app.filter_entry; typing, deleting = [], []
+    for _ in range(ctx.args.repeat):
+        entry.delete(0, "end"); app.filter_notes(); root.update_idletasks()
+        for ch in ctx.query:
+            t0 = time.perf_counter(); entry.insert("end", ch); app.filter_notes(); root.update_idletasks(); typing.append(time.perf_counter() - t0)
+        for _ in ctx.query:
+            t0 = time.perf_counter(); entry.delete(len(entry.get()) - 1, "end"); app.filter_notes(); root.update_idletasks(); deleting.append(time.perf_counter() - t0)
+    root.update()
+    out.update(query=ctx.query, type_keystroke=stats(typing), delete_keystroke=stats(deleting))
+    return out
+
+
+def bench_app_note_open(ctx, root, app):
+    """load_note_content per note size: until the call returns and paints, until a chunked load finishes, until the preview is shown."""
+    rounds = {label: {"open": [], "loaded": [], "preview": []} for label, _, _ in ctx.sized_notes}
+    for _ in range(ctx.args.repeat):
+        round_start = time.perf_counter()
+        for label, name, _ in ctx.sized_notes:
+            app.new_note(confirm_discard=False); settle(root, 0.05)
+            if not app.notes_list.select_item(name): raise RuntimeError(f"{name} is not in the sidebar")
+            before = app._last_preview_html
+            t0 = time.perf_counter(); app.load_note_content(); root.update_idletasks(); rounds[label]["open"].append(time.perf_counter() - t0)
+            rounds[label]["loaded"].append(time.perf_counter() - t0 + pump(root, lambda: app._note_loader is None, 300, f"{name} to load"))
+            rounds[label]["preview"].append(time.perf_counter() - t0 + pump(root, lambda: app._last_preview_html is not before, 300, f"{name} preview"))
+        if time.perf_counter() - round_start > ctx.args.budget: break # a round with the 10 MB note can take that long; the first one is enough then
+    return {label: {kind: stats(samples) for kind, samples in kinds.items()} for label, kinds in rounds.items()}
+
+
+def bench_app_preview_edit(ctx, root, app):
+    """Typing into an open note: insert a word in the middle, until the re-rendered preview is shown."""
+    out = {}
+    for label, name, chars in ctx.sized_notes:
+        if chars > 1 << 20: continue # large notes only preview the visible region, covered by note_open
+        app.new_note(confirm_discard=False); app.notes_list.select_item(name); app.load_note_content()
+        pump(root, lambda: app._note_loader is None, 300, f"{name} to load"); settle(root, 0.2)
+        middle = f"{int(app.text_editor.index('end').split('.')[0]) // 2}.0"; samples = []
+        for i in range(ctx.args.repeat):
+            before = app._last_preview_html
+            t0 = time.perf_counter(); app.text_editor.insert(middle, f"edit{i} "); app.update_live_preview()
+            samples.append(time.perf_counter() - t0 + pump(root, lambda: app._last_preview_html is not before, 120, f"{name} preview after edit"))
+        out[label] = stats(samples)
+    app.new_note(confirm_discard=False); root.update()
+    return out
+
+
+def bench_app_editor_highlight(ctx, root, app):
+    """Editor highlighting per note size: opening until every line state is known, a keystroke in the middle, and opening a fence there (every line below changes)."""
+    highlighter = app.highlighter
+    if highlighter is None: raise RuntimeError("editor_highlight is off in the config")
+    idle = lambda: highlighter._job_id is None
+    out = {}
+    for label, name, _ in ctx.sized_notes:
+        app.new_note(confirm_discard=False); app.notes_list.select_item(name); settle(root, 0.05)
+        t0 = time.perf_counter(); app.load_note_content()
+        opened = time.perf_counter() - t0 + pump(root, lambda: app._note_loader is None and idle(), 300, f"{name} to load and highlight")
+        middle = f"{int(app.text_editor.index('end').split('.')[0]) // 2}.0"; app.text_editor.see(middle); pump(root, idle, 60, "the view to highlight")
+        keys, fences = [], []
+        for _ in range(ctx.args.repeat):
+            t0 = time.perf_counter(); app.text_editor.insert(middle, "*"); keys.append(time.perf_counter() - t0 + pump(root, idle, 60, "a keystroke to highlight"))
+            t0 = time.perf_counter(); app.text_editor.insert(middle, "```\n"); fences.append(time.perf_counter() - t0 + pump(root, idle, 300, "a fence to highlight"))
+            app.text_editor.delete(middle, f"{middle} + 4c"); pump(root, idle, 300, "the fence removal to highlight")
+        out[label] = {"open": stats([opened]), "keystroke": stats(keys), "open_fence": stats(fences)}
+    app.new_note(confirm_discard=False); root.update()
+    return out
+
+
+def bench_app_terminal(ctx, root, app):
+    """Shell output end to end (PTY, I/O thread, poll_shell_output, Text widget): echo latency and stream throughput."""
+    app.toggle_terminal()
+    pump(root, lambda: app.session.master_fd is not None, 30, "the shell"); settle(root, 0.5)
+    widget = app.terminal_output
+    def shown(text): return bool(widget.search(text, "end-60l", "end"))
+    def run(cmd): app.terminal_input.delete(0, "end"); app.terminal_input.insert(0, cmd); app.execute_command()
+    samples = []
+    for i in range(ctx.args.echoes):
+        t0 = time.perf_counter(); run(f"echo e{i}-$((1+1))") # the command line itself never contains the output text
+        samples.append(time.perf_counter() - t0 + pump(root, lambda: shown(f"e{i}-2"), 10, f"echo {i}"))
+    nbytes = parse_size(ctx.args.stream); frames = app.render_stats.frames
+    t0 = time.perf_counter(); run(f"yes | head -c {nbytes}; echo DONE-$((6*7))")
+    wall = time.perf_counter() - t0 + pump(root, lambda: shown("DONE-42"), 300, "the output stream")
+    app.toggle_terminal(); root.update()
+    return {"echo": stats(samples), "stream_bytes": nbytes, "stream_mib_per_s": round(nbytes / wall / (1 << 20), 2), "stream_frames": app.render_stats.frames - frames}
+
+
+LOGIC = [("preview_engine", bench_preview_engine), ("notes_scan", bench_notes_scan), ("index_search", bench_index_search), ("terminal_pipeline", bench_terminal_pipeline)]
+APP = [("app_startup", bench_app_startup), ("app_sidebar", bench_app_sidebar), ("app_note_open", bench_app_note_open), ("app_preview_edit", bench_app_preview_edit), ("app_editor_highlight", bench_app_editor_highlight), ("app_terminal", bench_app_terminal)]
+
+
+def run_suite(args):
+    ctx = argparse.Namespace(args=args, sizes=[s.strip() for s in args.sizes.split(",") if s.strip()], started=time.perf_counter())
+    home = tempfile.mkdtemp(prefix="notesshell-bench-")
+    ctx.notes_dir = os.path.join(home, ".notesshell", "notes"); ctx.index_path = os.path.join(home, ".notesshell", "index.db")
+    doc = {"suite": "notesshell", "format": 1, "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "host": host_info(), "options": vars(args), "results": {}, "skipped": {}, "errors": {}}
+    wanted = lambda name: not args.only or name in args.only
+    def record(name, fn, *fn_args):
+        log(f"{name}...")
+        try: doc["results"][name] = fn(ctx, *fn_args)
+        except Exception as e: doc["errors"][name] = f"{type(e).__name__}: {e}"; log(f"  failed: {e}")
+    old_home = os.environ.get("HOME")
+    try:
+        make_fixture(ctx)
+        if wanted("index_search") or any(wanted(name) for name, _ in APP): record("index_search", bench_index_search) # the app tier reuses the index
+        for name, fn in LOGIC:
+            if wanted(name) and name != "index_search": record(name, fn)
+        if any(wanted(name) for name, _ in APP):
+            os.environ["HOME"] = home # NoteShellApp keeps everything under ~/.notesshell
+            with open(os.path.join(home, ".notesshell", "config.json"), "w") as f: json.dump({"autosave": False}, f) # typed edits must not be written back to the fixture
+            try: root, app = start_app(ctx)
+            except Exception as e:
+                for name, _ in APP:
+                    if wanted(name): doc["skipped"][name] = f"cannot start the app ({type(e).__name__}: {e}); run under xvfb-run for this tier"
+            else:
+                try:
+                    for name, fn in APP:
+                        if wanted(name): record(name, fn, root, app)
+                finally:
+                    app.is_dirty = False; app.on_close()
+    finally:
+        if old_home is not None: os.environ["HOME"] = old_home
+        if args.keep: log(f"fixture kept in {home}")
+        else: shutil.rmtree(home, ignore_errors=True)
+    if not wanted("index_search"): doc["results"].pop("index_search", None)
+    doc["elapsed_s"] = round(time.perf_counter() - ctx.started, 1)
+    return doc
+
+
+def host_info():
+    try: commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count(), "commit": commit}
+
+
+def flatten(node, prefix=""):
+    """{path: number} for the timings (lower is better) and throughputs (higher is better) in a results tree."""
+    out = {}
+    for key, value in node.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict): out.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and (key == "median_ms" or key.endswith("_per_s")): out[path] = value
+    return out
+
+
+def compare(baseline, current, threshold):
+    """Prints every shared number that moved and returns the paths that got worse by more than threshold (a ratio)."""
+    old, new = flatten(baseline["results"]), flatten(current["results"]); regressions = []
+    for path in sorted(old.keys() & new.keys()):
+        a, b = old[path], new[path]
+        if not a or not b: continue
+        worse = b / a if path.endswith("median_ms") else a / b # > 1 means slower
+        flag = "REGRESSION" if worse > threshold else ("faster" if worse < 1 / threshold else "")
+        if flag == "REGRESSION": regressions.append(path)
+        log(f"{path:60s} {a:12.3f} -> {b:12.3f}  {1 / worse:6.2f}x {flag}")
+    for path in sorted(old.keys() - new.keys()): log(f"{path:60s} missing from this run")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=SIZES, help="note sizes for the preview and note-open benchmarks (default: %(default)s)")
+    parser.add_argument("--notes", type=int, default=100000, help="synthetic notes in the sidebar fixture (default: %(default)s)")
+    parser.add_argument("--stream", default="64M", help="bytes of shell output for the throughput runs (default: %(default)s)")
+    parser.add_argument("--echoes", type=int, default=50, help="lines per echo latency run (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per timing (default: %(default)s)")
+    parser.add_argument("--budget", type=float, default=30.0, help="seconds after which a timing stops repeating (default: %(default)s)")
+    parser.add_argument("--quick", action="store_true", help=f"smaller fixture for a fast check: {QUICK}")
+    parser.add_argument("--only", nargs="+", metavar="NAME", choices=[name for name, _ in LOGIC + APP], help="run only these benchmarks")
+    parser.add_argument("--out", metavar="FILE", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="--compare fails when something is this many times worse (default: %(default)s)")
+    parser.add_argument("--keep", action="store_true", help="keep the fixture directory")
+    args = parser.parse_args()
+    if args.quick:
+        for key, value in QUICK.items():
+            if getattr(args, key) == parser.get_default(key): setattr(args, key, value)
+    with contextlib.redirect_stdout(sys.stderr): doc = run_suite(args) # the app logs to stdout
+    text = json.dumps(doc, indent=2)
+    if args.out:
+        with open(args.out, "w") as f: f.write(text + "\n")
+        log(f"results written to {args.out}")
+    else: print(text)
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+        regressions = compare(baseline, doc, args.threshold)
+        if regressions: log(f"{len(regressions)} regression(s) beyond {args.threshold}x"); sys.exit(1)
+    if doc["errors"]: sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,2466 @@
 
 # version 1.0
 
+import time
+_STARTUP_T0 = time.perf_counter() # --profile-startup measures from here, before the remaining imports
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext, filedialog, colorchooser
-import os, sys, subprocess, signal, time
+import tkinter.font as tkfont
+import os, sys, subprocess, signal, errno
 import pty
-import threading, queue
-import markdown2
-from tkhtmlview import HTMLLabel
+import threading
+import selectors
+from collections import deque, namedtuple, OrderedDict
+import hashlib
+import bisect
+import ctypes, ctypes.util
+import struct
+from array import array
 import re
-import select
 # fcntl is Unix-specific, use conditionally
 if sys.platform != "win32":
-    import fcntl
-import string
+    import fcntl, termios
 import json
+import codecs
+import mmap
+import zlib
+import sqlite3
+from html import escape as html_escape
+from urllib.parse import quote, unquote
+
+CLEAR_SCREEN = object() # output marker: the shell asked for the screen to be cleared
+
+MARKDOWN_EXTRAS = ["fenced-code-blocks", "tables", "code-friendly", "footnotes"]
+
+PREVIEW_CSS_TEMPLATE = '' # formatted with size= and code_size=; shared by the live preview and --export
+
+TERMINAL_PALETTE = ("#000000", "#cd0000", "#00cd00", "#cdcd00", "#0000ee", "#cd00cd", "#00cdcd", "#e5e5e5", # xterm's 16 base colours
+                    "#7f7f7f", "#ff0000", "#00ff00", "#ffff00", "#5c5cff", "#ff00ff", "#00ffff", "#ffffff")
+
+OutputFrame = namedtuple("OutputFrame", "reset_line start_line text chars chunks dropped")
+
+
+def format_size(n):
+    for unit in ("B", "K", "M"):
+        if n < 1024: return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}G"
+
+
+def create_private(path):
+    """Creates path for writing, readable by the owner only; fails if it exists. For files holding terminal output."""
+    return os.fdopen(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0), 0o600), "wb")
+
+
+class StartupProfile:
+    """Wall-clock startup timeline for --profile-startup: mark(phase) records the time since the previous mark."""
+
+    def __init__(self, enabled=False, t0=_STARTUP_T0):
+        self.enabled = enabled
+        self.t0 = self.last = t0
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000, (now - self.t0) * 1000)); self.last = now
+
+    def report(self):
+        if not self.enabled: return
+        print("[+] Startup profile (ms):")
+        print(f"    {'phase':<28}{'took':>9}{'at':>9}")
+        for phase, took, at in self.phases: print(f"    {phase:<28}{took:9.1f}{at:9.1f}")
+
+
+class PtyIOLoop:
+    """One selector thread serving the PTY master fds of every shell session, at most one read per ready fd per pass so none starves.
+    Input goes through write(), a per-fd FIFO the loop drains while the PTY is writable. add(), remove() and write() may be called from any thread."""
+    MIN_CHUNK = 4096
+    MAX_CHUNK = 1 << 16
+    WRITE_CHUNK = 64 * 1024
+    WRITE_QUEUE_MAX = 64 << 20 # bytes pending per fd before write() refuses more
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False); os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._commands = deque()
+        self._buffer = bytearray(self.MAX_CHUNK)
+        self._view = memoryview(self._buffer)
+        self._stopping = False
+        self._thread = None
+        self._write_lock = threading.Lock()
+        self._writes = {} # fd -> [deque of memoryviews, bytes pending]; present only while bytes are pending
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, fd, on_data, on_eof=None, encoding="utf-8", on_raw=None):
+        """Starts reading fd; on_data gets decoded text, on_raw (if set) the bytes as read, and on_eof runs once after the fd is unregistered."""
+        stream = [fd, on_data, on_eof, codecs.getincrementaldecoder(encoding)(errors="replace"), self.MIN_CHUNK, on_raw]
+        self._command(("add", stream))
+        if self._thread is None: self._thread = threading.Thread(target=self._run, daemon=True, name="pty-io"); self._thread.start()
+
+    def remove(self, fd, on_removed=None):
+        """Stops reading fd. Returns at once; on_removed runs on the loop thread once the fd is unregistered."""
+        self._command(("remove", fd, on_removed))
+
+    def write(self, fd, data, force=False):
+        """Queues data for fd behind everything queued before it. Any thread; returns at once.
+        Returns False, queueing none of it, if that would put more than WRITE_QUEUE_MAX bytes in the queue, unless force is set."""
+        if not data: return True
+        with self._write_lock:
+            queue = self._writes.get(fd)
+            pending = queue[1] if queue is not None else 0
+            if pending + len(data) > self.WRITE_QUEUE_MAX and not force: return False
+            if queue is None: queue = self._writes[fd] = [deque(), 0]
+            queue[0].append(memoryview(data)); queue[1] += len(data)
+            arm = not pending # the queue was empty, so the loop is not watching fd for writability
+        if arm: self._command(("write", fd))
+        return True
+
+    def queued(self, fd):
+        """Bytes queued for fd that the PTY has not taken yet."""
+        queue = self._writes.get(fd)
+        return queue[1] if queue is not None else 0
+
+    def _command(self, command):
+        self._commands.append(command)
+        try: os.write(self._wake_w, b"x")
+        except OSError: pass # pipe full: the loop is awake already
+
+    def _apply_commands(self):
+        while self._commands:
+            command = self._commands.popleft()
+            if command[0] == "add":
+                stream = command[1]
+                try: self._selector.register(stream[0], selectors.EVENT_READ, stream)
+                except (KeyError, ValueError, OSError) as e: print(f"[!] Could not watch PTY fd {stream[0]}: {e}"); self._finish(stream)
+            elif command[0] == "write":
+                fd = command[1]
+                try: key = self._selector.get_key(fd)
+                except (KeyError, ValueError): self._drop_writes(fd); continue # removed or ended meanwhile
+                with self._write_lock:
+                    if fd in self._writes: self._selector.modify(fd, selectors.EVENT_READ | selectors.EVENT_WRITE, key.data)
+            else:
+                _, fd, on_removed = command
+                try: self._selector.unregister(fd)
+                except (KeyError, ValueError): pass
+                self._drop_writes(fd)
+                if on_removed: on_removed()
+
+    def _flush(self, fd, stream):
+        """Writes from the head of fd's queue; stops watching for writability once it is empty."""
+        with self._write_lock:
+            queue = self._writes.get(fd)
+            if queue is None: return
+            chunks = queue[0]; head = chunks[0]
+            try: n = os.write(fd, head[:self.WRITE_CHUNK])
+            except BlockingIOError: return
+            except OSError as e:
+                if e.errno not in (errno.EIO, errno.EBADF): print(f"OSError during write in I/O loop: {e}")
+                n = 0; chunks.clear(); queue[1] = 0 # the shell side is gone; the read side sees EOF
+            if n == len(head): chunks.popleft()
+            elif n: chunks[0] = head[n:]
+            queue[1] -= n; self.bytes_written += n
+            if not queue[1]: del self._writes[fd]; self._selector.modify(fd, selectors.EVENT_READ, stream)
+        if METRICS.enabled and n: METRICS.count("pty.writes"); METRICS.count("pty.write_bytes", n)
+
+    def _drop_writes(self, fd):
+        with self._write_lock: queue = self._writes.pop(fd, None)
+        if queue is not None and queue[1]: print(f"[-] Dropped {format_size(queue[1])} of input queued for PTY fd {fd}.")
+
+    def _finish(self, stream):
+        fd, on_data, on_eof, decoder = stream[:4]
+        self._drop_writes(fd)
+        tail = decoder.decode(b"", final=True) # a truncated character at EOF becomes U+FFFD
+        if tail: on_data(tail)
+        if on_eof: on_eof()
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                for key, events in self._selector.select():
+                    if key.fd == self._wake_r:
+                        try:
+                            while os.read(self._wake_r, 512): pass
+                        except OSError: pass
+                        continue
+                    if events & selectors.EVENT_WRITE: self._flush(key.fd, key.data)
+                    if not events & selectors.EVENT_READ: continue
+                    stream = key.data
+                    fd, on_data, _, decoder, chunk, on_raw = stream
+                    try: n = os.readv(fd, [self._view[:chunk]])
+                    except BlockingIOError: continue
+                    except OSError as e:
+                        if e.errno not in (errno.EIO, errno.EBADF): print(f"OSError during read in I/O loop: {e}")
+                        n = 0
+                    if not n: # EIO/EOF: the shell side is gone
+                        try: self._selector.unregister(fd)
+                        except (KeyError, ValueError): pass
+                        self._finish(stream); continue
+                    self.bytes_read += n
+                    if METRICS.enabled: METRICS.count("pty.reads"); METRICS.count("pty.read_bytes", n)
+                    if on_raw: on_raw(bytes(self._view[:n]))
+                    text = decoder.decode(self._view[:n])
+                    if text: on_data(text)
+                    if n == chunk and chunk < self.MAX_CHUNK: stream[4] = chunk << 1
+                    elif n < chunk >> 2 and chunk > self.MIN_CHUNK: stream[4] = chunk >> 1
+                self._apply_commands()
+        finally:
+            self._selector.close()
+            for fd in (self._wake_r, self._wake_w):
+                try: os.close(fd)
+                except OSError: pass
+
+    def close(self):
+        """Stops the loop thread. Registered fds stay open; they belong to the sessions."""
+        self._stopping = True
+        if self._thread is None: self._selector.close(); os.close(self._wake_r); os.close(self._wake_w); return
+        try: os.write(self._wake_w, b"x")
+        except OSError: pass
+        self._thread.join(timeout=1.0)
+
+
+class AnsiStripper:
+    """Streaming escape-sequence stripper for PTY output; only newlines and tabs survive among the control characters.
+    A sequence cut off at the end of a chunk is held back and completed by the next one."""
+    _SEQUENCE_RE = re.compile(
+        r"\x1b(?:\[[0-?]*[ -/]*[@-~]" # CSI
+        r"|\][^\x07\x1b]*(?:\x07|\x1b\\)" # OSC, ended by BEL or ST
+        r"|[PX^_][^\x1b]*\x1b\\" # DCS/SOS/PM/APC, ended by ST
+        r"|[ -/]*[0-~])") # two-byte escapes and charset selection
+    _CONTROL_TABLE = dict.fromkeys(c for c in [*range(0x00, 0x20), *range(0x7f, 0xa0)] if c not in (0x09, 0x0a)) # \r and stray ESC included
+    _CONTROL_RE = re.compile(r"[\x00-\x08\x0b-\x1f\x7f-\x9f]+") # same set; faster than translate() on non-ASCII text
+    _PARTIAL_RE = re.compile(r"\x1b(?:\[[0-?]*[ -/]*|[\]PX^_][^\x07\x1b]*|[ -/]*)\Z")
+    _PARTIAL_ST_RE = re.compile(r"\x1b[\]PX^_][^\x07\x1b]*\x1b\Z") # string sequence cut between ESC and \\
+    CLEAR_SEQUENCE = "\x1b[2J"
+    MAX_PENDING = 4096 # give up holding an unterminated sequence beyond this
+
+    def __init__(self):
+        self._pending = ""
+
+    def reset(self):
+        self._pending = ""
+
+    def feed(self, data):
+        """Strips one chunk. Returns a list of text pieces with CLEAR_SCREEN where the shell cleared the screen."""
+        if self._pending: data = self._pending + data; self._pending = ""
+        data = self._hold_incomplete(data)
+        if self.CLEAR_SEQUENCE not in data:
+            text = self._strip(data)
+            return [text] if text else []
+        items = []
+        for i, part in enumerate(data.split(self.CLEAR_SEQUENCE)):
+            if i: items.append(CLEAR_SCREEN)
+            text = self._strip(part)
+            if text: items.append(text)
+        return items
+
+    def _strip(self, data):
+        if "\x1b" in data: data = self._SEQUENCE_RE.sub("", data)
+        return data.translate(self._CONTROL_TABLE) if data.isascii() else self._CONTROL_RE.sub("", data)
+
+    def _hold_incomplete(self, data):
+        data, self._pending = split_incomplete_escape(data)
+        return data
+
+
+def split_incomplete_escape(data, max_pending=AnsiStripper.MAX_PENDING):
+    """Splits data into (complete, tail) where tail is an escape sequence cut off at the end of the chunk."""
+    i = data.rfind("\x1b")
+    if i < 0 or len(data) - i > max_pending: return data, ""
+    j = data.rfind("\x1b", 0, i)
+    if j >= 0 and len(data) - j <= max_pending and AnsiStripper._PARTIAL_ST_RE.match(data, j): return data[:j], data[j:]
+    if AnsiStripper._PARTIAL_RE.match(data, i): return data[:i], data[i:]
+    return data, ""
+
+
+class TerminalScreen:
+    """VT100/xterm screen model (cursor, scroll region, alternate screen, SGR) fed with decoded PTY output on the reader thread.
+    Lines scrolled off the main screen come back as history text; changed rows are kept for take_damage(). All access goes through lock."""
+    _TOKEN_RE = re.compile(
+        r"((?:[^\x00-\x1f\x7f-\x9f]*\r\n)+)" # whole lines, the bulk of streaming output
+        r"|[^\x00-\x1f\x7f-\x9f]+" # printable run
+        r"|\x1b\[([0-?]*)([ -/]*)([@-~])" # CSI: params, intermediates, final
+        r"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)" # OSC (titles), ignored
+        r"|\x1b[PX^_][^\x1b]*\x1b\\" # DCS/SOS/PM/APC, ignored
+        r"|\x1b([ -/]*)([0-~])" # two-byte escapes and charset designation
+        r"|[\x00-\x1f\x7f-\x9f]") # single control character
+    DEC_GRAPHICS = str.maketrans("`afgjklmnopqrstuvwxyz{|}~", "◆▒°±┘┐┌└┼⎺⎻─⎼⎽├┤┴┬│≤≥π≠£·")
+    BOLD, DIM, ITALIC, UNDERLINE, REVERSE = 1, 2, 4, 8, 16
+    TAB = 8
+    _BLANKS = [" "] * 1024
+    _TRAILING_BLANKS_RE = re.compile(r"[^\S\n]+\n")
+
+    def __init__(self, rows=24, cols=80):
+        self.lock = threading.Lock()
+        self.rows = max(1, rows); self.cols = max(1, cols)
+        self.attr_table = [(None, None, 0)] # attribute id -> (fg, bg, flags); fg/bg are None, a 0-255 palette index or "#rrggbb"
+        self._attr_ids = {(None, None, 0): 0}
+        self._sgr_cache = {} # (attr id, SGR params) -> attr id
+        self.replies = [] # strings to write back to the PTY
+        self._reset()
+
+    def reset(self):
+        with self.lock: self._reset()
+
+    def _reset(self):
+        self.main = self._blank_grid(); self.alt = None
+        self.grid = self.main
+        self.x = self.y = 0
+        self.attr = 0
+        self.top, self.bottom = 0, self.rows - 1
+        self.wrap_pending = False
+        self.autowrap = True
+        self.cursor_visible = True
+        self.charsets = ["B", "B"]; self.shift = 0 # G0/G1 designations, active set
+        self.saved = None
+        self.last_char = " "
+        self._pending = ""
+        self._history_partial = ""
+        self._history_rows = [] # (chars, wrapped) of rows scrolled off the main screen, joined once per feed()
+        self.dirty = set(range(self.rows))
+        self.full_redraw = True
+        self.scrolled = 0 # whole-screen scrolls since the last take_damage()
+        self._drawn_cursor = None
+
+    @property
+    def damaged(self): return self.full_redraw or bool(self.dirty) or bool(self.scrolled) or self._drawn_cursor != (self.y, self.x, self.cursor_visible)
+
+    def _blank_row(self, attr=0): return [[" "] * self.cols, [attr] * self.cols, False] # chars, attrs, wrapped into the next row
+    def _blank_grid(self): return [self._blank_row() for _ in range(self.rows)]
+
+    # input
+    def feed(self, data):
+        """Applies one chunk of decoded output. Returns history items (text, CLEAR_SCREEN) for the scrollback."""
+        with self.lock:
+            if self._pending: data = self._pending + data; self._pending = ""
+            data, self._pending = split_incomplete_escape(data)
+            out = []
+            for m in self._TOKEN_RE.finditer(data):
+                last = m.lastindex # 1: lines, 4: CSI, 6: two-byte escape, None: text, control, or an ignored string sequence
+                if last == 4: self._csi(*m.group(2, 3, 4), out)
+                elif last == 1: self._lines(m.group(1), out)
+                elif last == 6: self._esc(m.group(5), m.group(6), out)
+                else:
+                    token = m.group(); c = token[0]
+                    if c == "\r": self.x = 0; self.wrap_pending = False # CR and LF inline: one of each per line of output
+                    elif c == "\n": self._linefeed(out)
+                    elif c == "\x1b": continue
+                    elif c < " " or "\x7f" <= c <= "\x9f": self._control(c, out)
+                    else: self._print(token, out)
+            self._flush_history(out)
+            return out
+
+    def _flush_history(self, out):
+        rows = self._history_rows
+        if not rows: return
+        self._history_rows = []
+        if not self._history_partial and not any(wrapped for chars, wrapped in rows): # the usual case: whole lines, joined and trimmed in one go
+            out.append(self._TRAILING_BLANKS_RE.sub("\n", "\n".join(map("".join, [chars for chars, wrapped in rows])) + "\n")); return
+        parts = []
+        for chars, wrapped in rows:
+            if wrapped: self._history_partial += "".join(chars)
+            else: parts.append(self._history_partial + "".join(chars).rstrip() + "\n"); self._history_partial = ""
+        if parts: out.append("".join(parts))
+        if len(self._history_partial) > 65536: out.append(self._history_partial); self._history_partial = "" # a very long unbroken line
+
+    def _print(self, text, out):
+        if self.charsets[self.shift] == "0": text = text.translate(self.DEC_GRAPHICS)
+        self.last_char = text[-1]
+        cols = self.cols; attr = self.attr
+        while text:
+            if self.wrap_pending:
+                if self.autowrap: self.grid[self.y][2] = True; self._linefeed(out); self.x = 0
+                self.wrap_pending = False
+            row = self.grid[self.y]
+            space = cols - self.x
+            if not self.autowrap and len(text) > space: text = text[:space - 1] + text[-1]
+            chunk = text[:space]; text = text[space:]; n = len(chunk)
+            row[0][self.x:self.x + n] = chunk; row[1][self.x:self.x + n] = [attr] * n
+            self.dirty.add(self.y)
+            self.x += n
+            if self.x >= cols: self.x = cols - 1; self.wrap_pending = True
+
+    def _lines(self, text, out):
+        """Prints CRLF-terminated lines. Once the cursor is at the start of a fresh bottom row of a
+        plainly scrolling main screen, a screenful or more of further lines is laid out in one go:
+        only the last rows reach the grid, the rest go to history as they are."""
+        lines = text.split("\r\n"); lines.pop()
+        for i, line in enumerate(lines):
+            if i and fresh and len(lines) - i >= self.rows and self.grid is self.main and self.top == 0 and self.bottom == self.rows - 1 \
+                    and self.autowrap and self.charsets[self.shift] != "0": break
+            if line: self._print(line, out)
+            self.x = 0; fresh = self.y == self.bottom; self._linefeed(out)
+        else: return
+        rest = lines[i:]; rows, cols = self.rows, self.cols
+        segments = []; j = len(rest) # the rows the last lines take
+        while len(segments) < rows - 1: j -= 1; segments[:0] = self._wrap_line(rest[j])
+        history = self._history_rows
+        history += [(row[0], row[2]) for row in self.grid[:rows - 1]]
+        for line in rest[:j]:
+            if len(line) <= cols: history.append((line, False))
+            else: history += self._wrap_line(line)
+        history += segments[:len(segments) - rows + 1]
+        attr = self.attr; blank = self._erase_attr() if attr else 0
+        self.grid[:rows - 1] = [[list(seg) + [" "] * (cols - len(seg)), [attr] * len(seg) + [blank] * (cols - len(seg)), wrapped] for seg, wrapped in segments[len(segments) - rows + 1:]]
+        last = next((line for line in reversed(rest) if line), None)
+        if last: self.last_char = last[-1]
+        self.full_redraw = True # a screenful scrolled by
+
+    def _wrap_line(self, line):
+        """(text, wrapped) rows a line of printable text fills, as _print would wrap it."""
+        cols = self.cols
+        return [(line[k:k + cols], k + cols < len(line)) for k in range(0, len(line), cols)] or [("", False)]
+
+    def _control(self, c, out):
+        if c == "\n" or c == "\x0b" or c == "\x0c": self._linefeed(out)
+        elif c == "\r": self.x = 0; self.wrap_pending = False
+        elif c == "\x08": self.x = max(0, self.x - 1); self.wrap_pending = False
+        elif c == "\t": self.x = min(self.cols - 1, (self.x // self.TAB + 1) * self.TAB)
+        elif c == "\x0e": self.shift = 1
+        elif c == "\x0f": self.shift = 0
+        # BEL, NUL and the rest are ignored
+
+    def _linefeed(self, out):
+        self.wrap_pending = False
+        if self.y == self.bottom: self._scroll_up(1, out)
+        elif self.y < self.rows - 1: self.y += 1
+
+    def _scroll_up(self, n, out=None):
+        top, bottom = self.top, self.bottom; n = min(n, bottom - top + 1)
+        grid = self.grid; cols = self.cols; blank = self._erase_attr() if self.attr else 0
+        gone = grid[top:top + n]; del grid[top:top + n]
+        if top == 0 and grid is self.main and out is not None: self._history_rows += [(row[0], row[2]) for row in gone]
+        for row in gone: # the scrolled-off rows come back blank at the bottom
+            row[0] = self._BLANKS[:cols] if cols <= len(self._BLANKS) else [" "] * cols; row[1] = [blank] * cols; row[2] = False
+        grid[bottom + 1 - n:bottom + 1 - n] = gone
+        if top == 0 and bottom == self.rows - 1 and not self.full_redraw and self.scrolled + n < self.rows:
+            # the whole screen moved: the renderer drops its top rows and appends new ones, so only the rows already changed follow them up
+            self.scrolled += n
+            if len(self.dirty) < self.rows: self.dirty = {y - n for y in self.dirty if y >= n}
+            self.dirty.update(range(self.rows - n, self.rows))
+        elif top == 0 and bottom == self.rows - 1: self.full_redraw = True
+        else: self.dirty.update(range(top, bottom + 1))
+
+    def _scroll_down(self, n):
+        top, bottom = self.top, self.bottom; n = min(n, bottom - top + 1)
+        blank = self._erase_attr()
+        self.grid[top:bottom + 1] = [self._blank_row(blank) for _ in range(n)] + self.grid[top:bottom + 1 - n]
+        self.dirty.update(range(top, bottom + 1))
+
+    def _erase_attr(self):
+        fg, bg, flags = self.attr_table[self.attr]
+        return self._intern((None, bg, 0)) if bg is not None else 0 # erased cells keep the background colour, like xterm
+
+    def _erase(self, y, x0, x1):
+        row = self.grid[y]; attr = self._erase_attr() if self.attr else 0; n = max(0, x1 - x0)
+        row[0][x0:x1] = self._BLANKS[:n] if n <= len(self._BLANKS) else [" "] * n; row[1][x0:x1] = [attr] * n
+        if x1 >= self.cols: row[2] = False
+        self.dirty.add(y)
+
+    def _esc(self, intermediate, final, out):
+        if intermediate in ("(", ")"): self.charsets[0 if intermediate == "(" else 1] = final; return
+        if intermediate: return
+        if final == "7": self._save_cursor()
+        elif final == "8": self._restore_cursor()
+        elif final == "D": self._linefeed(out)
+        elif final == "E": self._linefeed(out); self.x = 0
+        elif final == "M": # reverse index
+            self.wrap_pending = False
+            if self.y == self.top: self._scroll_down(1)
+            elif self.y > 0: self.y -= 1
+        elif final == "c": self._reset(); out.append(CLEAR_SCREEN)
+        # keypad modes (= >) and the rest are ignored
+
+    def _save_cursor(self): self.saved = (self.x, self.y, self.attr, self.wrap_pending, list(self.charsets), self.shift)
+
+    def _restore_cursor(self):
+        if not self.saved: self.x = self.y = 0; return
+        x, y, self.attr, self.wrap_pending, charsets, self.shift = self.saved
+        self.charsets = list(charsets); self.x = min(x, self.cols - 1); self.y = min(y, self.rows - 1)
+
+    def _csi(self, params, intermediate, final, out):
+        if final == "m" and not intermediate: # SGR is most of what a coloured stream sends
+            cached = self._sgr_cache.get((self.attr, params))
+            if cached is not None: self.attr = cached; return
+        elif final == "K" and not params: self.wrap_pending = False; self._erase(self.y, self.x, self.cols); return # erase to end of line, sent after most coloured runs
+        private = params[:1] if params[:1] in ("?", ">", "<", "=") else ""
+        if private: params = params[1:]
+        try: args = [int(p) if p else 0 for p in params.replace(":", ";").split(";")] if params else []
+        except ValueError: return
+        if intermediate: return # DECSCUSR (cursor style) and friends
+        def arg(i=0, default=1):
+            return args[i] if len(args) > i and args[i] else default
+        if final != "m" and final != "h" and final != "l": self.wrap_pending = False
+        if private == "?":
+            if final in "hl": self._private_mode(args, final == "h")
+            return
+        if private == ">":
+            if final == "c": self.replies.append("\x1b[>0;0;0c")
+            return
+        if final == "m":
+            self._sgr(args)
+            if len(self._sgr_cache) > 4096: self._sgr_cache.clear()
+            self._sgr_cache[(self._sgr_from, params)] = self.attr
+        elif final in "Hf": self.y = min(arg(0) - 1, self.rows - 1); self.x = min(arg(1) - 1, self.cols - 1)
+        elif final == "A": self.y = max(self.top if self.y >= self.top else 0, self.y - arg())
+        elif final == "B": self.y = min(self.bottom if self.y <= self.bottom else self.rows - 1, self.y + arg())
+        elif final in "Ca": self.x = min(self.cols - 1, self.x + arg())
+        elif final == "D": self.x = max(0, self.x - arg())
+        elif final == "E": self.y = min(self.rows - 1, self.y + arg()); self.x = 0
+        elif final == "F": self.y = max(0, self.y - arg()); self.x = 0
+        elif final in "G`": self.x = min(arg() - 1, self.cols - 1)
+        elif final == "d": self.y = min(arg() - 1, self.rows - 1)
+        elif final == "J": self._erase_display(arg(0, 0), out)
+        elif final == "K":
+            mode = arg(0, 0)
+            if mode == 0: self._erase(self.y, self.x, self.cols)
+            elif mode == 1: self._erase(self.y, 0, self.x + 1)
+            else: self._erase(self.y, 0, self.cols)
+        elif final == "X": self._erase(self.y, self.x, min(self.cols, self.x + arg()))
+        elif final == "@": self._shift_cells(arg(), insert=True)
+        elif final == "P": self._shift_cells(arg(), insert=False)
+        elif final in "LM":
+            if self.top <= self.y <= self.bottom:
+                top = self.top; self.top = self.y
+                if final == "L": self._scroll_down(arg())
+                else: self._scroll_up(arg())
+                self.top = top; self.x = 0
+        elif final == "S": self._scroll_up(arg(), out)
+        elif final == "T": self._scroll_down(arg())
+        elif final == "b": self._print(self.last_char * min(arg(), self.cols * self.rows), out)
+        elif final == "r":
+            top, bottom = arg(0) - 1, arg(1, self.rows) - 1
+            if 0 <= top < bottom < self.rows: self.top, self.bottom = top, bottom; self.x = self.y = 0
+        elif final == "s": self._save_cursor()
+        elif final == "u": self._restore_cursor()
+        elif final == "n":
+            if arg(0, 0) == 6: self.replies.append(f"\x1b[{self.y + 1};{self.x + 1}R")
+            elif arg(0, 0) == 5: self.replies.append("\x1b[0n")
+        elif final == "c": self.replies.append("\x1b[?1;2c")
+        # window ops (t), modes without ? (h/l) and the rest are ignored
+
+    def _erase_display(self, mode, out):
+        if mode == 0:
+            self._erase(self.y, self.x, self.cols)
+            for y in range(self.y + 1, self.rows): self._erase(y, 0, self.cols)
+        elif mode == 1:
+            for y in range(0, self.y): self._erase(y, 0, self.cols)
+            self._erase(self.y, 0, self.x + 1)
+        elif mode == 2:
+            for y in range(self.rows): self._erase(y, 0, self.cols)
+        elif mode == 3: out.append(CLEAR_SCREEN); self._history_partial = ""; self._history_rows = [] # clear scrollback (clear(1) sends it)
+
+    def _shift_cells(self, n, insert):
+        row = self.grid[self.y]; n = min(n, self.cols - self.x); attr = self._erase_attr()
+        for cells, fill in ((row[0], " "), (row[1], attr)):
+            if insert: cells[self.x:self.x] = [fill] * n; del cells[self.cols:]
+            else: del cells[self.x:self.x + n]; cells.extend([fill] * n)
+        self.dirty.add(self.y)
+
+    def _private_mode(self, args, on):
+        for mode in args:
+            if mode == 25: self.cursor_visible = on; self.dirty.add(self.y)
+            elif mode == 7: self.autowrap = on
+            elif mode in (47, 1047, 1049):
+                if on and self.grid is self.main:
+                    if mode == 1049: self._save_cursor()
+                    self.alt = self._blank_grid(); self.grid = self.alt
+                elif not on and self.grid is not self.main:
+                    self.grid = self.main; self.alt = None
+                    if mode == 1049: self._restore_cursor()
+                self.full_redraw = True; self.dirty.update(range(self.rows))
+            # bracketed paste (2004), application cursor keys (1), mouse modes and the rest are ignored
+
+    def _intern(self, attr):
+        attr_id = self._attr_ids.get(attr)
+        if attr_id is None:
+            if len(self.attr_table) >= 4096: self._sgr_cache.clear(); return 0 # truecolor gradients; fall back to default rather than grow without bound
+            attr_id = self._attr_ids[attr] = len(self.attr_table); self.attr_table.append(attr)
+        return attr_id
+
+    def _sgr(self, args):
+        self._sgr_from = self.attr
+        fg, bg, flags = self.attr_table[self.attr]
+        args = args or [0]; i = 0
+        while i < len(args):
+            a = args[i]
+            if a == 0: fg, bg, flags = None, None, 0
+            elif a == 1: flags |= self.BOLD
+            elif a == 2: flags |= self.DIM
+            elif a == 3: flags |= self.ITALIC
+            elif a == 4: flags |= self.UNDERLINE
+            elif a == 7: flags |= self.REVERSE
+            elif a == 22: flags &= ~(self.BOLD | self.DIM)
+            elif a == 23: flags &= ~self.ITALIC
+            elif a == 24: flags &= ~self.UNDERLINE
+            elif a == 27: flags &= ~self.REVERSE
+            elif 30 <= a <= 37: fg = a - 30
+            elif 40 <= a <= 47: bg = a - 40
+            elif 90 <= a <= 97: fg = a - 82
+            elif 100 <= a <= 107: bg = a - 92
+            elif a == 39: fg = None
+            elif a == 49: bg = None
+            elif a in (38, 48) and i + 1 < len(args):
+                color = None
+                if args[i + 1] == 5 and i + 2 < len(args): color = args[i + 2] & 0xff; i += 2
+                elif args[i + 1] == 2 and i + 4 < len(args): color = "#%02x%02x%02x" % tuple(min(255, v) for v in args[i + 2:i + 5]); i += 4
+                else: i += 1
+                if a == 38: fg = color
+                else: bg = color
+            i += 1
+        self.attr = self._intern((fg, bg, flags))
+
+    # size
+    def resize(self, rows, cols, out=None):
+        """Resizes the grid; rows pushed off the top of the main screen go to out as history."""
+        rows = max(1, rows); cols = max(1, cols)
+        with self.lock:
+            if (rows, cols) == (self.rows, self.cols): return
+            excess = self.y - rows + 1
+            if excess > 0: # keep the cursor row on screen, like xterm
+                self.top, self.bottom = 0, self.rows - 1
+                self._scroll_up(excess, out); self.y -= excess
+                if out is not None: self._flush_history(out)
+            for grid in (self.main, self.alt):
+                if grid is None: continue
+                for row in grid:
+                    if cols < self.cols: del row[0][cols:]; del row[1][cols:]; row[2] = False
+                    elif cols > self.cols: row[0].extend([" "] * (cols - self.cols)); row[1].extend([0] * (cols - self.cols))
+                del grid[rows:]
+            self.rows, self.cols = rows, cols
+            for grid in (self.main, self.alt):
+                if grid is not None: grid.extend(self._blank_row() for _ in range(rows - len(grid)))
+            self.top, self.bottom = 0, rows - 1
+            self.x = min(self.x, cols - 1); self.y = min(max(self.y, 0), rows - 1); self.wrap_pending = False
+            self.full_redraw = True; self.dirty = set(range(rows))
+
+    # output
+    def take_damage(self):
+        """Returns (full, scrolled, {row: [(text, attr_id), ...]}, cursor) for rows changed since the last call, and clears the damage.
+        Unless full, the renderer drops its top scrolled rows and appends as many blank ones before redrawing the rows given."""
+        with self.lock:
+            full = self.full_redraw; self.full_redraw = False
+            scrolled = 0 if full else self.scrolled; self.scrolled = 0
+            if self._drawn_cursor and 0 <= self._drawn_cursor[0] - scrolled < self.rows: self.dirty.add(self._drawn_cursor[0] - scrolled) # old cursor row may carry padding
+            self.dirty.add(self.y) # the cursor may sit past the end of the text
+            rows = range(self.rows) if full else sorted(self.dirty)
+            self.dirty = set(); self._drawn_cursor = (self.y, self.x, self.cursor_visible)
+            damage = {}
+            for y in rows:
+                chars, attrs, _ = self.grid[y]
+                end = len(chars)
+                while end > 0 and chars[end - 1] == " " and attrs[end - 1] == 0: end -= 1
+                if y == self.y: end = max(end, self.x + 1)
+                runs = []; start = 0
+                for x in range(1, end + 1):
+                    if x == end or attrs[x] != attrs[start]: runs.append(("".join(chars[start:x]), attrs[start])); start = x
+                damage[y] = runs
+            cursor = (self.y, self.x) if self.cursor_visible else None
+            return full, scrolled, damage, cursor
+
+    @staticmethod
+    def color_hex(color):
+        """xterm palette index (or an already resolved "#rrggbb") to a Tk colour."""
+        if isinstance(color, str): return color
+        if color < 16: return TERMINAL_PALETTE[color]
+        if color < 232:
+            r, g, b = (color - 16) // 36, (color - 16) // 6 % 6, (color - 16) % 6
+            return "#%02x%02x%02x" % tuple(0 if v == 0 else 55 + 40 * v for v in (r, g, b))
+        level = 8 + 10 * (color - 232)
+        return "#%02x%02x%02x" % (level, level, level)
+
+    def mark_all_dirty(self):
+        with self.lock: self.full_redraw = True; self.dirty = set(range(self.rows))
+
+    def text(self):
+        """The visible screen as plain text, for tests and copying."""
+        with self.lock: return "\n".join("".join(row[0]).rstrip() for row in self.grid)
+
+
+def atomic_write(path, text, durable=True):
+    """Writes text to path via a temp file, fsync and rename, so a crash leaves the old or the new file, never half of one.
+    durable=False skips the fsyncs: readers still never see a partial file, but a power loss may lose the write."""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+            if durable: f.flush(); os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+    if durable and sys.platform != "win32":
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try: os.fsync(dir_fd) # make the rename itself durable
+            finally: os.close(dir_fd)
+        except OSError: pass
+
+
+def common_affix_lengths(old, new):
+    """Lengths of the common prefix and (non-overlapping) common suffix of two strings."""
+    limit = min(len(old), len(new)); step = 4096; prefix = 0
+    while prefix + step <= limit and old[prefix:prefix + step] == new[prefix:prefix + step]: prefix += step
+    while prefix < limit and old[prefix] == new[prefix]: prefix += 1
+    limit -= prefix; suffix = 0
+    while suffix + step <= limit and old[len(old) - suffix - step:len(old) - suffix] == new[len(new) - suffix - step:len(new) - suffix]: suffix += step
+    while suffix < limit and old[len(old) - suffix - 1] == new[len(new) - suffix - 1]: suffix += 1
+    return prefix, suffix
+
+
+class TkWakeup:
+    """Lets worker threads schedule a callback on the Tk thread without calling into Tk.
+    notify() is cheap and coalescing: however often it is called, the callback runs once."""
+    POLL_MS = 50
+
+    def __init__(self, root, callback):
+        self.root = root
+        self.callback = callback
+        self._pending = threading.Event()
+        self._r = self._w = None
+        self._poll_id = None
+        if sys.platform != "win32" and hasattr(root.tk, "createfilehandler"):
+            self._r, self._w = os.pipe()
+            os.set_blocking(self._r, False); os.set_blocking(self._w, False)
+            root.tk.createfilehandler(self._r, tk.READABLE, self._on_readable)
+        else: self._poll_id = root.after(self.POLL_MS, self._poll)
+
+    def notify(self):
+        """Requests a callback on the Tk thread. Safe to call from any thread."""
+        if self._pending.is_set(): return
+        self._pending.set()
+        if self._w is not None:
+            try: os.write(self._w, b"x")
+            except OSError: pass
+
+    def _on_readable(self, fd, mask):
+        try:
+            while os.read(fd, 512): pass
+        except OSError: pass
+        self._fire()
+
+    def _poll(self):
+        self._poll_id = None
+        if self._pending.is_set(): self._fire()
+        if self.callback: self._poll_id = self.root.after(self.POLL_MS, self._poll)
+
+    def _fire(self):
+        self._pending.clear()
+        try: self.callback()
+        except Exception as e: print(f"[!] Error in wakeup callback: {e}")
+
+    def close(self):
+        if self._poll_id is not None:
+            try: self.root.after_cancel(self._poll_id)
+            except tk.TclError: pass
+            self._poll_id = None
+        if self._r is not None:
+            try: self.root.tk.deletefilehandler(self._r)
+            except tk.TclError: pass
+            for fd in (self._r, self._w):
+                try: os.close(fd)
+                except OSError: pass
+            self._r = self._w = None
+        self.callback = None
+
+
+class RenderStats:
+    """Throughput counters for the terminal render pipeline (Tk thread only)."""
+
+    def __init__(self): self.reset()
+
+    def reset(self):
+        self.frames = 0; self.chars = 0; self.chunks = 0
+        self.coalesced = 0 # chunks merged into another chunk's insert
+        self.dropped = 0 # chunks discarded without being shown (cleared before display)
+        self.chars_per_sec = 0.0
+        self._window_start = time.monotonic(); self._window_chars = 0
+
+    def record_frame(self, chars, chunks):
+        self.frames += 1; self.chars += chars; self.chunks += chunks
+        self.coalesced += max(0, chunks - 1)
+        self._window_chars += chars
+        now = time.monotonic(); elapsed = now - self._window_start
+        if elapsed >= 1.0: self.chars_per_sec = self._window_chars / elapsed; self._window_start = now; self._window_chars = 0
+
+    def snapshot(self):
+        return {"frames": self.frames, "chars": self.chars, "chunks": self.chunks, "coalesced": self.coalesced, "dropped": self.dropped, "chars_per_sec": round(self.chars_per_sec, 1)}
+
+
+class _MetricsTimer:
+    __slots__ = ("metrics", "name", "t0")
+
+    def __init__(self, metrics, name): self.metrics = metrics; self.name = name
+
+    def __enter__(self): self.t0 = time.perf_counter(); return self
+
+    def __exit__(self, *exc): self.metrics.observe(self.name, time.perf_counter() - self.t0)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc): return None
+
+
+class Metrics:
+    """Process-wide counters, gauges and latency histograms for the hot paths (any thread); off by default, each call then costs one attribute check.
+    Histograms count durations in power-of-two microsecond buckets, so percentiles are upper bounds within 2x."""
+    BUCKETS = 32 # bucket b holds durations below 2**b microseconds; the last one is open-ended
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}; self.gauges = {}
+            self.histograms = {} # name -> [count, total seconds, max seconds, bucket counts]
+            self.started = time.monotonic()
+
+    def count(self, name, n=1):
+        if not self.enabled: return
+        with self._lock: self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        if self.enabled: self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        if not self.enabled: return
+        bucket = min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)
+        with self._lock:
+            h = self.histograms.get(name)
+            if h is None: h = self.histograms[name] = [0, 0.0, 0.0, array('Q', bytes(8 * self.BUCKETS))]
+            h[0] += 1; h[1] += seconds; h[3][bucket] += 1
+            if seconds > h[2]: h[2] = seconds
+
+    def time(self, name):
+        """Context manager recording the duration of its block into histogram name."""
+        return _MetricsTimer(self, name) if self.enabled else _NULL_TIMER
+
+    @classmethod
+    def _summarize(cls, count, total, peak, buckets):
+        out = {"count": count, "mean_ms": round(1000.0 * total / count, 3) if count else 0.0, "max_ms": round(1000.0 * peak, 3)}
+        for label, q in (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+            rank = q * count; seen = 0
+            for b, n in enumerate(buckets):
+                seen += n
+                if n and seen >= rank: out[label] = round(min((1 << b) / 1000.0, 1000.0 * peak), 3); break
+            else: out[label] = 0.0
+        return out
+
+    def snapshot(self, since=None):
+        """JSON-ready dict of everything recorded. Rates are per second since the snapshot passed as since (else since reset)."""
+        now = time.monotonic()
+        with self._lock:
+            counters = dict(self.counters); gauges = dict(self.gauges)
+            hists = {name: (h[0], h[1], h[2], list(h[3])) for name, h in self.histograms.items()}
+        if since is not None and since.get("uptime_s", 0) <= now - self.started: base, elapsed = since["counters"], now - self.started - since["uptime_s"]
+        else: base, elapsed = {}, now - self.started
+        elapsed = max(elapsed, 1e-6)
+        return {"enabled": self.enabled, "uptime_s": round(now - self.started, 3), "interval_s": round(elapsed, 3),
+                "counters": counters, "rates_per_s": {k: round((v - base.get(k, 0)) / elapsed, 1) for k, v in counters.items()},
+                "gauges": gauges, "latency_ms": {name: self._summarize(*h) for name, h in sorted(hists.items())}}
+
+    @staticmethod
+    def summary_line(snap):
+        """One-line digest of a snapshot for the periodic log."""
+        parts = [f"{k} {v:g}/s" for k, v in sorted(snap["rates_per_s"].items()) if v]
+        parts += [f"{k}={v}" for k, v in sorted(snap["gauges"].items())]
+        parts += [f"{k} p95 {h['p95_ms']:g}ms max {h['max_ms']:g}ms n={h['count']}" for k, h in snap["latency_ms"].items()]
+        return " | ".join(parts) or "no samples"
+
+
+_NULL_TIMER = _NullTimer()
+METRICS = Metrics()
+
+
+class ScrollbackBuffer:
+    """Line-indexed history of terminal output, kept off the Tk widget in blocks of BLOCK_LINES lines.
+    Line 0 is the first line ever appended; with spill_path, blocks dropped from memory can be paged back from disk."""
+    BLOCK_LINES = 256
+
+    def __init__(self, max_bytes, spill_path=None):
+        self.max_bytes = max_bytes
+        self.line_count = 0 # completed lines appended so far
+        self._blocks = deque() # sealed blocks still held in memory
+        self._bytes = 0
+        self._first_block = 0 # absolute block number of self._blocks[0]
+        self._open = [] # completed lines of the block being filled
+        self._partial = "" # trailing text not terminated by a newline yet
+        self._lock = threading.Lock() # appended to by the reader thread when output overflows (see OutputBuffer)
+        self.spill_path = spill_path
+        self._spill = None
+        self._spill_size = 0
+        self._spill_index = array('Q') # file offset of each sealed block
+        if spill_path:
+            try:
+                os.makedirs(os.path.dirname(spill_path), mode=0o700, exist_ok=True)
+                if os.path.exists(spill_path): os.remove(spill_path) # left behind by a crash
+                self._spill = create_private(spill_path)
+                self._spill_reader = open(spill_path, "rb")
+                if sys.platform != "win32": os.remove(spill_path) # read and written through the open handles only, so nothing is left on disk
+            except OSError as e: print(f"[!] Could not open scrollback spill file: {e}"); self._spill = None
+
+    @property
+    def first_line(self):
+        """Oldest line that can still be retrieved."""
+        return 0 if self._spill else self._first_block * self.BLOCK_LINES
+
+    @property
+    def partial(self):
+        """Text after the last newline, not yet a completed line."""
+        with self._lock: return self._partial
+
+    def append(self, text):
+        if not text: return
+        with self._lock: self._append(text)
+
+    def _append(self, text):
+        parts = (self._partial + text).split("\n")
+        self._partial = parts.pop()
+        if not parts: return
+        self.line_count += len(parts)
+        i = 0
+        while i < len(parts):
+            take = self.BLOCK_LINES - len(self._open)
+            self._open.extend(parts[i:i + take]); i += take
+            if len(self._open) == self.BLOCK_LINES: self._seal()
+
+    def _seal(self):
+        block = "\n".join(self._open); self._open = []
+        self._blocks.append(block); self._bytes += len(block)
+        if self._spill:
+            try:
+                data = (block + "\n").encode("utf-8", errors="replace")
+                self._spill.write(data); self._spill_index.append(self._spill_size); self._spill_size += len(data)
+            except OSError as e: print(f"[!] Scrollback spill failed, continuing in memory only: {e}"); self._close_spill()
+        while self._bytes > self.max_bytes and len(self._blocks) > 1:
+            self._bytes -= len(self._blocks.popleft()); self._first_block += 1
+
+    def _block_lines(self, block_no):
+        sealed = self._first_block + len(self._blocks)
+        if block_no == sealed: return self._open
+        if self._first_block <= block_no < sealed: return self._blocks[block_no - self._first_block].split("\n")
+        if self._spill and 0 <= block_no < len(self._spill_index):
+            self._spill.flush()
+            start = self._spill_index[block_no]
+            end = self._spill_index[block_no + 1] if block_no + 1 < len(self._spill_index) else self._spill_size
+            self._spill_reader.seek(start)
+            return self._spill_reader.read(end - start)[:-1].decode("utf-8", errors="replace").split("\n")
+        return []
+
+    def get_lines(self, start, end):
+        """Returns completed lines [start, end), clipped to what is still available."""
+        with self._lock: return self._get_lines(start, end)
+
+    def _get_lines(self, start, end):
+        line = max(start, self.first_line); end = min(end, self.line_count)
+        out = []
+        while line < end:
+            block_no, lo = divmod(line, self.BLOCK_LINES)
+            lines = self._block_lines(block_no)
+            hi = min(end - block_no * self.BLOCK_LINES, len(lines))
+            if hi <= lo: break
+            out.extend(lines[lo:hi]); line = block_no * self.BLOCK_LINES + hi
+        return out
+
+    SEARCH_READ_BYTES = 4 << 20 # spilled blocks are read back for a search in runs of about this size
+
+    def search(self, regex, start=0, end=None, cancelled=None, fold_case=False):
+        """Absolute numbers of the completed lines in [start, end) that compiled regex matches, in order, as array('Q'). Any thread.
+        fold_case lowercases the text first, for a lowercase regex; returns None if cancelled() turns true between blocks."""
+        with self._lock:
+            end = self.line_count if end is None else min(end, self.line_count)
+            first_block, blocks, open_lines = self._first_block, list(self._blocks), list(self._open)
+            spill_index, spill_size, spill_fd = array('Q'), 0, None
+            if self._spill:
+                try: self._spill.flush(); spill_index, spill_size, spill_fd = self._spill_index[:], self._spill_size, self._spill_reader.fileno()
+                except (OSError, ValueError): pass
+        start = max(start, 0 if spill_fd is not None else first_block * self.BLOCK_LINES)
+        found = array('Q'); block_no = start // self.BLOCK_LINES; last_block = (end - 1) // self.BLOCK_LINES
+        while block_no <= last_block:
+            if cancelled is not None and cancelled(): return None
+            if block_no < first_block: # spilled only: read a run of blocks at once
+                stop = bisect.bisect_left(spill_index, spill_index[block_no] + self.SEARCH_READ_BYTES, block_no + 1, first_block)
+                stop = min(max(stop, block_no + 1), first_block, last_block + 1)
+                offset = spill_index[block_no]; size = (spill_index[stop] if stop < len(spill_index) else spill_size) - offset
+                try: text = os.pread(spill_fd, size, offset)[:-1].decode("utf-8", errors="replace")
+                except OSError as e: print(f"[-] Scrollback search could not read the spill file: {e}"); block_no = first_block; continue
+                count = stop - block_no
+            else:
+                i = block_no - first_block
+                text = blocks[i] if i < len(blocks) else "\n".join(open_lines); count = 1
+            if fold_case: text = text.lower()
+            line = block_no * self.BLOCK_LINES; pos = 0; search = regex.search
+            while True:
+                m = search(text, pos)
+                if m is None: break
+                line += text.count("\n", pos, m.start())
+                if line >= end: break
+                if line >= start: found.append(line)
+                pos = text.find("\n", m.start()) + 1 # the rest of the line cannot add a line number
+                if not pos: break
+                line += 1
+            block_no += count
+        return found
+
+    def _close_spill(self):
+        for f in (self._spill, getattr(self, "_spill_reader", None)):
+            if f:
+                try: f.close()
+                except OSError: pass
+        self._spill = None
+
+    def close(self):
+        """Drops the spill file; it is a paging cache, not a transcript."""
+        had_spill = self._spill is not None
+        self._close_spill()
+        if had_spill:
+            try: os.remove(self.spill_path)
+            except OSError: pass
+
+
+class OutputBuffer:
+    """Bounded hand-off from the reader thread to the render pipeline. Past max_chars the oldest output is dropped ('tail')
+    or moved into the scrollback history ('spill'); take() appends what it hands out to the history, in order."""
+    SEGMENT_CHARS = 64 * 1024
+    OVERFLOW_POLICIES = ("tail", "spill")
+
+    def __init__(self, history, max_chars, overflow="tail"):
+        self.history = history
+        self.max_chars = max_chars
+        self.overflow = overflow if overflow in self.OVERFLOW_POLICIES else "tail"
+        self._lock = threading.Lock()
+        self._items = deque() # [parts, chars] segments and CLEAR_SCREEN markers
+        self.pending_chars = 0
+        self.unseen_chars = 0 # received since mark_seen(), for the unread indicator
+        self.dropped_chars = 0 # lost to the 'tail' policy, total
+        self._gap_chars = 0 # overflowed since the last take()
+
+    @property
+    def pending(self): return bool(self._items) or self._gap_chars > 0
+
+    def put(self, item):
+        """Queues decoded text or CLEAR_SCREEN. Called from the reader thread."""
+        with self._lock:
+            if item is CLEAR_SCREEN: self._items.append(CLEAR_SCREEN); return
+            n = len(item)
+            last = self._items[-1] if self._items else CLEAR_SCREEN
+            if last is not CLEAR_SCREEN and last[1] < self.SEGMENT_CHARS: last[0].append(item); last[1] += n
+            else: self._items.append([[item], n])
+            self.pending_chars += n; self.unseen_chars += n
+            if self.pending_chars > self.max_chars: self._overflow()
+
+    def _overflow(self):
+        while self.pending_chars > self.max_chars and len(self._items) > 1:
+            item = self._items.popleft()
+            if item is CLEAR_SCREEN: continue # the widget is reset after a gap anyway
+            self.pending_chars -= item[1]; self._gap_chars += item[1]
+            if self.overflow == "spill": self.history.append("".join(item[0]))
+            else: self.dropped_chars += item[1]
+
+    def take(self, max_chars=None):
+        """Hands out pending output (about max_chars of it, or all) as an OutputFrame, or None. reset_line is set when the widget
+        must be cleared first, to the history line it then starts at; start_line is the history line the text begins on."""
+        with self._lock:
+            if not self.pending: return None
+            reset_line = None; parts = []; chars = chunks = dropped = 0
+            start_line = self.history.line_count
+            if self._gap_chars:
+                if self.overflow == "spill": notice = f"\n[... {format_size(self._gap_chars)} of earlier output moved to scrollback (Ctrl+PageUp) ...]\n"
+                else: notice = f"\n[... {format_size(self._gap_chars)} of output dropped ...]\n"
+                reset_line = start_line; self._gap_chars = 0
+                self.history.append(notice); parts.append(notice)
+            while self._items and (max_chars is None or chars < max_chars):
+                item = self._items.popleft()
+                if item is CLEAR_SCREEN:
+                    dropped += len(parts); parts = []
+                    reset_line = start_line = self.history.line_count
+                    continue
+                text = "".join(item[0]); self.pending_chars -= item[1]
+                self.history.append(text); parts.append(text)
+                chars += item[1]; chunks += len(item[0])
+            return OutputFrame(reset_line, start_line, "".join(parts), chars, chunks, dropped)
+
+    def mark_seen(self):
+        with self._lock: self.unseen_chars = 0
+
+
+class ScrollbackSearchWorker:
+    """Runs ScrollbackBuffer.search on a background thread; only the newest request matters, an older scan is abandoned between blocks.
+    on_result(scrollback, lines, start, end, elapsed_ms) is called on the Tk thread."""
+
+    def __init__(self, root, on_result):
+        self.on_result = on_result
+        self._cond = threading.Condition()
+        self._request = None # (generation, scrollback, regex, fold_case, start, end)
+        self._result = None
+        self.generation = 0
+        self._closed = False
+        self._wakeup = TkWakeup(root, self._deliver)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="scrollback-search")
+        self._thread.start()
+
+    def submit(self, scrollback, regex, fold_case, start, end):
+        """Queues a search of lines [start, end), superseding any pending or running one. Tk thread."""
+        with self._cond:
+            self.generation += 1
+            self._request = (self.generation, scrollback, regex, fold_case, start, end)
+            self._cond.notify()
+        return self.generation
+
+    def cancel(self):
+        with self._cond: self.generation += 1; self._request = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._request is None and not self._closed: self._cond.wait()
+                if self._closed: return
+                generation, scrollback, regex, fold_case, start, end = self._request; self._request = None
+            t0 = time.perf_counter()
+            try: lines = scrollback.search(regex, start, end, cancelled=lambda: self.generation != generation, fold_case=fold_case)
+            except Exception as e: print(f"[!] Scrollback search failed: {e}"); lines = array('Q')
+            with self._cond:
+                if lines is None or generation != self.generation: continue
+                METRICS.observe("scrollback.search", time.perf_counter() - t0)
+                self._result = (generation, scrollback, lines, start, end, (time.perf_counter() - t0) * 1000)
+            self._wakeup.notify()
+
+    def _deliver(self):
+        with self._cond: result = self._result; self._result = None
+        if result is None or result[0] != self.generation: return
+        self.on_result(*result[1:])
+
+    def close(self):
+        with self._cond: self._closed = True; self._cond.notify()
+        self._wakeup.close()
+
+
+class MarkdownPreviewEngine:
+    """Block-level incremental Markdown renderer: the note is split into top-level blocks, each block's HTML is cached under
+    a hash of its text, and an edit only re-renders the blocks it touched."""
+    CACHE_CHARS = 16 * 1024 * 1024 # HTML kept in the block cache
+    _FENCE_RE = re.compile(r" {0,3}(`{3,}|~{3,})")
+    _LIST_ITEM_RE = re.compile(r" {0,3}(?:[*+-]|\d+[.)])(?:\s|$)")
+    _CROSS_BLOCK_RE = re.compile(r"^ {0,3}\[[^\]\n]+\]:", re.M)
+    _HTML_BLOCK_TAGS = "address|article|aside|blockquote|body|canvas|dd|del|details|div|dl|dt|fieldset|figcaption|figure|footer|form|h[1-6]|head|header|html|iframe|ins|li|main|math|nav|noscript|ol|p|pre|script|section|style|table|tfoot|ul|video"
+    _HTML_OPEN_RE = re.compile(r"<(!--|(?:%s)\b)" % _HTML_BLOCK_TAGS) # what markdown2 takes as the start of a raw HTML block
+
+    def __init__(self, extras=MARKDOWN_EXTRAS):
+        self.extras = list(extras)
+        self._md = None
+        self._cache = OrderedDict() # content hash -> html
+        self._cache_chars = 0
+        self.last_stats = {"blocks": 0, "rendered": 0}
+
+    @property
+    def md(self):
+        if self._md is None:
+            import markdown2 # deferred to the first render, off the startup path
+            self._md = markdown2.Markdown(extras=self.extras)
+        return self._md
+
+    def split_blocks(self, text):
+        blocks = []; current = []; fence = None; html = None; blank_seen = False; in_list = False
+        for line in text.split("\n"):
+            if fence:
+                current.append(line)
+                if line.strip().startswith(fence) and not line.strip().strip(fence[0]): fence = None
+                continue
+            if html: # open HTML block: blank lines inside it do not end it
+                current.append(line); depth = html[1] + self._html_depth(html[0], line)
+                html = (html[0], depth) if depth > 0 else None
+                continue
+            if not line.strip():
+                if current: current.append(line); blank_seen = True
+                continue
+            starts_list = bool(self._LIST_ITEM_RE.match(line))
+            if blank_seen and not (line[:1] in (" ", "\t") or (in_list and starts_list)):
+                while current and not current[-1].strip(): current.pop()
+                blocks.append("\n".join(current)); current = []; in_list = False
+            blank_seen = False
+            if not current: in_list = starts_list
+            current.append(line)
+            m = self._FENCE_RE.match(line) or (len(current) == 1 and self._HTML_OPEN_RE.match(line))
+            if m and m.re is self._FENCE_RE: fence = m.group(1)
+            elif m and self._html_depth(m.group(1), line) > 0: html = (m.group(1), self._html_depth(m.group(1), line))
+        while current and not current[-1].strip(): current.pop()
+        if current: blocks.append("\n".join(current))
+        return blocks
+
+    @staticmethod
+    def _html_depth(tag, line):
+        """Net number of tag elements (or comments, for "!--") a line opens."""
+        if tag == "!--": return line.count("<!--") - line.count("-->")
+        return len(re.findall(r"<%s\b" % tag, line)) - line.count(f"</{tag}>")
+
+    def _convert_cached(self, source):
+        key = hashlib.blake2b(source.encode("utf-8", errors="surrogatepass"), digest_size=16).digest()
+        html = self._cache.get(key)
+        if html is not None: self._cache.move_to_end(key); return html, False
+        html = self.md.convert(source)
+        self._cache[key] = html; self._cache_chars += len(html)
+        while self._cache_chars > self.CACHE_CHARS and len(self._cache) > 1: self._cache_chars -= len(self._cache.popitem(last=False)[1])
+        return html, True
+
+    def render(self, text, cancelled=None):
+        """Returns the HTML body for text, re-rendering only blocks not seen before.
+        cancelled, if given, is polled between blocks; render returns None once it is true."""
+        if self._CROSS_BLOCK_RE.search(text): blocks = [text]
+        else: blocks = self.split_blocks(text)
+        parts = []; rendered = 0
+        for block in blocks:
+            if cancelled is not None and cancelled(): return None
+            html, fresh = self._convert_cached(block)
+            parts.append(html); rendered += fresh
+        self.last_stats = {"blocks": len(blocks), "rendered": rendered}
+        return "\n".join(parts)
+
+
+class PreviewRenderWorker:
+    """Renders preview HTML on a background thread; only the newest request matters, and older ones are abandoned between blocks.
+    on_result(html, render_ms) is called on the Tk thread."""
+
+    def __init__(self, root, engine, on_result):
+        self.engine = engine # only ever used from the worker thread
+        self.on_result = on_result
+        self._cond = threading.Condition()
+        self._request = None # (generation, text, css)
+        self._result = None # (generation, html, render_ms)
+        self.generation = 0
+        self._closed = False
+        self._wakeup = TkWakeup(root, self._deliver)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="preview-render")
+        self._thread.start()
+
+    def submit(self, text, css):
+        """Queues a render of text, superseding any pending or running one. Tk thread."""
+        with self._cond:
+            self.generation += 1
+            self._request = (self.generation, text, css)
+            self._cond.notify()
+        return self.generation
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._request is None and not self._closed: self._cond.wait()
+                if self._closed: return
+                generation, text, css = self._request; self._request = None
+            t0 = time.perf_counter()
+            try:
+                html_content = self.engine.render(text, cancelled=lambda: self.generation != generation)
+                if html_content is None: continue # superseded
+                METRICS.observe("preview.convert", time.perf_counter() - t0)
+                full_html = f"<!DOCTYPE html><html><head>{css}</head><body>{html_content}</body></html>"
+            except Exception as e:
+                print(f"Error updating preview: {e}")
+                full_html = f"<pre>Error rendering Markdown:\n{e}</pre>"
+            with self._cond:
+                if generation != self.generation: continue
+                self._result = (generation, full_html, (time.perf_counter() - t0) * 1000)
+            self._wakeup.notify()
+
+    def _deliver(self):
+        with self._cond: result = self._result; self._result = None
+        if result is None or result[0] != self.generation: return
+        self.on_result(result[1], result[2])
+
+    def close(self):
+        with self._cond: self._closed = True; self._cond.notify()
+        self._wakeup.close()
+
+
+EXPORT_MANIFEST = ".notesshell-export.json"
+_export_md = None # per-process markdown2 converter of the export pool
+
+
+def iter_note_files(notes_dir):
+    """Yields the relative paths of all .md files under notes_dir, depth first, skipping dot directories."""
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(notes_dir, rel_dir)) as it:
+                for entry in it:
+                    rel = os.path.join(rel_dir, entry.name)
+                    if entry.name.startswith("."): continue
+                    if entry.is_dir(follow_symlinks=False): stack.append(rel)
+                    elif entry.name.endswith(".md") and entry.is_file(): yield rel
+        except OSError as e: print(f"[!] Skipping {rel_dir or notes_dir}: {e}")
+
+
+def _export_init():
+    global _export_md
+    import markdown2
+    _export_md = markdown2.Markdown(extras=MARKDOWN_EXTRAS)
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C is handled by the parent, which terminates the pool
+
+
+def _export_note(task):
+    """Pool worker: renders one note unless its content hash matches the last export. Returns (rel, status, digest)."""
+    rel, src, dst, css, salt, old_digest = task
+    try:
+        with open(src, "rb") as f: data = f.read()
+        digest = hashlib.blake2b(data, digest_size=16, key=salt).hexdigest()
+        if digest == old_digest and os.path.exists(dst): return rel, "unchanged", digest
+        title = html_escape(os.path.splitext(os.path.basename(rel))[0])
+        body = _export_md.convert(data.decode("utf-8", errors="replace"))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        atomic_write(dst, f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title>{css}</head><body>{body}</body></html>\n', durable=False)
+        return rel, "written", digest
+    except Exception as e: return rel, f"failed: {e}", None
+
+
+def export_notes(notes_dir, out_dir, jobs=None, font_size=11, force=False, progress_interval=0.5):
+    """Renders every note under notes_dir to out_dir/<same path>.html on a process pool, skipping notes unchanged since
+    the last export's manifest and removing HTML of deleted ones. Returns (written, unchanged, failed)."""
+    import markdown2, multiprocessing
+    out_dir = os.path.abspath(out_dir); os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, EXPORT_MANIFEST)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f: manifest = json.load(f)
+    except (OSError, ValueError): manifest = {}
+    css = PREVIEW_CSS_TEMPLATE.format(size=font_size, code_size=max(8, int(font_size * 0.9)))
+    salt = hashlib.blake2b(repr((css, MARKDOWN_EXTRAS, markdown2.__version__)).encode(), digest_size=16).digest() # a new stylesheet re-renders everything
+    notes = list(iter_note_files(notes_dir)) # paths only; the notes themselves are read by the workers
+    tasks = ((rel, os.path.join(notes_dir, rel), os.path.join(out_dir, os.path.splitext(rel)[0] + ".html"), css, salt, None if force else manifest.get(rel)) for rel in notes)
+    new_manifest = {}; counts = {"written": 0, "unchanged": 0, "failed": 0}
+    jobs = jobs or os.cpu_count() or 1; t0 = last = time.perf_counter()
+    print(f"[+] Exporting {len(notes)} notes from {notes_dir} to {out_dir} on {jobs} processes")
+    pool = multiprocessing.Pool(jobs, initializer=_export_init)
+    try:
+        for done, (rel, status, digest) in enumerate(pool.imap_unordered(_export_note, tasks, chunksize=32), 1):
+            if digest: new_manifest[rel] = digest
+            if status.startswith("failed"): counts["failed"] += 1; print(f"\n[-] {rel}: {status}", file=sys.stderr)
+            else: counts[status] += 1
+            now = time.perf_counter()
+            if now - last >= progress_interval or done == len(notes):
+                last = now
+                print(f"\r[+] {done}/{len(notes)} notes ({counts['written']} written, {counts['unchanged']} unchanged, {counts['failed']} failed)", end="", file=sys.stderr, flush=True)
+        pool.close()
+    except KeyboardInterrupt: pool.terminate(); print("\n[!] Export interrupted; keeping what was written.", file=sys.stderr)
+    finally:
+        pool.join()
+        if len(notes): print(file=sys.stderr)
+        existing = set(notes)
+        for rel in manifest.keys() - existing: # notes that no longer exist
+            try: os.remove(os.path.join(out_dir, os.path.splitext(rel)[0] + ".html"))
+            except OSError: pass
+        new_manifest.update({rel: manifest[rel] for rel in (manifest.keys() & existing) - new_manifest.keys()}) # interrupted: keep old hashes of untouched notes
+        atomic_write(manifest_path, json.dumps(new_manifest, sort_keys=True))
+    print(f"[+] Export finished in {time.perf_counter() - t0:.1f}s: {counts['written']} written, {counts['unchanged']} unchanged, {counts['failed']} failed")
+    return counts["written"], counts["unchanged"], counts["failed"]
+
+
+NoteMeta = namedtuple("NoteMeta", "title mtime_ns size words snippet")
+
+_META_STRIP_RE = re.compile(r"^[#>*+\-\s]+|[`*_]+")
+
+
+def note_metadata(text, snippet_chars=160):
+    """Title (first non-empty line, as filenames are derived), word count and a short plain snippet of a note."""
+    title = ""; rest = text
+    for i, line in enumerate(text.splitlines()):
+        if line.strip(): title = _META_STRIP_RE.sub("", line).strip()[:120]; rest = "\n".join(text.splitlines()[i + 1:i + 40]); break
+    parts = []; in_code = False
+    for line in rest.splitlines():
+        if line.lstrip().startswith("```"): in_code = not in_code; continue
+        if line.strip() and not in_code: parts.append(_META_STRIP_RE.sub("", line).strip())
+    return title, len(text.split()), " ".join(parts)[:snippet_chars]
+
+
+class NoteIndex:
+    """Persistent full-text index and metadata cache of notes (SQLite), stored under ~/.notesshell.
+    Writes and search_async() run on one background thread; without FTS5, available is False but the metadata cache still works."""
+    BATCH = 200
+
+    def __init__(self, db_path, on_changed=None, on_search=None):
+        self.db_path = db_path
+        self.on_changed = on_changed
+        self.on_search = on_search
+        self._local = threading.local()
+        self._jobs = deque()
+        self._search_request = None # (generation, text), newest only
+        self.search_generation = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._changed = {} # metadata changed by the current job, reported once it is committed
+        self.available = False
+        self.meta_available = False
+        try:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            conn = self._conn()
+            conn.execute("CREATE TABLE IF NOT EXISTS note_files (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, mtime_ns INTEGER, size INTEGER)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(note_files)")}
+            for column, kind in (("ino", "INTEGER"), ("title", "TEXT"), ("words", "INTEGER"), ("snippet", "TEXT")):
+                if column not in columns: conn.execute(f"ALTER TABLE note_files ADD COLUMN {column} {kind}") # rows from older versions have no inode, so sync refreshes them
+            conn.commit()
+            self.meta_available = True
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(name, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+            conn.commit()
+            self.available = True
+        except sqlite3.Error as e: print(f"[-] Full-text search unavailable ({e}); searching filenames only.")
+        self._thread = threading.Thread(target=self._run, daemon=True, name="note-index")
+        if self.meta_available: self._thread.start()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _submit(self, *job):
+        if not self.meta_available: return
+        with self._cond: self._jobs.append(job); self._cond.notify()
+
+    def sync(self, notes_dir): self._submit("sync", notes_dir)
+    def update(self, name, text, st=None): self._submit("update", name, text, st)
+    def remove(self, name): self._submit("remove", name)
+    def refresh(self, path, name): self._submit("refresh", path, name) # re-reads the file on the index thread
+
+    def search_async(self, text):
+        """Queues a search for on_search, superseding any pending one. Returns its generation."""
+        with self._cond:
+            self.search_generation += 1
+            if self.meta_available: self._search_request = (self.search_generation, text); self._cond.notify()
+            return self.search_generation
+
+    def cancel_search(self):
+        with self._cond: self.search_generation += 1; self._search_request = None
+
+    def _serve_search(self):
+        with self._cond: request, self._search_request = self._search_request, None
+        if request is None: return
+        names = self.search(request[1])
+        if request[0] == self.search_generation and self.on_search: self.on_search(request[0], names) # a newer request makes this one moot
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs and self._search_request is None and not self._closed: self._cond.wait()
+                if self._closed: return
+                job = self._jobs.popleft() if self._search_request is None else None
+            if job is None: self._serve_search(); continue
+            try:
+                if job[0] == "sync": self._sync(job[1])
+                elif job[0] == "update": self._update(*job[1:]); self._conn().commit()
+                elif job[0] == "remove": self._remove(job[1]); self._conn().commit()
+                elif job[0] == "refresh":
+                    with open(job[1], "r", encoding="utf-8", errors="replace") as f: st = os.fstat(f.fileno()); text = f.read()
+                    self._update(job[2], text, st); self._conn().commit()
+            except (sqlite3.Error, OSError) as e: print(f"[!] Note index {job[0]} failed: {e}")
+            changed, self._changed = self._changed, {}
+            if changed and self.on_changed: self.on_changed(changed)
+
+    def _update(self, name, text, st):
+        conn = self._conn()
+        title, words, snippet = note_metadata(text)
+        mtime_ns, size = (st.st_mtime_ns, st.st_size) if st else (None, None)
+        conn.execute("INSERT INTO note_files(name, ino, mtime_ns, size, title, words, snippet) VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+                     "ino = excluded.ino, mtime_ns = excluded.mtime_ns, size = excluded.size, title = excluded.title, words = excluded.words, snippet = excluded.snippet",
+                     (name, st.st_ino if st else None, mtime_ns, size, title, words, snippet))
+        self._changed[name] = NoteMeta(title, mtime_ns or 0, size or 0, words, snippet)
+        if not self.available: return
+        (doc_id,) = conn.execute("SELECT id FROM note_files WHERE name = ?", (name,)).fetchone()
+        conn.execute("DELETE FROM note_fts WHERE rowid = ?", (doc_id,))
+        conn.execute("INSERT INTO note_fts(rowid, name, body) VALUES (?, ?, ?)", (doc_id, name[:-3] if name.endswith(".md") else name, text))
+
+    def _remove(self, name):
+        conn = self._conn()
+        row = conn.execute("SELECT id FROM note_files WHERE name = ?", (name,)).fetchone()
+        if not row: return
+        if self.available: conn.execute("DELETE FROM note_fts WHERE rowid = ?", row)
+        conn.execute("DELETE FROM note_files WHERE id = ?", row); self._changed[name] = None
+
+    def metadata(self):
+        """Cached metadata of every indexed note as {name: NoteMeta}, read on the caller's connection. May be stale until sync finishes."""
+        if not self.meta_available: return {}
+        try: rows = self._conn().execute("SELECT name, title, mtime_ns, size, words, snippet FROM note_files").fetchall()
+        except sqlite3.Error as e: print(f"[-] Could not read note metadata: {e}"); return {}
+        return {name: NoteMeta(title or "", mtime_ns or 0, size or 0, words or 0, snippet or "") for name, title, mtime_ns, size, words, snippet in rows}
+
+    def _sync(self, notes_dir):
+        """Re-indexes notes whose mtime or size changed since they were indexed, drops deleted ones."""
+        conn = self._conn(); t0 = time.perf_counter()
+        known = {name: (ino, mtime_ns, size) for name, ino, mtime_ns, size in conn.execute("SELECT name, ino, mtime_ns, size FROM note_files")}
+        seen = set(); pending = 0; reindexed = 0
+        with os.scandir(notes_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".md") or not entry.is_file(): continue
+                st = entry.stat(); seen.add(entry.name)
+                if known.get(entry.name) == (st.st_ino, st.st_mtime_ns, st.st_size): continue
+                try:
+                    with open(entry.path, "r", encoding="utf-8", errors="replace") as f: text = f.read()
+                except OSError: continue
+                self._update(entry.name, text, st); pending += 1; reindexed += 1
+                if pending >= self.BATCH: # commit and report in batches, so a big rebuild fills the sidebar progressively
+                    conn.commit(); pending = 0
+                    changed, self._changed = self._changed, {}
+                    if self.on_changed: self.on_changed(changed)
+                    self._serve_search() # a typed query need not wait for the whole rebuild
+        for name in known.keys() - seen: self._remove(name)
+        conn.commit()
+        print(f"[+] Note index synced: {reindexed} re-indexed, {len(known.keys() - seen)} removed in {time.perf_counter() - t0:.2f}s")
+
+    _QUERY_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+    @classmethod
+    def build_query(cls, text):
+        """Turns search box text into an FTS5 query: "quoted phrases" match as phrases, bare words as prefixes."""
+        terms = []
+        for phrase, word in cls._QUERY_TOKEN_RE.findall(text):
+            if phrase.strip(): terms.append('"' + phrase.replace('"', '""') + '"')
+            elif word:
+                word = re.sub(r"[^\w]+", " ", word).strip()
+                for part in word.split(): terms.append(f'"{part}"*')
+        return " ".join(terms) or None
+
+    def search(self, text, limit=500):
+        """Returns note names matching text, best match first. Empty when unavailable or no terms."""
+        if not self.available: return []
+        query = self.build_query(text)
+        if not query: return []
+        try:
+            rows = self._conn().execute("SELECT f.name FROM note_fts JOIN note_files f ON f.id = note_fts.rowid WHERE note_fts MATCH ? ORDER BY bm25(note_fts, 5.0, 1.0) LIMIT ?", (query, limit)).fetchall()
+        except sqlite3.Error as e: print(f"[-] Search failed: {e}"); return []
+        return [name for (name,) in rows]
+
+    def close(self):
+        with self._cond: self._closed = True; self._cond.notify()
+
+
+class NotesDirectoryCache:
+    """Cached listing of the .md files in the notes directory: one stat of the directory while its mtime is unchanged."""
+
+    def __init__(self, notes_dir):
+        self.notes_dir = notes_dir
+        self._dir_mtime_ns = None
+        self.names = []
+
+    def invalidate(self): self._dir_mtime_ns = None
+
+    def scan(self):
+        """Returns the sorted note names and whether they changed since the last scan."""
+        mtime_ns = os.stat(self.notes_dir).st_mtime_ns
+        if mtime_ns == self._dir_mtime_ns: return self.names, False
+        with os.scandir(self.notes_dir) as it: names = sorted(entry.name for entry in it if entry.name.endswith(".md") and entry.is_file())
+        self._dir_mtime_ns = mtime_ns
+        changed = names != self.names; self.names = names
+        return names, changed
+
+
+class NotesWatcher:
+    """Watches the notes directory (inotify on Linux, mtime polling elsewhere) and hands batches of events to the Tk thread.
+    Events are (kind, name, old_name), kind being created, modified, deleted, renamed or rescan."""
+    IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x8, 0x40, 0x80, 0x100, 0x200
+    IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_ISDIR = 0x400, 0x800, 0x4000, 0x40000000
+    IN_NONBLOCK, IN_CLOEXEC = os.O_NONBLOCK, 0o2000000
+    _EVENT = struct.Struct("iIII")
+    MOVE_PAIR_SECONDS = 0.2 # how long a MOVED_FROM waits for its MOVED_TO, which can come in a later read
+
+    def __init__(self, root, notes_dir, on_events, batch_ms=150, poll_interval=2.0):
+        self.root = root
+        self.notes_dir = notes_dir
+        self.on_events = on_events
+        self.batch_ms = batch_ms
+        self.poll_interval = poll_interval
+        self.backend = None
+        self._events = deque()
+        self._batch_job = None
+        self._stop = threading.Event()
+        self._stop_r, self._stop_w = os.pipe()
+        self._wakeup = TkWakeup(root, self._on_wakeup)
+        self._inotify_fd = self._init_inotify()
+        self.backend = "inotify" if self._inotify_fd is not None else "polling"
+        self._thread = threading.Thread(target=self._run_inotify if self._inotify_fd is not None else self._run_polling, daemon=True, name="notes-watcher")
+        self._thread.start()
+        print(f"[+] Watching {notes_dir} ({self.backend})")
+
+    def _init_inotify(self):
+        if not sys.platform.startswith("linux"): return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE | self.IN_DELETE_SELF | self.IN_MOVE_SELF
+            if libc.inotify_add_watch(fd, os.fsencode(self.notes_dir), mask) < 0:
+                err = ctypes.get_errno(); os.close(fd); raise OSError(err, os.strerror(err))
+            return fd
+        except (OSError, AttributeError) as e: print(f"[-] inotify unavailable ({e}); polling the notes directory instead."); return None
+
+    def _emit(self, events):
+        if events: self._events.extend(events); self._wakeup.notify()
+
+    def _run_inotify(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self._inotify_fd, selectors.EVENT_READ); sel.register(self._stop_r, selectors.EVENT_READ)
+        moved_from = {} # cookie -> (name, deadline), pairs MOVED_FROM with MOVED_TO into a rename
+        dir_gone = False
+        try:
+            while not self._stop.is_set():
+                sel.select(max(0.0, min(deadline for _, deadline in moved_from.values()) - time.monotonic()) if moved_from else None)
+                if self._stop.is_set(): break
+                try: buf = os.read(self._inotify_fd, 64 * 1024)
+                except BlockingIOError: buf = b"" # woken for a MOVED_FROM that is due
+                events, dir_gone = self._parse_events(buf, moved_from, time.monotonic())
+                if dir_gone: events.append(("rescan", None, None))
+                self._emit(events)
+                if dir_gone: break
+        finally: sel.close()
+        if dir_gone and not self._stop.is_set(): self._run_polling() # the directory may come back; inotify can't see that
+
+    def _parse_events(self, buf, moved_from, now):
+        """Maps inotify records to events and returns (events, dir_gone). A MOVED_FROM left unpaired for MOVE_PAIR_SECONDS is a delete."""
+        events = []; dir_gone = False; offset = 0
+        while offset + self._EVENT.size <= len(buf):
+            _, mask, cookie, length = self._EVENT.unpack_from(buf, offset)
+            name = os.fsdecode(buf[offset + self._EVENT.size:offset + self._EVENT.size + length].rstrip(b"\0")); offset += self._EVENT.size + length
+            if mask & self.IN_Q_OVERFLOW: events.append(("rescan", None, None)); continue
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF): dir_gone = True; continue
+            if mask & self.IN_ISDIR or not name.endswith(".md"): continue
+            if mask & self.IN_MOVED_FROM: moved_from[cookie] = (name, now + self.MOVE_PAIR_SECONDS)
+            elif mask & self.IN_MOVED_TO:
+                old = moved_from.pop(cookie, (None,))[0]
+                events.append(("renamed", name, old) if old else ("created", name, None))
+            elif mask & self.IN_CREATE: events.append(("created", name, None))
+            elif mask & self.IN_CLOSE_WRITE: events.append(("modified", name, None))
+            elif mask & self.IN_DELETE: events.append(("deleted", name, None))
+        for cookie, (name, deadline) in list(moved_from.items()):
+            if deadline <= now: del moved_from[cookie]; events.append(("deleted", name, None)) # moved out of the directory
+        return events, dir_gone
+
+    def _snapshot(self):
+        files = {}
+        try:
+            with os.scandir(self.notes_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".md"): continue
+                    try:
+                        if entry.is_file(): st = entry.stat(); files[entry.name] = (st.st_mtime_ns, st.st_size)
+                    except FileNotFoundError: pass # removed between listing and stat
+        except OSError: pass
+        return files
+
+    def _run_polling(self):
+        known = self._snapshot()
+        while not self._stop.wait(self.poll_interval):
+            current = self._snapshot()
+            if current == known: continue
+            events = [("created", name, None) for name in current.keys() - known.keys()]
+            events += [("deleted", name, None) for name in known.keys() - current.keys()]
+            events += [("modified", name, None) for name in current.keys() & known.keys() if current[name] != known[name]]
+            known = current; self._emit(events)
+
+    # Tk thread
+    def _on_wakeup(self):
+        if self._batch_job is None: self._batch_job = self.root.after(self.batch_ms, self._deliver)
+
+    def _deliver(self):
+        self._batch_job = None
+        events = []
+        while self._events: events.append(self._events.popleft())
+        if events: self.on_events(events)
+
+    def close(self):
+        self._stop.set()
+        try: os.write(self._stop_w, b"x")
+        except OSError: pass
+        self._thread.join(timeout=2.0)
+        if self._batch_job: self.root.after_cancel(self._batch_job); self._batch_job = None
+        for fd in (self._inotify_fd, self._stop_r, self._stop_w):
+            if fd is not None:
+                try: os.close(fd)
+                except OSError: pass
+        self._wakeup.close()
+
+
+class VirtualListbox(ttk.Frame):
+    """Listbox that only materializes the rows on screen, with the subset of the Listbox API the sidebar uses.
+    It generates <<ListboxSelect>> on itself when the user changes the selection."""
+    WHEEL_ROWS = 3
+
+    def __init__(self, master, display=None, **listbox_options):
+        super().__init__(master)
+        self.display = display # item -> row text, applied to the visible rows only
+        self._items = []
+        self._positions = {} # item -> index, for select_item
+        self._offset = 0
+        self._rows = 1
+        self._selected = None
+        self.listbox = tk.Listbox(self, exportselection=False, height=1, **listbox_options)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.listbox.bind("<Configure>", self._on_configure)
+        self.listbox.bind("<<ListboxSelect>>", self._on_listbox_select)
+        self.listbox.bind("<MouseWheel>", lambda e: self._scroll_rows(-self.WHEEL_ROWS if e.delta > 0 else self.WHEEL_ROWS))
+        self.listbox.bind("<Button-4>", lambda e: self._scroll_rows(-self.WHEEL_ROWS))
+        self.listbox.bind("<Button-5>", lambda e: self._scroll_rows(self.WHEEL_ROWS))
+        self.listbox.bind("<Up>", lambda e: self._move_selection(-1))
+        self.listbox.bind("<Down>", lambda e: self._move_selection(1))
+        self.listbox.bind("<Prior>", lambda e: self._move_selection(-self._rows))
+        self.listbox.bind("<Next>", lambda e: self._move_selection(self._rows))
+
+    # Listbox-like API
+    def set_items(self, items):
+        self._items = list(items); self._positions = {item: i for i, item in enumerate(self._items)}
+        self._selected = None
+        self._offset = max(0, min(self._offset, len(self._items) - self._rows))
+        self._refresh()
+
+    def redraw(self): self._refresh() # after the display text of items changed
+
+    def items(self): return self._items
+    def size(self): return len(self._items)
+    def get(self, index): return self._items[index]
+    def curselection(self): return () if self._selected is None else (self._selected,)
+    def activate(self, index): pass
+
+    def selection_clear(self, first=0, last=None):
+        if self._selected is not None: self._selected = None; self._refresh()
+
+    def selection_set(self, index):
+        if 0 <= index < len(self._items): self._selected = index; self._refresh()
+
+    def select_item(self, item):
+        """Selects item and scrolls it into view. Returns False if it is not in the list."""
+        index = self._positions.get(item)
+        if index is None: self.selection_clear(); return False
+        self._selected = index; self.see(index)
+        return True
+
+    def see(self, index):
+        if index < self._offset: self._offset = index
+        elif index >= self._offset + self._rows: self._offset = index - self._rows + 1
+        self._refresh()
+
+    # internals
+    def _refresh(self):
+        window = self._items[self._offset:self._offset + self._rows]
+        self.listbox.delete(0, tk.END)
+        if window: self.listbox.insert(tk.END, *(map(self.display, window) if self.display else window))
+        if self._selected is not None and self._offset <= self._selected < self._offset + len(window): self.listbox.selection_set(self._selected - self._offset)
+        total = max(len(self._items), 1)
+        self.scrollbar.set(self._offset / total, min(1.0, (self._offset + self._rows) / total))
+
+    def _on_configure(self, event):
+        bbox = self.listbox.bbox(0)
+        row_height = bbox[3] + 1 if bbox else tkfont.Font(font=self.listbox.cget("font")).metrics("linespace") + 1
+        rows = max(1, event.height // max(row_height, 1))
+        if rows != self._rows:
+            self._rows = rows
+            self._offset = max(0, min(self._offset, len(self._items) - rows))
+            self._refresh()
+
+    def _scroll_rows(self, delta):
+        offset = max(0, min(self._offset + delta, len(self._items) - self._rows))
+        if offset != self._offset: self._offset = offset; self._refresh()
+        return "break"
+
+    def _on_scrollbar(self, *args):
+        if args[0] == "moveto": self._scroll_rows(int(float(args[1]) * len(self._items)) - self._offset)
+        elif args[0] == "scroll": self._scroll_rows(int(args[1]) * (self._rows if args[2] == "pages" else 1))
+
+    def _on_listbox_select(self, event):
+        sel = self.listbox.curselection()
+        if not sel: return
+        self._selected = self._offset + sel[0]
+        self.event_generate("<<ListboxSelect>>")
+
+    def _move_selection(self, delta):
+        if not self._items: return "break"
+        index = 0 if self._selected is None else max(0, min(self._selected + delta, len(self._items) - 1))
+        if index != self._selected: self._selected = index; self.see(index); self.event_generate("<<ListboxSelect>>")
+        return "break"
+
+
+class ChunkedTextLoader:
+    """Streams a large UTF-8 file into a read-only tk.Text in chunks, one per event-loop turn, from a memory map.
+    on_progress(done_bytes, total_bytes) and on_done(error) are called on the Tk thread."""
+    def __init__(self, widget, path, on_progress=None, on_done=None, chunk_bytes=256 * 1024, first_chunk_bytes=32 * 1024):
+        self.widget = widget
+        self.path = path
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.chunk_bytes = chunk_bytes
+        self.first_chunk_bytes = first_chunk_bytes
+        self.total_bytes = 0
+        self.done_bytes = 0
+        self._map = None
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._job_id = None
+
+    def start(self):
+        with open(self.path, "rb") as f:
+            self.total_bytes = os.fstat(f.fileno()).st_size
+            if self.total_bytes: self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.widget.config(undo=False, state=tk.DISABLED)
+        self._step(self.first_chunk_bytes)
+
+    def _step(self, size=None):
+        self._job_id = None
+        try:
+            end = min(self.total_bytes, self.done_bytes + (size or self.chunk_bytes))
+            text = self._decoder.decode(self._map[self.done_bytes:end] if self._map else b"", final=(end >= self.total_bytes))
+            self.widget.config(state=tk.NORMAL); self.widget.insert("end-1c", text); self.widget.config(state=tk.DISABLED)
+            self.done_bytes = end
+        except (UnicodeDecodeError, ValueError, tk.TclError) as e: self._finish(e); return
+        if self.on_progress: self.on_progress(self.done_bytes, self.total_bytes)
+        if self.done_bytes >= self.total_bytes: self._finish(None)
+        else: self._job_id = self.widget.after(1, self._step) # a timer, not after_idle, so input and redraws get in between chunks
+
+    def _finish(self, error):
+        self._release()
+        if self.on_done: self.on_done(error)
+
+    def _release(self):
+        if self._job_id: self.widget.after_cancel(self._job_id); self._job_id = None
+        if self._map: self._map.close(); self._map = None
+        try: self.widget.config(undo=True, state=tk.NORMAL); self.widget.edit_reset()
+        except tk.TclError: pass
+
+    def cancel(self):
+        """Stops loading without calling on_done; the widget keeps whatever was inserted so far."""
+        self._release()
+
+
+class MarkdownHighlighter:
+    """Incremental Markdown highlighting for the editor: headings, code fences and spans, emphasis, links and tables.
+    Keeps each line's fence state; an edit re-tags the lines in view and propagates states only until they match the old ones again."""
+    SLICE_MS = 8
+    MARGIN_LINES = 30
+    SCAN_LINES = 2000 # lines read per step of the state scan
+    TAG_LINES = 500 # lines tagged per step
+    TAGS = ("md_heading", "md_fence", "md_code", "md_bold", "md_italic", "md_link", "md_url", "md_table")
+    _FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})(.*)$", re.M)
+    _HEADING_RE = re.compile(r" {0,3}#{1,6}(?:[ \t]|$)")
+    _TABLE_RE = re.compile(r" {0,3}\|.*\|[ \t]*$| {0,3}\|?[ \t]*:?-+:?[ \t]*(?:\|[ \t]*:?-+:?[ \t]*)+\|?[ \t]*$")
+    # code spans first, so nothing inside one is matched; no _ emphasis, as with the code-friendly extra
+    _INLINE_RE = re.compile(r"(`+)(.+?)\1|\*\*(?=\S)(.+?)(?<=\S)\*\*|\*(?=[^\s*])(.+?)(?<=[^\s*])\*|\[([^\]\n]+)\]\(([^)\n]*)\)|<(https?://[^>\s]+)>")
+    _WRAPPER = """proc WIDGET args {
+    switch -- [lindex $args 0] {
+        insert - delete - replace {
+            set end [ORIG index end]
+            set first [ORIG index [lindex $args 1]]
+            set last [expr {[lindex $args 0] ne "insert" && [llength $args] > 2 ? [ORIG index [lindex $args 2]] : $first}]
+            set result [ORIG {*}$args]
+            CALLBACK [lindex $args 0] [llength $args] $first $last $end [ORIG index end]
+            return $result
+        }
+        edit {
+            set result [ORIG {*}$args]
+            if {[lindex $args 1] in {undo redo}} {CALLBACK reset 0 1.0 1.0 1.0 1.0}
+            return $result
+        }
+        default {tailcall ORIG {*}$args}
+    }
+}"""
+
+    def __init__(self, widget, font):
+        self.widget = widget
+        self._job_id = None
+        widget.tag_configure("md_heading", foreground="#1a5fb4")
+        widget.tag_configure("md_fence", foreground="#8c959f", background="#f6f8fa")
+        widget.tag_configure("md_code", foreground="#a0306e", background="#f6f8fa")
+        widget.tag_configure("md_link", foreground="#0969da", underline=True)
+        widget.tag_configure("md_url", foreground="#8c959f")
+        widget.tag_configure("md_table", foreground="#2f6f4f")
+        self.set_font(font)
+        for tag in self.TAGS: widget.tag_lower(tag, "sel") # the selection stays visible over code backgrounds
+        path = str(widget); orig = path + "_hl_orig"
+        widget.tk.call("rename", path, orig)
+        widget.tk.eval(self._WRAPPER.replace("WIDGET", path).replace("ORIG", orig).replace("CALLBACK", widget.register(self._on_edit)))
+        widget.configure(yscrollcommand=lambda *_: self.schedule()) # any scroll, resize or see() may bring untagged lines into view
+        self.reset()
+
+    def set_font(self, font):
+        family, size = font[0], font[1]
+        self.widget.tag_configure("md_heading", font=(family, size, "bold"))
+        self.widget.tag_configure("md_bold", font=(family, size, "bold"))
+        self.widget.tag_configure("md_italic", font=(family, size, "italic"))
+
+    def reset(self):
+        """Forgets all line states; the lines in view are re-highlighted first."""
+        n = int(self.widget.index("end").split(".")[0]) - 1
+        self._states = array("I", [0]) * n # lexer state at the start of each line: 0, or fence length << 1 | is_tilde
+        self._stale = bytearray(b"\x01") * n # 1 where the line's tags do not match its text and state
+        self._frontier = 1 # states below this line index are up to date
+        self._known = 1 # states below this one were computed at some point (the old values the scan compares against)
+        self._edit_end = -1 # last line edited since the scan last caught up
+        self.schedule()
+
+    def _on_edit(self, op, nargs, first, last, end_before, end_after):
+        """Tcl wrapper callback, after an insert/delete/replace (line indexes as before it) or undo/redo."""
+        if op == "reset" or (op == "delete" and int(nargs) > 3): self.reset(); return # several ranges at once: not worth tracking
+        lines_before = int(end_before.split(".")[0]) - 1
+        line = min(int(first.split(".")[0]), lines_before) - 1 # 0-based; an "end" index means the last line
+        delta = int(end_after.split(".")[0]) - int(end_before.split(".")[0])
+        changed = max(0, min(int(last.split(".")[0]), lines_before) - 1 - line + delta) # lines after `line` holding edited text
+        if delta > 0: self._states[line + 1:line + 1] = array("I", [0]) * delta; self._stale[line + 1:line + 1] = bytes(delta)
+        elif delta < 0: del self._states[line + 1:line + 1 - delta]; del self._stale[line + 1:line + 1 - delta]
+        end = min(len(self._stale), line + changed + 1)
+        self._stale[line:end] = b"\x01" * (end - line)
+        if self._known > line + 1: self._known = max(line + 1, self._known + delta)
+        if self._edit_end > line: self._edit_end = max(line, self._edit_end + delta)
+        self._edit_end = max(self._edit_end, line + changed)
+        self._frontier = min(self._frontier, line + 1)
+        self.schedule()
+
+    def schedule(self):
+        if self._job_id is None: self._job_id = self.widget.after(1, self._step) # a timer, not after_idle, so keystrokes get in between slices
+
+    def cancel(self):
+        if self._job_id is not None: self.widget.after_cancel(self._job_id); self._job_id = None
+
+    def _step(self):
+        self._job_id = None
+        deadline = time.perf_counter() + self.SLICE_MS / 1000
+        with METRICS.time("editor.highlight"):
+            try: more = self._work(deadline)
+            except tk.TclError: return # widget gone
+        if more: self._job_id = self.widget.after(1, self._step)
+
+    def _work(self, deadline):
+        """One slice; returns whether work is left."""
+        widget = self.widget; n = len(self._states)
+        top = max(0, int(widget.index("@0,0").split(".")[0]) - 1 - self.MARGIN_LINES)
+        bottom = min(n, int(widget.index(f"@0,{widget.winfo_height()}").split(".")[0]) + self.MARGIN_LINES)
+        while self._frontier < bottom: # the states the view depends on
+            self._scan()
+            if time.perf_counter() > deadline: return True
+        while True:
+            start = self._stale.find(1, top, bottom)
+            if start < 0: break
+            end = self._stale.find(0, start, min(bottom, start + self.TAG_LINES))
+            self._tag_lines(start, end if end >= 0 else min(bottom, start + self.TAG_LINES))
+            if time.perf_counter() > deadline: return True
+        while self._frontier < n: # the rest of the document, in the background
+            self._scan()
+            if time.perf_counter() > deadline: return True
+        return False
+
+    def _next_state(self, state, m):
+        """State after a line matching _FENCE_RE, entered in state."""
+        fence = m.group(1)
+        if state: return 0 if (fence[0] == "~") == (state & 1) and len(fence) >= state >> 1 and not m.group(2).strip() else state
+        if fence[0] == "`" and "`" in m.group(2): return 0 # inline code, not a fence
+        return len(fence) << 1 | (fence[0] == "~")
+
+    def _scan(self):
+        """Computes the states of the next SCAN_LINES lines from the frontier on, from their fence lines alone."""
+        f = self._frontier; n = len(self._states)
+        last = min(n, f - 1 + self.SCAN_LINES) # lines f-1 .. last-1 are read; their exits are the states of f .. last
+        text = self.widget.get(f"{f}.0", f"{last}.end")
+        line = f - 1; pos = 0; state = self._states[f - 1]
+        for m in self._FENCE_RE.finditer(text):
+            at = line + text.count("\n", pos, m.start())
+            if self._fill(line + 1, at + 1, state): return
+            state = self._next_state(state, m); line = at; pos = m.start()
+        if self._fill(line + 1, last + 1, state): return
+        self._frontier = min(n, last + 1); self._known = max(self._known, self._frontier)
+        if self._frontier >= n: self._edit_end = -1
+
+    def _fill(self, a, b, state):
+        """Sets the state of lines a..b-1. Returns True, with the frontier moved on, once the states are back in step with the old ones."""
+        b = min(b, len(self._states))
+        if a < self._edit_end + 1 < b: return self._fill(a, self._edit_end + 1, state) or self._fill(self._edit_end + 1, b, state)
+        if a >= b: return False
+        if self._edit_end < a < self._known and self._states[a] == state: self._frontier = self._known; self._edit_end = -1; return True
+        new = array("I", [state]) * (b - a)
+        if self._states[a:b] != new: self._states[a:b] = new; self._stale[a:b] = b"\x01" * (b - a)
+        return False
+
+    def _tag_lines(self, a, b):
+        """Re-tags lines a..b-1 (0-based), whose states are up to date."""
+        widget = self.widget; states = self._states
+        ranges = {tag: [] for tag in self.TAGS}
+        for k, text in enumerate(widget.get(f"{a + 1}.0", f"{b}.end").split("\n")): self._tokenize(text, states[a + k], ranges, a + k + 1)
+        for tag in self.TAGS:
+            widget.tag_remove(tag, f"{a + 1}.0", f"{b + 1}.0")
+            if ranges[tag]: widget.tag_add(tag, *ranges[tag])
+        self._stale[a:b] = bytes(b - a)
+
+    def _tokenize(self, text, state, ranges, lineno):
+        """Adds the tag ranges of one line (lineno is 1-based) to ranges."""
+        m = self._FENCE_RE.match(text)
+        after = self._next_state(state, m) if m is not None else state
+        if state or after: ranges["md_fence" if after != state else "md_code"] += (f"{lineno}.0", f"{lineno + 1}.0"); return # the newline too, so the background spans the line
+        if self._HEADING_RE.match(text): ranges["md_heading"] += (f"{lineno}.0", f"{lineno}.end")
+        elif self._TABLE_RE.match(text): ranges["md_table"] += (f"{lineno}.0", f"{lineno}.end")
+        for m in self._INLINE_RE.finditer(text):
+            if m.group(1): ranges["md_code"] += (f"{lineno}.{m.start()}", f"{lineno}.{m.end()}")
+            elif m.group(3): ranges["md_bold"] += (f"{lineno}.{m.start()}", f"{lineno}.{m.end()}")
+            elif m.group(4): ranges["md_italic"] += (f"{lineno}.{m.start()}", f"{lineno}.{m.end()}")
+            elif m.group(5): ranges["md_link"] += (f"{lineno}.{m.start()}", f"{lineno}.{m.end(5) + 1}"); ranges["md_url"] += (f"{lineno}.{m.start(6) - 1}", f"{lineno}.{m.end()}")
+            else: ranges["md_link"] += (f"{lineno}.{m.start()}", f"{lineno}.{m.end()}")
+
+
+class AutosaveJournal:
+    """Per-note write-ahead journal of edits plus background atomic autosave, both on one worker thread.
+    Journals that survive a crash are returned by recover()."""
+    UNTITLED = "__untitled__"
+
+    def __init__(self, root, journal_dir, on_saved):
+        self.journal_dir = journal_dir
+        self.on_saved = on_saved # on_saved(key, generation, text, error) on the Tk thread
+        self._texts = {} # key -> text as of the last record, Tk thread only
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._write_lock = threading.Lock() # serializes note file writes with manual saves
+        self._latest_generation = {} # path -> newest generation written or requested by a manual save
+        self.written = {} # path -> (mtime_ns, size) of our own last write, so the notes watcher can tell it from outside changes
+        self._results = deque()
+        self._wakeup = TkWakeup(root, self._deliver)
+        os.makedirs(journal_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="autosave")
+        self._thread.start()
+
+    def _journal_path(self, key): return os.path.join(self.journal_dir, quote(key, safe="") + ".journal")
+
+    # Tk thread API
+    def record(self, key, note, text):
+        """Journals the change from the previously recorded text for key (or the full text, the first time)."""
+        old = self._texts.get(key)
+        if old == text: return
+        if old is None: entry = {"op": "base", "note": note, "text": text, "t": time.time()}
+        else:
+            prefix, suffix = common_affix_lengths(old, text)
+            entry = {"op": "edit", "s": prefix, "e": len(old) - suffix, "text": text[prefix:len(text) - suffix], "t": time.time()}
+        self._texts[key] = text
+        self._submit(("journal", key, json.dumps(entry, ensure_ascii=False) + "\n"))
+
+    def save(self, key, path, text, generation):
+        with self._cond:
+            self._jobs = deque(job for job in self._jobs if not (job[0] == "save" and job[2] == path)) # coalesce
+            self._jobs.append(("save", key, path, text, generation)); self._cond.notify()
+
+    def write_now(self, key, path, text, generation):
+        """Manual save: writes on the calling thread and supersedes any queued or running autosave of path."""
+        with self._write_lock:
+            self._latest_generation[path] = max(generation, self._latest_generation.get(path, -1))
+            atomic_write(path, text); self._remember_write(path)
+        self.checkpoint(key)
+
+    def _remember_write(self, path):
+        st = os.stat(path); self.written[path] = (st.st_mtime_ns, st.st_size)
+
+    def checkpoint(self, key):
+        """The note is safely on disk: drop its journal."""
+        self._texts.pop(key, None); self._submit(("remove", key))
+
+    def discard(self, key, path=None, generation=-1):
+        """The user threw the changes away: drops the journal and queued autosaves of key, and makes a running one for path up to generation a no-op."""
+        with self._cond:
+            self._jobs = deque(job for job in self._jobs if not (job[0] == "save" and job[1] == key))
+            if path is not None: self._latest_generation[path] = max(generation, self._latest_generation.get(path, -1)) # checked under _write_lock before writing
+        self.checkpoint(key)
+
+    def _submit(self, job):
+        with self._cond: self._jobs.append(job); self._cond.notify()
+
+    # worker thread
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs and not self._closed: self._cond.wait()
+                if not self._jobs: return
+                job = self._jobs.popleft()
+            try:
+                if job[0] == "journal":
+                    with open(self._journal_path(job[1]), "a", encoding="utf-8") as f: f.write(job[2]); f.flush(); os.fsync(f.fileno())
+                elif job[0] == "remove":
+                    try: os.remove(self._journal_path(job[1]))
+                    except FileNotFoundError: pass
+                elif job[0] == "save": self._autosave(*job[1:])
+            except OSError as e:
+                print(f"[!] Autosave {job[0]} failed: {e}")
+                if job[0] == "save": self._results.append((job[1], job[4], job[3], e)); self._wakeup.notify()
+
+    def _autosave(self, key, path, text, generation):
+        with self._write_lock:
+            if generation <= self._latest_generation.get(path, -1): return # a newer (manual) save already landed
+            with METRICS.time("note.autosave"): atomic_write(path, text)
+            self._remember_write(path); self._latest_generation[path] = generation
+        self._results.append((key, generation, text, None)); self._wakeup.notify()
+
+    def _deliver(self):
+        while self._results: self.on_saved(*self._results.popleft())
+
+    # startup / shutdown
+    def recover(self):
+        """Replays surviving journals. Returns [(key, note, text, mtime)] newest first; unreadable tails are ignored."""
+        recovered = []
+        for fname in os.listdir(self.journal_dir):
+            if not fname.endswith(".journal"): continue
+            path = os.path.join(self.journal_dir, fname); note = None; text = None
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try: entry = json.loads(line)
+                        except ValueError: break # torn final record
+                        if entry.get("op") == "base": note = entry.get("note"); text = entry.get("text", "")
+                        elif entry.get("op") == "edit" and text is not None: text = text[:entry["s"]] + entry["text"] + text[entry["e"]:]
+                if text is not None: recovered.append((unquote(fname[:-len(".journal")]), note, text, os.path.getmtime(path)))
+            except (OSError, KeyError, TypeError) as e: print(f"[!] Could not read journal {fname}: {e}")
+        return sorted(recovered, key=lambda r: r[3], reverse=True)
+
+    def remove_journal(self, key):
+        try: os.remove(self._journal_path(key))
+        except FileNotFoundError: pass
+
+    def close(self):
+        """Finishes queued journal writes and saves, then stops the worker."""
+        with self._cond: self._closed = True; self._cond.notify()
+        self._thread.join(timeout=5.0)
+        self._wakeup.close()
+
+
+ShellSession = namedtuple("ShellSession", "process master_fd slave_fd")
+
+
+class ShellSupervisor:
+    """Starts shell sessions off the Tk thread and keeps one pre-forked standby shell ready for start() to hand out.
+    retire() tears a session down on a background thread, so a restart never waits for the old shell."""
+    def __init__(self, root, on_spawned, prepare_fd=None):
+        self.on_spawned = on_spawned
+        self.prepare_fd = prepare_fd # called with each new master fd before the shell is forked (window size)
+        self._lock = threading.Lock()
+        self._resolved = {} # configured command -> resolved argv
+        self._standby = None # (key, ShellSession) ready to take over
+        self._standby_spawning = False
+        self._last = None # (shell_cmd, env) of the last start, what replenish() pre-forks
+        self._results = deque()
+        self._wakeup = TkWakeup(root, self._deliver)
+        self._closed = False
+
+    @staticmethod
+    def _find(cmd_path):
+        """Path of an executable command (searched on PATH unless absolute), or None."""
+        if not cmd_path: return None
+        if os.path.isabs(cmd_path): return cmd_path if os.path.exists(cmd_path) and os.access(cmd_path, os.X_OK) else None
+        for pdir in os.environ.get("PATH", os.defpath).split(os.pathsep):
+            fp = os.path.join(pdir, cmd_path)
+            if os.path.exists(fp) and os.access(fp, os.X_OK): return fp
+            if sys.platform == "win32":
+                for ext in ['.exe', '.cmd', '.bat', '.com']:
+                    if os.path.exists(fp + ext) and os.access(fp + ext, os.X_OK): return fp + ext
+        return None
+
+    def resolve(self, shell_cmd):
+        """Returns the argv to run: shell_cmd, or the system default if it is not executable. Raises FileNotFoundError."""
+        key = tuple(shell_cmd or ())
+        resolved = self._resolved.get(key)
+        if resolved is not None and self._find(resolved[0]): return resolved # one stat instead of a PATH scan
+        path = self._find(shell_cmd[0]) if shell_cmd else None
+        if path: resolved = [path] + list(shell_cmd[1:])
+        else:
+            print(f"Configured shell '{shell_cmd[0] if shell_cmd and shell_cmd[0] else 'N/A'}' not found/executable. Falling back to system default.")
+            fallback = "sh" if sys.platform != "win32" else "cmd.exe"
+            path = self._find(fallback)
+            if not path: raise FileNotFoundError(f"Fallback '{fallback}' not found.")
+            resolved = [path]
+        self._resolved[key] = resolved
+        return resolved
+
+    def start(self, shell_cmd, env, owner=None):
+        """Returns the standby session if one matches, else spawns in the background and returns None;
+        on_spawned(owner, session, error) then follows on the Tk thread."""
+        self._last = (shell_cmd, env)
+        with self._lock: standby, self._standby = self._standby, None
+        if standby is not None:
+            key, session = standby
+            if key == (tuple(shell_cmd), tuple(sorted(env.items()))) and session.process.poll() is None: return session
+            self.retire(session) # the configured shell changed, or the standby died
+        threading.Thread(target=self._spawn_job, args=(shell_cmd, env, False, owner), daemon=True, name="shell-spawn").start()
+        return None
+
+    def replenish(self):
+        """Pre-forks a standby for the last started command, unless one is ready or on its way."""
+        with self._lock:
+            if self._last is None or self._closed or self._standby is not None or self._standby_spawning: return
+            self._standby_spawning = True
+        threading.Thread(target=self._spawn_job, args=(*self._last, True), daemon=True, name="shell-standby").start()
+
+    def _spawn(self, shell_cmd, env):
+        master_fd = slave_fd = None
+        try:
+            master_fd, slave_fd = pty.openpty()
+            if self.prepare_fd: self.prepare_fd(master_fd)
+            if sys.platform != "win32": flags = fcntl.fcntl(master_fd, fcntl.F_GETFL); fcntl.fcntl(master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            # start_new_session instead of preexec_fn=os.setsid: same effect, and lets subprocess use vfork
+            process = subprocess.Popen(shell_cmd, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd, start_new_session=(sys.platform != "win32"), close_fds=True, env=env)
+            if sys.platform != "win32": os.close(slave_fd); slave_fd = None # the child holds its copy; closing ours lets the reader see EOF/EIO when it exits
+            return ShellSession(process, master_fd, slave_fd)
+        except Exception:
+            for fd in (master_fd, slave_fd):
+                if fd is not None:
+                    try: os.close(fd)
+                    except OSError: pass
+            raise
+
+    def _spawn_job(self, shell_cmd, env, standby, owner=None):
+        try: session, error = self._spawn(shell_cmd, env), None
+        except Exception as e: session, error = None, e
+        if not standby: self._results.append((owner, session, error)); self._wakeup.notify(); return
+        with self._lock:
+            self._standby_spawning = False
+            if session is not None and not self._closed: self._standby = ((tuple(shell_cmd), tuple(sorted(env.items()))), session); session = None
+        if error is not None: print(f"[-] Could not pre-fork standby shell: {error}")
+        if session is not None: self.retire(session) # closed while spawning
+        else: print("[+] Standby shell ready.")
+
+    def _deliver(self):
+        while self._results:
+            owner, session, error = self._results.popleft()
+            if self._closed:
+                if session is not None: self.retire(session)
+                continue
+            self.on_spawned(owner, session, error)
+
+    def retire(self, session, reader_thread=None):
+        """Terminates a session's process group and closes its PTY on a background thread. Returns at once."""
+        threading.Thread(target=self._teardown, args=(session, reader_thread), daemon=True, name="shell-retire").start()
+
+    @staticmethod
+    def _teardown(session, reader_thread=None, timeout=0.5):
+        process, master_fd, slave_fd = session
+        if process is not None and process.poll() is None:
+            try:
+                if sys.platform != "win32":
+                    pgid = os.getpgid(process.pid)
+                    for sig in (signal.SIGHUP, signal.SIGTERM): os.killpg(pgid, sig) # interactive shells ignore SIGTERM but exit on hangup, as when a terminal closes
+                else: process.terminate()
+                process.wait(timeout=timeout)
+            except (ProcessLookupError, PermissionError, OSError): pass
+            except subprocess.TimeoutExpired:
+                print(f"[-] Shell {process.pid} unresponsive, sending SIGKILL.")
+                try:
+                    if sys.platform != "win32": os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+                    else: process.kill()
+                    process.wait(timeout=timeout)
+                except Exception as kill_e: print(f"[!] Error sending SIGKILL: {kill_e}")
+        if reader_thread is not None and reader_thread.is_alive():
+            reader_thread.join(timeout=2.0)
+            if reader_thread.is_alive(): print("[!] Old reader thread still running; leaving its PTY open."); return # closing could hand its fd number to someone else
+        for fd in (master_fd, slave_fd):
+            if fd is not None:
+                try: os.close(fd)
+                except OSError: pass
+
+    def close(self):
+        """Kills the standby shell. Sessions already being retired finish on their own threads."""
+        with self._lock: self._closed = True; standby, self._standby = self._standby, None
+        if standby is not None: self._teardown(standby[1], timeout=0.2)
+        self._wakeup.close()
+
+
+class SessionRecorder:
+    """Append-only, timestamped transcript of a PTY's raw output: independently decompressible gzip frames plus a sparse .idx time index.
+    write() only queues; a thread of its own compresses and writes, and output beyond max_pending is dropped as a GAP record."""
+    RECORD = struct.Struct("<dBI")
+    INDEX = struct.Struct("<dQQ")
+    OUTPUT, META, GAP = 0, 1, 2
+    FRAME_BYTES = 256 * 1024
+    FRAME_SECONDS = 1.0
+    SUFFIX = ".nsrec"
+
+    def __init__(self, path, meta=None, max_pending=64 << 20, level=6):
+        self.path = path
+        self.max_pending = max_pending
+        self.level = level
+        self.bytes_recorded = 0 # payload bytes handed to write()
+        self.bytes_written = 0 # compressed bytes on disk
+        self.dropped = 0
+        self._t0 = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue = deque() # (t, kind, payload)
+        self._pending = 0
+        self._gap = 0 # dropped since the writer last drained the queue
+        self._closing = False
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        self._file = create_private(path) # never overwrites an earlier recording; owner-only, it holds everything the shell printed
+        self._index = create_private(path + ".idx")
+        self._offset = self._stream_offset = 0
+        self.meta(dict(meta or {}, started=time.time(), format=1))
+        self._thread = threading.Thread(target=self._run, daemon=True, name="session-recorder"); self._thread.start()
+
+    def write(self, data):
+        """Queues raw PTY output. Any thread; never blocks on I/O."""
+        t = time.monotonic() - self._t0
+        with self._cond:
+            if self._closing: return
+            if self._pending + len(data) > self.max_pending: self._gap += len(data); self.dropped += len(data); return
+            self._queue.append((t, self.OUTPUT, data)); self._pending += len(data); self.bytes_recorded += len(data)
+            if self._pending >= self.FRAME_BYTES: self._cond.notify()
+
+    def meta(self, info):
+        """Queues a metadata record (a JSON object): the session header, a terminal resize."""
+        data = json.dumps(info).encode()
+        with self._cond:
+            if not self._closing: self._queue.append((time.monotonic() - self._t0, self.META, data))
+
+    def _run(self):
+        frame = bytearray(); frame_t = None; frame_opened = 0.0
+        while True:
+            with self._cond:
+                if not self._queue and not self._closing: self._cond.wait(self.FRAME_SECONDS)
+                items = list(self._queue); self._queue.clear(); self._pending = 0
+                gap, self._gap = self._gap, 0
+                closing = self._closing
+            if gap: items.insert(0, (items[0][0] if items else time.monotonic() - self._t0, self.GAP, struct.pack("<Q", gap)))
+            for t, kind, data in items:
+                if frame_t is None: frame_t = t; frame_opened = time.monotonic()
+                frame += self.RECORD.pack(t, kind, len(data)); frame += data
+                if len(frame) >= self.FRAME_BYTES: self._write_frame(frame, frame_t); frame = bytearray(); frame_t = None
+            if frame and (closing or time.monotonic() - frame_opened >= self.FRAME_SECONDS): self._write_frame(frame, frame_t); frame = bytearray(); frame_t = None
+            if closing: break
+        for f in (self._file, self._index):
+            try: f.close()
+            except OSError: pass
+
+    def _write_frame(self, frame, frame_t):
+        if self._file.closed: return
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31) # wbits 31: a gzip member
+        data = compressor.compress(frame) + compressor.flush()
+        try:
+            self._file.write(data); self._file.flush() # data before its index entry, so an entry never points past the file
+            self._index.write(self.INDEX.pack(frame_t, self._offset, self._stream_offset)); self._index.flush()
+        except OSError as e: print(f"[!] Session recording to {self.path} failed, stopping it: {e}"); self._file.close(); return
+        self._offset += len(data); self._stream_offset += len(frame); self.bytes_written += len(data)
+
+    def close(self, wait=False):
+        """Flushes what is queued and closes the files on the recorder's thread."""
+        with self._cond: self._closing = True; self._cond.notify()
+        if wait: self._thread.join(timeout=5.0)
+
+
+class SessionRecording:
+    """Reader for a SessionRecorder transcript: records from any point in time on, and text search."""
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path + ".idx", "rb") as f: raw = f.read()
+        except FileNotFoundError: raw = b"" # no index: read from the start
+        size = SessionRecorder.INDEX.size
+        self.frames = [SessionRecorder.INDEX.unpack_from(raw, i) for i in range(0, len(raw) - size + 1, size)] # (time, file offset, stream offset)
+        self._times = [frame[0] for frame in self.frames]
+
+    def _frames_from(self, offset):
+        """Decompressed frames from a file offset on; stops quietly at a truncated last frame."""
+        with open(self.path, "rb") as f:
+            f.seek(offset); data = b""
+            while True:
+                decompressor = zlib.decompressobj(31); parts = []
+                while not decompressor.eof:
+                    if not data:
+                        data = f.read(1 << 16)
+                        if not data: return
+                    try: parts.append(decompressor.decompress(data))
+                    except zlib.error: return
+                    data = decompressor.unused_data
+                yield b"".join(parts)
+
+    def records(self, start=0.0):
+        """Yields (time, kind, payload) for every record at or after start seconds."""
+        i = bisect.bisect_right(self._times, start) - 1
+        offset = self.frames[i][1] if i >= 0 else 0
+        record = SessionRecorder.RECORD
+        for frame in self._frames_from(offset):
+            pos = 0
+            while pos + record.size <= len(frame):
+                t, kind, n = record.unpack_from(frame, pos); pos += record.size
+                if t >= start: yield t, kind, frame[pos:pos + n]
+                pos += n
+
+    def meta(self):
+        """The header record written when the recording started."""
+        for t, kind, data in self.records():
+            if kind == SessionRecorder.META: return json.loads(data)
+        return {}
+
+    def search(self, pattern, start=0.0, end=None):
+        """Yields (time, line) for output lines matching a regex, with escape sequences stripped."""
+        regex = re.compile(pattern) if isinstance(pattern, str) else pattern
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace"); stripper = AnsiStripper()
+        line, line_t = "", None
+        for t, kind, data in self.records(start):
+            if end is not None and t > end: break
+            if kind != SessionRecorder.OUTPUT: continue
+            for item in stripper.feed(decoder.decode(data)):
+                if item is CLEAR_SCREEN: continue
+                parts = item.split("\n")
+                if line_t is None: line_t = t
+                for part in parts[:-1]:
+                    line += part
+                    if regex.search(line): yield line_t, line
+                    line, line_t = "", t
+                line += parts[-1]
+        if line and regex.search(line): yield line_t, line
+
+
+def replay_recording(path, start=0.0, speed=1.0, max_idle=2.0, out=None):
+    """Writes a recording's output to out (stdout) with its original timing, idle gaps capped at max_idle; speed 0 means no delays."""
+    out = out or sys.stdout.buffer
+    clock = 0.0; prev = None; wall0 = time.monotonic()
+    for t, kind, data in SessionRecording(path).records(start):
+        if kind != SessionRecorder.OUTPUT: continue
+        if speed > 0:
+            if prev is not None: clock += min(t - prev, max_idle) / speed
+            delay = wall0 + clock - time.monotonic()
+            if delay > 0: time.sleep(delay)
+        prev = t
+        out.write(data); out.flush()
+
+
+class TerminalSession:
+    """One shell session: its PTY, output interpretation, scrollback history and command history.
+    Output is queued per session; only the session shown in the terminal view is rendered."""
+    def __init__(self, sid, scrollback, output_buffer, screen=None):
+        self.sid = sid
+        self.name = f"{sid}"
+        self.process = None
+        self.master_fd = None
+        self.slave_fd = None
+        self.reader_thread = None # Windows only; elsewhere the app's PtyIOLoop reads the PTY
+        self.spawning = False
+        self.stripper = AnsiStripper()
+        self.screen = screen # TerminalScreen, or None when escapes are just stripped
+        self.scrollback = scrollback
+        self.output_buffer = output_buffer
+        self.command_history = []
+        self.history_index = -1
+        self.current_input_buffer = ""
+        self.input_text = "" # what was in the input line when another session was shown
+        self.view_first_line = 0 # first history line the widget showed when another session was shown
+        self.recorder = None # SessionRecorder when record_sessions is on
+
+    @property
+    def alive(self): return self.process is not None and self.process.poll() is None
+
+    def label(self):
+        command = os.path.basename(self.process.args[0]) if self.process is not None else "shell"
+        return f"{self.name}: {command}" + ("" if self.alive or self.spawning else " (ended)")
+
 
 class NoteShellApp:
-    def __init__(self, root):
+    def __init__(self, root, profile=None):
         self.root = root
+        self.profile = profile or StartupProfile()
+        self.profile.mark("imports + Tk")
+        self._startup_pending = {"preview", "shell"} # stages the startup profile waits for
         self.root.title("NotesShell")
         self.root.geometry("1200x800")
 
@@ -37,32 +2479,79 @@ class NoteShellApp:
         self.var_editor_font_size = tk.IntVar()
 
         self.load_config() # load/set defaults and update tk.vars
+        METRICS.enabled = self.config["metrics"] or self.config["metrics_log_interval_s"] > 0
+        self.profile.mark("config")
 
         # application state
         self.current_note = None
         self.is_dirty = False # flag for unsaved changes
-        self.md = markdown2.Markdown(extras=["fenced-code-blocks", "tables", "code-friendly", "footnotes"])
+        self._edit_generation = 0 # bumped on every editor change, lets autosave results tell whether they are current
+        self._journal_delay_ms = 400
+        self._journal_job_id = None
+        self._autosave_job_id = None
+        self.autosave = AutosaveJournal(self.root, os.path.join(self.app_data_dir, "journal"), self._on_autosaved)
+        self._note_loader = None # ChunkedTextLoader while a large note is streaming into the editor
+        self._note_partial = False # the editor holds a cut-off load of the note: read-only, and never saved
+        self._note_disk_sig = None # (mtime_ns, size) of the open note as last loaded or saved
+        self._disk_prompt_open = False
+        self._large_note_bytes = 0 # size of the open note when it is over large_note_bytes, else 0
+        self._large_preview_lines = 150 # lines rendered above and below the visible region of a large note
+        self._last_preview_html = None
+        self.preview_worker = PreviewRenderWorker(self.root, MarkdownPreviewEngine(), self._apply_preview_html)
 
-        # live preview debouncing state to prevent excessive rerenderings
-        self._preview_debounce_ms = 550 # in ms (should be made an option)
+        # live preview debouncing: short for small notes, scaled to the measured render cost for large ones
+        self._preview_debounce_min_ms = 120
+        self._preview_debounce_max_ms = 2000
+        self._preview_small_chars = 20000
+        self._preview_cost_ms = 0.0 # moving average of render + set_html time
+        self._preview_text_len = 0
         self._preview_update_job_id = None
 
         self.base_editor_font = ('Monospace', self.config.get("editor_font_size", 11))
-        self.preview_css_template = ''
+        self.preview_css_template = PREVIEW_CSS_TEMPLATE
 
-        # shell state
+        # shell sessions: all PTYs are read by one I/O thread, the terminal view shows self.session
         self.running = True
-        self.shell_process = None
-        self.master_fd = None
-        self.slave_fd = None
-        self.reader_thread = None
-        self.output_queue = queue.Queue()
-        self._poll_id = None
+        self.io_loop = PtyIOLoop() if sys.platform != "win32" else None
+        self.sessions = []
+        self._session_ids = iter(range(1, 1 << 30))
+        self._term_size = (24, 80) # rows, cols of the terminal view, shared by every session's PTY
+        self._sgr_tags = {} # screen attribute id -> Tk tag name, for the session on screen
+        self._screen_rows_drawn = 0
+        self._resize_job_id = None
+        self._poll_id = None # pending render frame
+        self._terminal_visible = False
+        self._flush_on_show = False
+        self._unread_job_id = None
+        self._render_frame_ms = 16 # minimum spacing between frames under sustained output
+        self._render_max_chars = 256 * 1024 # cap on text inserted per frame
+        self._last_frame_time = 0.0
+        self.render_stats = RenderStats()
+        self.diagnostics_window = None # Ctrl+Shift+D, see toggle_diagnostics
+        self._diagnostics_last = None # previous snapshot shown, the base for its rates
+        self._metrics_log_last = None
+        self.shell_supervisor = ShellSupervisor(self.root, self._on_shell_spawned, prepare_fd=self._set_pty_size)
 
-        # history attributes
-        self.command_history = []
-        self.history_index = -1
-        self.current_input_buffer = ""
+        # terminal scrollback: the widget keeps the newest scrollback_lines/bytes of the shown session, the full history lives in session.scrollback
+        self._widget_first_line = 0 # absolute scrollback line shown on widget line 1
+        self._widget_chars = 0
+        self._page_in_lines = 500
+
+        # scrollback find bar (Ctrl+Shift+F): an index of matching history lines, built by find_worker
+        self.find_bar = None
+        self.find_worker = None
+        self._find_regex = self._find_line_regex = None # index pattern (lowercase with _find_fold) / pattern for single lines
+        self._find_fold = False
+        self._find_lines = array('Q') # matching history lines of the shown session, ascending
+        self._find_indexed_end = 0 # history lines below this are in _find_lines
+        self._find_searching = False
+        self._find_current = None # (absolute line, start column, end column) of the match shown
+        self._find_job_id = self._find_highlight_job = None
+        self._history_view = None # (first, end) history lines the widget shows instead of live output, to reach an old match
+        self._ended_shells = deque() # (session, fd) whose shell hung up, for the Tk thread to close
+        self._output_wakeup = TkWakeup(self.root, self._on_output_ready)
+        self.session_bar = None
+        self.session = self._new_session()
 
         # F11 double-press state
         self._last_f11_time = 0
@@ -71,25 +2560,80 @@ class NoteShellApp:
 
         # notes filtering state
         self._all_notes = []
+        self._notes_dir_cache = NotesDirectoryCache(self.notes_dir)
+        self._filter_state = (None, None, []) # (query, _all_notes object, filename matches) of the last filter
+        self._meta_updates = deque() # {name: NoteMeta or None} batches from the index thread
+        self._meta_wakeup = TkWakeup(self.root, self._on_metadata_changed)
+        self._content_search = None # (generation, query, names shown) of the content search the sidebar waits for
+        self._search_result = None # (generation, names) from the index thread
+        self._search_wakeup = TkWakeup(self.root, self._on_search_result)
+        self.note_index = NoteIndex(os.path.join(self.app_data_dir, "index.db"), on_changed=self._queue_metadata, on_search=self._queue_search_result)
+        self._note_meta = self.note_index.metadata() # cached titles/snippets/mtimes, validated by the index sync in the background
+        self._meta_version = 0
+        self._recent_order = (None, -1, []) # (_all_notes object, _meta_version, names newest first)
         self.filter_entry = None
         self.delete_button = None
+        self.preview = None # built after the first frame, see _build_preview
+        self.terminal_container = self.terminal_input = self.terminal_output = None # built on first use, see _ensure_terminal
+        self.input_queue_label = None
+        self._input_queue_job_id = None
+        self._settings_built = False
+        self.notes_watcher = None
+        self.profile.mark("state + index metadata")
 
+        # staged startup: only what the first frame shows is built here; the rest follows in _finish_startup
         self.style = ttk.Style(root)
         self.apply_theme()
         self.setup_ui()
         self.setup_key_bindings()
+        self.profile.mark("editor + sidebar UI")
         self.load_notes()
         self._apply_editor_font_size() # apply initial font size
+        self.profile.mark("notes list")
+        self.text_editor.bind("<Map>", self._on_first_map, add='+')
+        self._first_frame_done = False
+        self.root.after(2000, self._on_first_frame) # in case the window starts unmapped (iconified, other desktop)
 
-        self._schedule_initial_shell_start()
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self._update_save_status() # initial status update
 
+    def _on_first_map(self, event=None):
+        self.text_editor.unbind("<Map>")
+        self.root.after_idle(self._on_first_frame) # Tk redraws in idle callbacks queued ahead of this one
+
+    def _on_first_frame(self):
+        if self._first_frame_done: return
+        self._first_frame_done = True
+        self.profile.mark("first frame")
+        self.root.after(1, self._finish_startup) # let the frame reach the screen and input through first
+
+    def _finish_startup(self):
+        """Second startup stage, after the editor is on screen: background work, the preview and the shell."""
+        self._schedule_initial_shell_start() # spawns on a background thread
+        self.note_index.sync(self.notes_dir) # catches up on notes changed while the app was closed, in the background
+        self.notes_watcher = NotesWatcher(self.root, self.notes_dir, self._on_notes_changed)
+        self.profile.mark("shell spawn + watchers queued")
+        self._build_preview()
+        self.profile.mark("preview (tkhtmlview)")
+        self._recover_autosave_journals()
+        if self.config["metrics_log_interval_s"]: self.root.after(int(self.config["metrics_log_interval_s"] * 1000), self._log_metrics)
+        self._startup_pending.discard("preview"); self._report_startup()
+
+    def _report_startup(self):
+        if not self._startup_pending and self.profile.enabled: self.profile.report(); self.profile.enabled = False
+
     def load_config(self):
         default_shell = ["bash", "--norc"] if sys.platform != "win32" else ["cmd.exe"]
         default_theme = 'clam'
         default_font_size = 11
-        default_config = {"shell_cmd": default_shell, "term_bg": "#f0f0f0", "term_fg": "#333333", "show_help": True, "theme": default_theme, "editor_font_size": default_font_size}
+        default_config = {"shell_cmd": default_shell, "term_bg": "#f0f0f0", "term_fg": "#333333", "show_help": True, "theme": default_theme, "editor_font_size": default_font_size,
+                          "scrollback_lines": 5000, "scrollback_bytes": 2 * 1024 * 1024, "history_bytes": 64 * 1024 * 1024, "scrollback_spill": False,
+                          "background_buffer_bytes": 4 * 1024 * 1024, "background_overflow": "tail",
+                          "autosave": True, "autosave_delay_ms": 2000,
+                          "large_note_bytes": 2 * 1024 * 1024, "large_note_preview": "visible", "sidebar_sort": "name",
+                          "terminal_emulation": True, "warm_standby_shell": True,
+                          "record_sessions": False, "recordings_dir": "", "metrics": False, "metrics_log_interval_s": 0,
+                          "editor_highlight": True}
 
         config_loaded = {}
         if os.path.exists(self.config_path):
@@ -107,8 +2651,21 @@ class NoteShellApp:
         if not isinstance(self.config.get("term_fg"), str): self.config["term_fg"] = default_config["term_fg"]
         if not isinstance(self.config.get("show_help"), bool): self.config["show_help"] = default_config["show_help"]
         if not isinstance(self.config.get("theme"), str): self.config["theme"] = default_config["theme"]
-        try: self.config["editor_font_size"] = int(self.config.get("editor_font_size"))
-        except (ValueError, TypeError): self.config["editor_font_size"] = default_config["editor_font_size"]
+        for key in ("editor_font_size", "scrollback_lines", "scrollback_bytes", "history_bytes", "background_buffer_bytes", "autosave_delay_ms", "large_note_bytes"):
+            try: self.config[key] = int(self.config.get(key))
+            except (ValueError, TypeError): self.config[key] = default_config[key]
+        if not isinstance(self.config.get("scrollback_spill"), bool): self.config["scrollback_spill"] = default_config["scrollback_spill"]
+        if not isinstance(self.config.get("autosave"), bool): self.config["autosave"] = default_config["autosave"]
+        if not isinstance(self.config.get("terminal_emulation"), bool): self.config["terminal_emulation"] = default_config["terminal_emulation"]
+        if not isinstance(self.config.get("warm_standby_shell"), bool): self.config["warm_standby_shell"] = default_config["warm_standby_shell"]
+        if not isinstance(self.config.get("record_sessions"), bool): self.config["record_sessions"] = default_config["record_sessions"]
+        if not isinstance(self.config.get("recordings_dir"), str): self.config["recordings_dir"] = default_config["recordings_dir"]
+        if not isinstance(self.config.get("metrics"), bool): self.config["metrics"] = default_config["metrics"]
+        if not isinstance(self.config.get("editor_highlight"), bool): self.config["editor_highlight"] = default_config["editor_highlight"]
+        if not isinstance(self.config.get("metrics_log_interval_s"), (int, float)) or isinstance(self.config.get("metrics_log_interval_s"), bool) or self.config["metrics_log_interval_s"] < 0: self.config["metrics_log_interval_s"] = default_config["metrics_log_interval_s"]
+        if self.config.get("sidebar_sort") not in ("name", "recent"): self.config["sidebar_sort"] = default_config["sidebar_sort"]
+        if self.config.get("large_note_preview") not in ("visible", "off"): self.config["large_note_preview"] = default_config["large_note_preview"]
+        if self.config.get("background_overflow") not in OutputBuffer.OVERFLOW_POLICIES: self.config["background_overflow"] = default_config["background_overflow"]
 
         # update tk.vars AFTER self.config is finalized
         self.var_shell_cmd.set(" ".join(self.config["shell_cmd"]))
@@ -157,7 +2714,12 @@ class NoteShellApp:
     def apply_terminal_colors(self):
         bg = self.config.get("term_bg", "#f0f0f0")
         fg = self.config.get("term_fg", "#333333")
-        if hasattr(self, 'terminal_output') and self.terminal_output.winfo_exists(): self.terminal_output.config(bg=bg, fg=fg, insertbackground=fg)
+        if self.terminal_output and self.terminal_output.winfo_exists():
+            self.terminal_output.config(bg=bg, fg=fg, insertbackground=fg)
+            if self.session.screen is not None: # reverse video and the cursor are drawn in the default colours
+                self.terminal_output.tag_configure("term_cursor", background=fg, foreground=bg)
+                for tag in self._sgr_tags.values(): self.terminal_output.tag_delete(tag)
+                self._sgr_tags.clear(); self.session.screen.mark_all_dirty(); self.start_polling_output()
         print("Terminal colors updated (config value).")
 
     def apply_help_visibility(self):
@@ -172,7 +2734,9 @@ class NoteShellApp:
         try:
             size = self.config.get("editor_font_size", 11)
             new_font = ('Monospace', size)
-            if hasattr(self, 'text_editor') and self.text_editor.winfo_exists(): self.text_editor.config(font=new_font)
+            if hasattr(self, 'text_editor') and self.text_editor.winfo_exists():
+                self.text_editor.config(font=new_font)
+                if self.highlighter: self.highlighter.set_font(new_font)
             self.base_editor_font = new_font
             print(f"[+] Editor font size set to {size}pt.")
             # trigger preview update AFTER applying editor size
@@ -198,6 +2762,8 @@ class NoteShellApp:
         ttk.Button(self.toolbar, text="Save As...", command=self.save_note_as).pack(side=tk.LEFT, padx=2)
         self.help_label = ttk.Label(self.toolbar, text=" | F12: Term | F11x2: RShell | Ctrl+/-/0: Size", font=('Arial', 9, 'italic'), foreground="#666")
         self.apply_help_visibility() # Apply initial state
+        self.unread_label = ttk.Label(self.toolbar, text="", font=('Arial', 9), foreground="#999") # unread terminal output, packed only when non-zero
+        self.load_progress = ttk.Progressbar(self.toolbar, length=120, mode="determinate", maximum=100) # packed only while a large note loads
 
         # Notebook for tabs
         self.notebook = ttk.Notebook(self.root)
@@ -217,13 +2783,22 @@ class NoteShellApp:
         self.filter_entry.bind("<FocusOut>", self._restore_filter_placeholder)
         self.filter_entry.bind("<KeyRelease>", self.filter_notes)
 
-        self.notes_list = tk.Listbox(self.sidebar_frame, font=('Arial', 11), borderwidth=0, highlightthickness=0, selectbackground="#e9ecef", selectforeground="#000000", activestyle='none')
+        self.sort_combo = ttk.Combobox(self.sidebar_frame, values=("Sort by name", "Sort by recent"), state="readonly", font=('Arial', 9))
+        self.sort_combo.current(1 if self.config.get("sidebar_sort") == "recent" else 0)
+        self.sort_combo.pack(fill=tk.X, padx=5, pady=(0, 2))
+        self.sort_combo.bind("<<ComboboxSelected>>", self._on_sort_changed)
+
+        self.notes_list = VirtualListbox(self.sidebar_frame, display=self._note_row_text, font=('Arial', 11), borderwidth=0, highlightthickness=0, selectbackground="#e9ecef", selectforeground="#000000", activestyle='none')
         self.notes_list.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 2))
         self.notes_list.bind("<<ListboxSelect>>", self.load_note_content)
 
+        self.note_details = ttk.Label(self.sidebar_frame, text="", font=('Arial', 9), foreground="#666", wraplength=190, justify=tk.LEFT)
+        self.note_details.pack(fill=tk.X, padx=5, pady=(0, 2))
+
         self.delete_button = ttk.Button(self.sidebar_frame, text="Delete Selected", command=self.delete_selected_note, state=tk.DISABLED)
         self.delete_button.pack(fill=tk.X, padx=5, pady=(0, 5))
         self.notes_list.bind("<<ListboxSelect>>", lambda e: self._update_delete_button_state(), add='+')
+        self.notes_list.bind("<<ListboxSelect>>", lambda e: self._update_note_details(), add='+')
 
         self.paned = ttk.PanedWindow(self.notes_tab_frame, orient=tk.HORIZONTAL)
         self.paned.pack(fill=tk.BOTH, expand=True, pady=(5,0))
@@ -231,21 +2806,34 @@ class NoteShellApp:
         self.editor_frame = ttk.Frame(self.paned)
         self.text_editor = tk.Text(self.editor_frame, wrap=tk.WORD, font=self.base_editor_font, padx=10, pady=10, undo=True, borderwidth=0, bg="#ffffff", fg="#333333", insertbackground="#333333")
         self.text_editor.pack(fill=tk.BOTH, expand=True)
+        self.highlighter = MarkdownHighlighter(self.text_editor, self.base_editor_font) if self.config["editor_highlight"] else None
         self.paned.add(self.editor_frame, weight=1)
 
-        self.preview_frame = ttk.Frame(self.paned, style='Preview.TFrame')
-        self.preview = HTMLLabel(self.preview_frame, background="#ffffff", padx=10, pady=10)
-        self.preview.pack(fill=tk.BOTH, expand=True)
+        self.preview_frame = ttk.Frame(self.paned, style='Preview.TFrame') # the HTMLLabel itself comes with _build_preview
         self.paned.add(self.preview_frame, weight=1)
 
         # editor change binding
         self.text_editor.bind("<KeyRelease>", self._on_editor_change)
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>", "<ButtonRelease-1>", "<Configure>"): self.text_editor.bind(seq, self._on_editor_view_change, add='+')
         # <<Modified>> is implicitly handled by setting the dirty flag in _on_editor_change
 
-        # Settings Tab
+        # Settings Tab, filled in on first selection
         self.settings_tab_frame = ttk.Frame(self.notebook, padding="10")
         self.notebook.add(self.settings_tab_frame, text=' Settings ')
+        self.notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed)
+
+    def _on_tab_changed(self, event=None):
+        if not self._settings_built and self.notebook.select() == str(self.settings_tab_frame): self._build_settings_tab()
+
+    def _build_preview(self):
+        if self.preview is not None: return
+        from tkhtmlview import HTMLLabel # imports requests and friends; kept off the first frame
+        self.preview = HTMLLabel(self.preview_frame, background="#ffffff", padx=10, pady=10)
+        self.preview.pack(fill=tk.BOTH, expand=True)
+        self.update_live_preview()
 
+    def _build_settings_tab(self):
+        self._settings_built = True
         settings_content_frame = ttk.LabelFrame(self.settings_tab_frame, text="Configuration", padding="10")
         settings_content_frame.pack(fill=tk.BOTH, expand=True)
         settings_content_frame.columnconfigure(1, weight=1)
@@ -279,18 +2867,92 @@ class NoteShellApp:
 
         ttk.Button(settings_content_frame, text="Save Settings", command=self.save_config).grid(row=6, column=0, columnspan=4, pady=20)
 
-        # setup Terminal widgets (but don't pack)
-        self.setup_terminal()
-
     def _on_editor_change(self, event=None):
+        if self._note_loader or self._note_partial: return # read-only until the note has finished loading
         if not self.is_dirty:
              self.is_dirty = True
              self._update_save_status()
+        self._edit_generation += 1
         self._debounced_update()
+        self._schedule_autosave()
+
+    def _on_editor_view_change(self, event=None):
+        if self._large_note_bytes and self.config.get("large_note_preview") == "visible": self._debounced_update() # the previewed region follows the view
+
+    def _journal_key(self): return self.current_note or AutosaveJournal.UNTITLED
+
+    def _schedule_autosave(self):
+        if self._journal_job_id: self.root.after_cancel(self._journal_job_id)
+        self._journal_job_id = self.root.after(self._journal_delay_ms, self._journal_edits)
+        if self.config.get("autosave") and self.current_note:
+            if self._autosave_job_id: self.root.after_cancel(self._autosave_job_id)
+            self._autosave_job_id = self.root.after(max(self.config.get("autosave_delay_ms", 2000), self._journal_delay_ms), self._autosave_now)
+
+    def _cancel_autosave_jobs(self):
+        for job in (self._journal_job_id, self._autosave_job_id):
+            if job: self.root.after_cancel(job)
+        self._journal_job_id = self._autosave_job_id = None
+
+    def _journal_edits(self):
+        self._journal_job_id = None
+        if self.is_dirty: self.autosave.record(self._journal_key(), self.current_note, self.text_editor.get("1.0", "end-1c"))
+
+    def _autosave_now(self):
+        self._autosave_job_id = None
+        if not (self.is_dirty and self.current_note): return
+        content = self.text_editor.get("1.0", tk.END).strip()
+        self.autosave.save(self.current_note, os.path.join(self.notes_dir, self.current_note), content + "\n", self._edit_generation)
+
+    def _on_autosaved(self, key, generation, text, error):
+        if error: self.root.title(f"NotesShell - {key} (autosave failed)"); return
+        path = os.path.join(self.notes_dir, key)
+        try: self.note_index.update(key, text, os.stat(path))
+        except OSError: pass
+        if key == self.current_note: self._note_disk_sig = self.autosave.written.get(path, self._note_disk_sig)
+        if key == self.current_note and generation == self._edit_generation:
+            self.autosave.checkpoint(key); self.is_dirty = False; self._update_save_status(); self.text_editor.edit_modified(False)
+
+    def _discard_journal(self):
+        self._cancel_autosave_jobs()
+        self.autosave.discard(self._journal_key(), os.path.join(self.notes_dir, self.current_note) if self.current_note else None, self._edit_generation)
+
+    def _recover_autosave_journals(self):
+        """Offers to restore edits that were journaled but never saved (the app crashed or was killed)."""
+        pending = []
+        for key, note, text, mtime in self.autosave.recover():
+            path = os.path.join(self.notes_dir, note) if note else None
+            try:
+                if path and os.path.exists(path):
+                    with open(path, "r", encoding="utf-8") as f:
+                        if f.read().strip() == text.strip(): self.autosave.remove_journal(key); continue # it did get saved
+            except OSError: pass
+            if text.strip(): pending.append((key, note, text, mtime))
+            else: self.autosave.remove_journal(key)
+        if not pending: return
+        names = ", ".join(note or "Untitled" for _, note, _, _ in pending[:5]) + (" ..." if len(pending) > 5 else "")
+        if not messagebox.askyesno("Recover Unsaved Changes", f"Unsaved changes were found for: {names}\n\nRestore them as new notes? (No discards them.)"):
+            for key, *_ in pending: self.autosave.remove_journal(key)
+            return
+        restored = []
+        for key, note, text, mtime in pending:
+            stem = note[:-3] if note and note.endswith(".md") else (note or "Untitled")
+            fname = f"{stem} (recovered {time.strftime('%Y-%m-%d %H%M', time.localtime(mtime))}).md"
+            try:
+                os.makedirs(self.notes_dir, exist_ok=True)
+                atomic_write(os.path.join(self.notes_dir, fname), text.strip() + "\n")
+                self.autosave.remove_journal(key); restored.append(fname); print(f"[+] Recovered unsaved changes into {fname}")
+            except OSError as e: messagebox.showerror("Recovery Error", f"Could not restore {stem}:\n{e}")
+        if restored:
+            self._notes_dir_cache.invalidate(); self.load_notes()
+            if self.notes_list.select_item(restored[0]): self.load_note_content()
 
     def _debounced_update(self):
         if self._preview_update_job_id: self.root.after_cancel(self._preview_update_job_id)
-        self._preview_update_job_id = self.root.after(self._preview_debounce_ms, self._perform_update)
+        self._preview_update_job_id = self.root.after(self._preview_debounce_ms(), self._perform_update)
+
+    def _preview_debounce_ms(self):
+        if self._preview_text_len < self._preview_small_chars: return self._preview_debounce_min_ms
+        return int(min(self._preview_debounce_max_ms, max(self._preview_debounce_min_ms, 1.5 * self._preview_cost_ms)))
 
     def _perform_update(self):
         self._preview_update_job_id = None
@@ -303,14 +2965,85 @@ class NoteShellApp:
         if not self.filter_entry.get().strip(): self.filter_entry.insert(0, "Search notes..."); self.filter_entry.config()
 
     def filter_notes(self, event=None):
+        """Filename and title matches first (by name or most recent), shown at once; notes whose contents match follow, best first, from the index thread."""
+        t0 = time.perf_counter()
         query = self.filter_entry.get().lower().strip()
-        self.notes_list.delete(0, tk.END)
-        notes_to_display = sorted([fname for fname in self._all_notes if not query or query == "search notes..." or query in fname.lower()])
-        for fname in notes_to_display: self.notes_list.insert(tk.END, fname)
-        if self.current_note and self.current_note in notes_to_display:
-             try: idx = notes_to_display.index(self.current_note); self.notes_list.selection_clear(0, tk.END); self.notes_list.selection_set(idx); self.notes_list.activate(idx)
-             except ValueError: pass
-        self._update_delete_button_state()
+        if query == "search notes...": query = ""
+        last_query, last_notes, last_matches = self._filter_state
+        if not query: name_matches = self._all_notes
+        else:
+            meta = self._note_meta
+            def matches(fname): return query in fname.lower() or (fname in meta and query in meta[fname].title.lower()) # the sidebar shows titles
+            if last_notes is self._all_notes and last_query is not None and query.startswith(last_query): name_matches = [fname for fname in last_matches if matches(fname)] # narrow the previous result
+            else: name_matches = [fname for fname in self._all_notes if matches(fname)]
+        self._filter_state = (query, self._all_notes, name_matches)
+        if self.config.get("sidebar_sort") == "recent": name_matches = self._recent_first(name_matches)
+        if len(query) >= 2 and self.note_index.available: self._content_search = (self.note_index.search_async(query), query, name_matches)
+        elif self._content_search is not None: self._content_search = None; self.note_index.cancel_search()
+        self._show_notes(name_matches)
+        METRICS.observe("sidebar.filter", time.perf_counter() - t0)
+
+    def _show_notes(self, names):
+        self.notes_list.set_items(names)
+        if self.current_note: self.notes_list.select_item(self.current_note)
+        self._update_delete_button_state(); self._update_note_details()
+
+    def _recent_first(self, names):
+        """names ordered by cached modification time, newest first; the unfiltered order is cached."""
+        meta = self._note_meta
+        if names is not self._all_notes: return sorted(names, key=lambda n: meta[n].mtime_ns if n in meta else 0, reverse=True)
+        notes, version, order = self._recent_order
+        if notes is not self._all_notes or version != self._meta_version:
+            order = sorted(names, key=lambda n: meta[n].mtime_ns if n in meta else 0, reverse=True); self._recent_order = (self._all_notes, self._meta_version, order)
+        return order
+
+    def _on_sort_changed(self, event=None):
+        self.config["sidebar_sort"] = "recent" if self.sort_combo.current() == 1 else "name" # persisted with the other settings
+        self.filter_notes()
+
+    def _note_row_text(self, name):
+        meta = self._note_meta.get(name)
+        return meta.title if meta and meta.title else (name[:-3] if name.endswith(".md") else name)
+
+    def _update_note_details(self):
+        selection = self.notes_list.curselection()
+        meta = self._note_meta.get(self.notes_list.get(selection[0])) if selection else None
+        if not meta: self.note_details.config(text=""); return
+        modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(meta.mtime_ns / 1e9)) if meta.mtime_ns else "?"
+        self.note_details.config(text=f"{meta.words} words \u00b7 {modified}" + (f"\n{meta.snippet[:120]}" if meta.snippet else ""))
+
+    def _queue_metadata(self, changed):
+        """Called on the index thread."""
+        self._meta_updates.append(changed); self._meta_wakeup.notify()
+
+    def _on_metadata_changed(self):
+        changed = False; self._filter_state = (None, None, []) # titles may have changed, so don't narrow stale matches
+        while self._meta_updates:
+            for name, meta in self._meta_updates.popleft().items():
+                if meta is None: changed |= self._note_meta.pop(name, None) is not None
+                elif self._note_meta.get(name) != meta: self._note_meta[name] = meta; changed = True
+        if not changed or not hasattr(self, "notes_list"): return
+        self._meta_version += 1
+        if self.config.get("sidebar_sort") == "recent": self.filter_notes()
+        else: self.notes_list.redraw()
+        self._update_note_details()
+
+    def _queue_search_result(self, generation, names):
+        """Called on the index thread."""
+        self._search_result = (generation, names); self._search_wakeup.notify()
+
+    def _on_search_result(self):
+        result, self._search_result = self._search_result, None
+        if result is None or self._content_search is None or result[0] != self._content_search[0]: return # superseded by a later keystroke
+        generation, query, name_matches = self._content_search; self._content_search = None
+        shown = set(name_matches); known = self._all_notes_lookup()
+        content_matches = [name for name in result[1] if name not in shown and name in known]
+        if content_matches: self._show_notes(name_matches + content_matches)
+
+    def _all_notes_lookup(self):
+        """Set view of _all_notes, rebuilt only when the list object changes."""
+        if getattr(self, "_all_notes_set_src", None) is not self._all_notes: self._all_notes_set = set(self._all_notes); self._all_notes_set_src = self._all_notes
+        return self._all_notes_set
 
     def _update_delete_button_state(self):
         if self.delete_button and self.delete_button.winfo_exists():
@@ -324,7 +3057,9 @@ class NoteShellApp:
         path = os.path.join(self.notes_dir, filename)
         if messagebox.askyesno("Confirm Deletion", f"Delete '{filename}'?"):
             try:
+                if self.current_note == filename: self._discard_journal() # no autosave may resurrect it
                 os.remove(path); print(f"Deleted: {filename}")
+                self.note_index.remove(filename); self._notes_dir_cache.invalidate()
                 was_current = (self.current_note == filename)
                 self.load_notes() # reloads list and applies filter
                 if was_current: self.new_note(confirm_discard=False)
@@ -353,38 +3088,66 @@ class NoteShellApp:
         self._apply_editor_font_size()
 
     def update_live_preview(self, event=None):
-        try:
-            md_text = self.text_editor.get("1.0", tk.END).strip()
-            html_content = self.md.convert(md_text)
+        """Queues a preview render of the editor text; the result is applied by _apply_preview_html."""
+        if self.preview is None: return # _build_preview renders once the widget exists
+        md_text = self._large_note_markdown() if self._large_note_bytes else self.text_editor.get("1.0", tk.END).strip()
+        editor_size = self.config.get("editor_font_size", 11)
+        code_size = max(8, int(editor_size * 0.9)) # Code font size relative to editor
+        formatted_css = self.preview_css_template.format(size=editor_size, code_size=code_size)
+        self._preview_text_len = len(md_text)
+        self.preview_worker.submit(md_text, formatted_css)
 
-            editor_size = self.config.get("editor_font_size", 11)
-            code_size = max(8, int(editor_size * 0.9)) # Code font size relative to editor
-            formatted_css = self.preview_css_template.format(size=editor_size, code_size=code_size)
+    def _large_note_markdown(self):
+        """Preview source for a large note: only the lines around the editor's visible region, or just a notice."""
+        size = format_size(self._large_note_bytes)
+        if self.config.get("large_note_preview") != "visible": return f"*Preview is off for large notes ({size}).*"
+        top = int(self.text_editor.index("@0,0").split(".")[0])
+        bottom = int(self.text_editor.index(f"@0,{max(1, self.text_editor.winfo_height())}").split(".")[0])
+        start = f"{max(1, top - self._large_preview_lines)}.0"
+        end = self.text_editor.index(f"{bottom + self._large_preview_lines}.0 lineend")
+        cap = self.text_editor.index(f"{start} + 200000 chars") # a note with few, huge lines must not pull the whole file in
+        if self.text_editor.compare(cap, "<", end): end = cap
+        last = int(end.split(".")[0])
+        return f"*Large note ({size}): previewing lines {start.split('.')[0]}-{last}.*\n\n" + self.text_editor.get(start, end).strip()
 
-            # wrap in proper HTML structure
-            full_html = f"<!DOCTYPE html><html><head>{formatted_css}</head><body>{html_content}</body></html>"
-
-            if self.preview and self.preview.winfo_exists():
-                self.preview.set_html(full_html) # Pass the full HTML string
-        except Exception as e:
-            print(f"Error updating preview: {e}")
+    def _apply_preview_html(self, full_html, render_ms):
+        t0 = time.perf_counter()
+        try:
+            if full_html == self._last_preview_html: return # nothing changed, keep the widget as is
             if self.preview and self.preview.winfo_exists():
-                self.preview.set_html(f"<pre>Error rendering Markdown:\n{e}</pre>")
+                scroll_pos = self.preview.yview()[0]
+                with METRICS.time("preview.set_html"): self.preview.set_html(full_html) # Pass the full HTML string
+                self.preview.yview_moveto(scroll_pos) # keep the reader's place
+                self._last_preview_html = full_html
+        except Exception as e: print(f"Error updating preview: {e}"); self._last_preview_html = None
+        finally:
+            cost_ms = render_ms + (time.perf_counter() - t0) * 1000
+            self._preview_cost_ms = cost_ms if not self._preview_cost_ms else 0.7 * self._preview_cost_ms + 0.3 * cost_ms
 
 
     def setup_terminal(self):
         self.terminal_container = ttk.Frame(self.root)
+        self.var_session = tk.IntVar(value=self.session.sid)
+        self.session_bar = ttk.Frame(self.terminal_container) # packed by _rebuild_session_bar once there are two sessions
         bg = self.config.get("term_bg", "#f0f0f0")
         fg = self.config.get("term_fg", "#333333")
         prompt_fg = "#666666"
         self.terminal_output = scrolledtext.ScrolledText(self.terminal_container, bg=bg, fg=fg, font=('Monospace', 10), wrap=tk.WORD, borderwidth=0, highlightthickness=0, insertbackground=fg)
         self.terminal_output.pack(fill=tk.BOTH, expand=True, padx=5, pady=(5, 0))
         self.terminal_output.configure(state='disabled')
+        if self.session.screen is not None:
+            # widget layout: scrollback history lines, then the screen rows from the "screen_start" mark on
+            self.terminal_output.configure(wrap=tk.NONE) # the screen wraps its own rows; a Tk wrap would break row = line
+            self.terminal_output.mark_set("screen_start", "1.0"); self.terminal_output.mark_gravity("screen_start", "left")
+            self.terminal_output.tag_configure("term_cursor", background=fg, foreground=bg)
+            self.terminal_output.bind("<Configure>", self._on_terminal_configure, add="+")
+            self._screen_rows_drawn = 0; self.session.screen.mark_all_dirty()
         self.input_frame = ttk.Frame(self.terminal_container)
         self.input_frame.pack(fill=tk.X, padx=5, pady=5)
         ttk.Label(self.input_frame, text="$", font=('Monospace', 10), foreground=prompt_fg).pack(side=tk.LEFT, padx=(0, 5))
         self.terminal_input = ttk.Entry(self.input_frame, font=('Monospace', 10))
         self.terminal_input.pack(fill=tk.X, expand=True)
+        self.input_queue_label = ttk.Label(self.input_frame, font=('Monospace', 9)) # packed while a large paste is still going into the PTY
         # Don't pack container initially
 
     def setup_key_bindings(self):
@@ -395,189 +3158,661 @@ class NoteShellApp:
         self.root.bind_all("<Control-equal>", lambda e: self._change_font_size(1))
         self.root.bind_all("<Control-minus>", lambda e: self._change_font_size(-1))
         self.root.bind_all("<Control-0>", self._reset_font_size)
+        self.root.bind_all("<Control-D>", self.toggle_diagnostics)
+
+    # diagnostics
+    def metrics_snapshot(self, since=None):
+        """METRICS.snapshot plus the app-side counters that are kept anyway (render stats, sessions, I/O loop)."""
+        snap = METRICS.snapshot(since)
+        snap["app"] = {"render": self.render_stats.snapshot(), "sessions": len(self.sessions), "preview_cost_ms": round(self._preview_cost_ms, 1),
+                       "pty_bytes_read": self.io_loop.bytes_read if self.io_loop is not None else None, "pty_bytes_written": self.io_loop.bytes_written if self.io_loop is not None else None,
+                       "dropped_while_hidden_chars": sum(session.output_buffer.dropped_chars for session in self.sessions)}
+        return snap
+
+    def _log_metrics(self):
+        if not self.running: return
+        self._metrics_log_last = snap = METRICS.snapshot(self._metrics_log_last)
+        print(f"[+] Metrics: {Metrics.summary_line(snap)}")
+        self.root.after(int(self.config["metrics_log_interval_s"] * 1000), self._log_metrics)
+
+    def toggle_diagnostics(self, event=None):
+        """Ctrl+Shift+D: shows or hides the live metrics window."""
+        if self.diagnostics_window is not None:
+            self.diagnostics_window.destroy(); self.diagnostics_window = None; return "break"
+        win = self.diagnostics_window = tk.Toplevel(self.root); win.title("NotesShell diagnostics"); win.geometry("640x520")
+        win.protocol("WM_DELETE_WINDOW", self.toggle_diagnostics)
+        win.bind("<Control-D>", self.toggle_diagnostics)
+        bar = ttk.Frame(win); bar.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        self.var_metrics_enabled = tk.BooleanVar(value=METRICS.enabled)
+        ttk.Checkbutton(bar, text="Collect metrics", variable=self.var_metrics_enabled, command=lambda: setattr(METRICS, "enabled", self.var_metrics_enabled.get())).pack(side=tk.LEFT)
+        ttk.Button(bar, text="Reset", command=lambda: (METRICS.reset(), self.render_stats.reset())).pack(side=tk.LEFT, padx=5)
+        ttk.Button(bar, text="Export JSON...", command=self.export_metrics).pack(side=tk.LEFT)
+        self._diagnostics_text = scrolledtext.ScrolledText(win, wrap=tk.NONE, font=('Monospace', 9), state='disabled')
+        self._diagnostics_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+        self._diagnostics_last = None; self._refresh_diagnostics()
+        return "break"
+
+    def _refresh_diagnostics(self):
+        """Redraws the diagnostics window once a second while it is open."""
+        if self.diagnostics_window is None or not self.diagnostics_window.winfo_exists(): self.diagnostics_window = None; return
+        snap = self._diagnostics_last = self.metrics_snapshot(self._diagnostics_last)
+        lines = [f"collecting: {'yes' if snap['enabled'] else 'no (tick Collect metrics)'}   uptime {snap['uptime_s']:.0f}s", "", "counters                          total        per second"]
+        lines += [f"  {name:28s} {value:12d} {snap['rates_per_s'][name]:14.1f}" for name, value in sorted(snap["counters"].items())]
+        lines += ["", "gauges"] + [f"  {name:28s} {value}" for name, value in sorted(snap["gauges"].items())]
+        lines += ["", f"latency (ms)                 {'count':>8s} {'mean':>8s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'max':>8s}"]
+        lines += [f"  {name:28s} {h['count']:8d} {h['mean_ms']:8.2f} {h['p50_ms']:8.2f} {h['p95_ms']:8.2f} {h['p99_ms']:8.2f} {h['max_ms']:8.2f}" for name, h in snap["latency_ms"].items()]
+        lines += ["", "app"] + [f"  {name:28s} {value}" for name, value in snap["app"].items()]
+        text = self._diagnostics_text; first = text.yview()[0]
+        text.configure(state='normal'); text.delete("1.0", tk.END); text.insert("1.0", "\n".join(lines)); text.configure(state='disabled'); text.yview_moveto(first)
+        self.diagnostics_window.after(1000, self._refresh_diagnostics)
 
+    def export_metrics(self):
+        path = filedialog.asksaveasfilename(parent=self.diagnostics_window, initialfile=f"notesshell-metrics-{time.strftime('%Y%m%d-%H%M%S')}.json", defaultextension=".json", filetypes=[("JSON Files", "*.json"), ("All Files", "*.*")])
+        if not path: return
+        try: atomic_write(path, json.dumps(self.metrics_snapshot(), indent=2) + "\n"); print(f"[+] Metrics exported to {path}")
+        except Exception as e: messagebox.showerror("Export Error", f"Failed to export metrics:\n{e}")
+
+    def _ensure_terminal(self):
+        """Builds the terminal widgets on first use. Output that arrived before sits in output_buffer."""
+        if self.terminal_container is not None: return
+        self.setup_terminal(); self._bind_terminal_keys()
+
+    def _bind_terminal_keys(self):
         if self.terminal_input and self.terminal_input.winfo_exists():
             self.terminal_input.bind("<Return>", self.execute_command)
             self.terminal_input.bind("<Up>", self.navigate_history_up)
             self.terminal_input.bind("<Down>", self.navigate_history_down)
             self.terminal_input.bind("<Tab>", self.handle_tab_complete)
             self.terminal_input.bind("<Control-d>", self.send_eot)
+            self.terminal_input.bind("<Control-Prior>", self.page_in_scrollback)
+            self.terminal_input.bind("<Control-F>", self.show_find_bar)
+            self._bind_session_keys(self.terminal_input)
 
         if self.terminal_output and self.terminal_output.winfo_exists():
             self.terminal_output.bind("<Control-Shift-c>", self.copy_terminal_selection)
             self.terminal_output.bind("<Control-c>", self.send_interrupt)
+            self.terminal_output.bind("<Control-Prior>", self.page_in_scrollback)
+            self.terminal_output.bind("<Control-F>", self.show_find_bar)
+            self._bind_session_keys(self.terminal_output)
+
+    def _bind_session_keys(self, widget):
+        widget.bind("<Control-T>", self.new_session)
+        widget.bind("<Control-W>", self.close_session)
+        widget.bind("<Control-Tab>", lambda e: self.cycle_session(1))
+        widget.bind("<Control-ISO_Left_Tab>", lambda e: self.cycle_session(-1)) # Ctrl+Shift+Tab on X11
 
     def _schedule_initial_shell_start(self):
-        self.root.after(500, self.start_shell)
+        self.start_shell() # the fork/exec runs on a background thread, see ShellSupervisor
         print("[+] Scheduled initial shell startup.")
 
-    def start_shell(self):
-        if self.shell_process and self.shell_process.poll() is None: print("[-] Shell already appears to be running."); self._queue_message("[Shell already running]\n"); self.start_polling_output(); return
-        print("[+] Attempting to start shell..."); self._cleanup_shell_resources_full()
-        try:
-            self.master_fd, self.slave_fd = pty.openpty()
-            if sys.platform != "win32": flags = fcntl.fcntl(self.master_fd, fcntl.F_GETFL); fcntl.fcntl(self.master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-            shell_cmd = self.config.get("shell_cmd", ["bash", "--norc"])
-            def is_command_available(cmd_path):
-                if not cmd_path: return False
-                if os.path.isabs(cmd_path): return os.path.exists(cmd_path) and os.access(cmd_path, os.X_OK)
-                penv = os.environ.get("PATH", os.defpath)
-                for pdir in penv.split(os.pathsep):
-                    fp = os.path.join(pdir, cmd_path)
-                    if os.path.exists(fp) and os.access(fp, os.X_OK): return True
-                    if sys.platform == "win32":
-                         for ext in ['.exe', '.cmd', '.bat', '.com']:
-                             if os.path.exists(fp + ext) and os.access(fp + ext, os.X_OK): return True
-                return False
-            if not shell_cmd or not shell_cmd[0] or not is_command_available(shell_cmd[0]):
-                 cfg_cmd = shell_cmd[0] if shell_cmd and shell_cmd[0] else 'N/A'
-                 print(f"Configured shell '{cfg_cmd}' not found/executable. Falling back to system default.")
-                 if sys.platform != "win32": shell_cmd = ["sh"]
-                 else: shell_cmd = ["cmd.exe"]
-                 if not is_command_available(shell_cmd[0]): raise FileNotFoundError(f"Fallback '{shell_cmd[0]}' not found.")
-            env = os.environ.copy(); env['TERM'] = 'xterm-256color'; print(f"[+] Starting shell: {' '.join(shell_cmd)}")
-            self.running = True
-            self.shell_process = subprocess.Popen(shell_cmd, stdin=self.slave_fd, stdout=self.slave_fd, stderr=self.slave_fd, preexec_fn=os.setsid if sys.platform != "win32" else None, close_fds=True, env=env)
-            print(f"[+] Shell process started with PID: {self.shell_process.pid}")
-            self.reader_thread = threading.Thread(target=self.read_shell_output, daemon=True); self.reader_thread.start(); print("[+] Shell reader thread started.")
-            if self.terminal_output and self.terminal_output.winfo_exists(): self.root.after_idle(self.clear_terminal_display); self._queue_message("[Shell session started]\n")
+    def _new_session(self):
+        """Creates a session, without a shell yet, with its own scrollback and output queue."""
+        sid = next(self._session_ids)
+        spill_path = os.path.join(self.app_data_dir, "scrollback", f"terminal-{os.getpid()}-{sid}.log") if self.config["scrollback_spill"] else None
+        scrollback = ScrollbackBuffer(max(self.config["history_bytes"], 1 << 20), spill_path)
+        # output waiting to be rendered; bounded so a hidden terminal or session cannot grow memory without limit
+        output_buffer = OutputBuffer(scrollback, max(self.config["background_buffer_bytes"], 64 * 1024), self.config["background_overflow"])
+        # with terminal_emulation the output drives a screen model (colours, cursor, full-screen apps); otherwise escapes are stripped
+        screen = TerminalScreen(*self._term_size) if self.config["terminal_emulation"] else None
+        session = TerminalSession(sid, scrollback, output_buffer, screen)
+        self.sessions.append(session)
+        return session
+
+    def start_shell(self, session=None):
+        session = session or self.session
+        if session.alive: print("[-] Shell already appears to be running."); self._post_output("[Shell already running]\n", session); self.start_polling_output(); return
+        if session.spawning: print("[-] Shell is already starting."); return
+        print("[+] Attempting to start shell..."); self._retire_shell(session)
+        try: shell_cmd = self.shell_supervisor.resolve(self.config.get("shell_cmd", ["bash", "--norc"]))
+        except FileNotFoundError as e: self._on_shell_start_failed(session, f"Shell command not found: {e}"); return
+        env = os.environ.copy(); env['TERM'] = 'xterm-256color'; print(f"[+] Starting shell: {' '.join(shell_cmd)}")
+        spawned = self.shell_supervisor.start(shell_cmd, env, owner=session) # the fork/exec runs on a background thread unless a standby is ready
+        if spawned is not None: print("[+] Took over the standby shell."); self._on_shell_spawned(session, spawned, None)
+        else: session.spawning = True; self._update_session_labels()
+
+    def _on_shell_spawned(self, session, spawned, error):
+        session.spawning = False
+        if session not in self.sessions: # closed while its shell was starting
+            if spawned is not None: self.shell_supervisor.retire(spawned)
+            return
+        if error is not None: self._on_shell_start_failed(session, f"Failed to start shell: {error}")
+        else:
+            session.process, session.master_fd, session.slave_fd = spawned
+            print(f"[+] Shell process started with PID: {session.process.pid} (session {session.name})")
+            self._set_pty_size(session.master_fd) # a standby was forked at whatever size the terminal had then
+            session.stripper.reset()
+            if session.screen is not None: session.screen.reset()
+            if self.config["record_sessions"]: session.recorder = self._start_recorder(session)
+            self._attach_reader(session)
+            self._post_output(CLEAR_SCREEN, session); self._post_output("[Shell session started]\n", session)
             self.start_polling_output() # ensure polling starts
-        except FileNotFoundError as e: msg = f"Shell command not found: {e}"; messagebox.showerror("Shell Error", msg); print(msg); self.running = False; self._queue_error_message(f"\n[Shell startup failed: {msg}]\n"); self._cleanup_shell_resources_light()
-        except Exception as e: msg = f"Failed to start shell: {e}"; messagebox.showerror("Shell Error", msg); print(msg); self.running = False; self._queue_error_message(f"\n[Shell startup failed: {e}]\n"); self._cleanup_shell_resources_light()
+            if self.config["warm_standby_shell"]: self.shell_supervisor.replenish()
+        self._update_session_labels()
+        if "shell" in self._startup_pending: self.profile.mark("shell ready (background)"); self._startup_pending.discard("shell"); self._report_startup()
 
-    def read_shell_output(self):
-        print("[+] Shell output reader thread running.")
-        buffer = b""
-        while self.running and self.master_fd is not None:
-            try:
-                data_bytes = b""
-                if sys.platform != "win32":
-                    r, _, _ = select.select([self.master_fd], [], [], 0.005)
-                    if r: data_bytes = os.read(self.master_fd, 4096)
-                else:
-                    try: data_bytes = os.read(self.master_fd, 1024)
-                    except BlockingIOError: pass
-                    except OSError as e:
-                         if e.errno == os.errno.EBADF: print("Reader thread got EBADF on Windows read.")
-                         else: print(f"OSError during Windows read: {e}")
-                         break
-                if data_bytes:
-                    buffer += data_bytes
-                    try:
-                        decoded_str = buffer.decode('utf-8', errors='replace'); buffer = b""
-                        filtered_data, clear_detected = self.filter_ansi(decoded_str)
-                        if clear_detected: self.root.after_idle(self.clear_terminal_display)
-                        if filtered_data: self.output_queue.put(filtered_data)
-                    except UnicodeDecodeError: pass
-                    except Exception as e: print(f"Error decoding/filtering: {e}"); buffer = b""
-                elif sys.platform != "win32" and r and not data_bytes: print("Shell process likely exited (EOF on read)."); break
-                if not data_bytes and sys.platform != "win32": time.sleep(0.0005)
-            except select.error as e:
-                 if e.errno == select.EINTR: continue
-                 print(f"Select error in reader: {e}")
-                 break
+    def _on_shell_start_failed(self, session, msg):
+        messagebox.showerror("Shell Error", msg); print(msg); self._post_output(f"\n[Shell startup failed: {msg}]\n", session); self._cleanup_shell_resources_light(session)
+
+    def _start_recorder(self, session):
+        """Opens a transcript for the session's raw PTY output; see SessionRecorder and --replay."""
+        directory = os.path.expanduser(self.config["recordings_dir"]) or os.path.join(self.app_data_dir, "recordings")
+        now = time.time()
+        path = os.path.join(directory, f"session-{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}-{os.getpid()}-{session.sid}{SessionRecorder.SUFFIX}")
+        try: recorder = SessionRecorder(path, {"shell": list(session.process.args), "session": session.sid, "rows": self._term_size[0], "cols": self._term_size[1]})
+        except OSError as e: print(f"[!] Could not start session recording: {e}"); return None
+        print(f"[+] Recording session {session.name} to {path}")
+        return recorder
+
+    def _stop_recorder(self, session, wait=False):
+        recorder, session.recorder = session.recorder, None
+        if recorder is not None: recorder.close(wait=wait); print(f"[+] Recorded {format_size(recorder.bytes_recorded)} of session {session.name} to {recorder.path}")
+
+    def _attach_reader(self, session):
+        """Hands the session's PTY to the shared I/O loop (a reader thread of its own on Windows)."""
+        fd = session.master_fd
+        if self.io_loop is not None:
+            # the fd check drops a last chunk from a session that has been restarted meanwhile
+            self.io_loop.add(fd, lambda text: session.master_fd == fd and self._handle_shell_text(session, text), on_eof=lambda: self._handle_shell_eof(session, fd),
+                             on_raw=session.recorder.write if session.recorder is not None else None)
+        else: session.reader_thread = threading.Thread(target=self._read_shell_output_polling, args=(session,), daemon=True); session.reader_thread.start()
+
+    def _handle_shell_text(self, session, text):
+        """I/O thread. Never touches Tk: everything goes through the session's output_buffer."""
+        if METRICS.enabled: METRICS.count("terminal.filter_chars", len(text))
+        if session.screen is not None: self._handle_screen_text(session, text); return
+        try:
+            with METRICS.time("terminal.filter"):
+                for item in session.stripper.feed(text): session.output_buffer.put(item)
+        except Exception as e: print(f"Error filtering shell output: {e}")
+        self._output_wakeup.notify()
+
+    def _handle_screen_text(self, session, text):
+        """Applies output to the session's screen model; lines scrolled off the top go to its history."""
+        screen = session.screen
+        try:
+            with METRICS.time("terminal.filter"):
+                for item in screen.feed(text): session.output_buffer.put(item)
+            with screen.lock: replies, screen.replies = screen.replies, []
+            if replies and session.master_fd is not None: # cursor position / device attribute queries, answered as a terminal would, in order with queued input
+                try: self.io_loop.write(session.master_fd, "".join(replies).encode()) if self.io_loop is not None else os.write(session.master_fd, "".join(replies).encode())
+                except OSError as e: print(f"[-] Could not answer terminal query: {e}")
+        except Exception as e: print(f"Error interpreting shell output: {e}")
+        self._output_wakeup.notify()
+
+    def _post_output(self, item, session=None):
+        """Queues text (or CLEAR_SCREEN) for a session, the shown one by default, and wakes the render pipeline. Any thread."""
+        (session or self.session).output_buffer.put(item)
+        self._output_wakeup.notify()
+
+    def _handle_shell_eof(self, session, fd):
+        """I/O thread. The fd is closed on the Tk thread, which owns master_fd; closing it here could hit a number already reused."""
+        self._ended_shells.append((session, fd)); self._output_wakeup.notify()
+
+    def _close_ended_shells(self):
+        while self._ended_shells:
+            session, fd = self._ended_shells.popleft()
+            if session.master_fd != fd: continue # retired by a restart; the supervisor closes it
+            print(f"[+] Shell in session {session.name} ended.")
+            self._post_output("\n[Shell process ended]\n", session)
+            self._stop_recorder(session)
+            self._cleanup_shell_resources_light(session) # the I/O loop has already let go of the fd
+
+    def _read_shell_output_polling(self, session):
+        # Windows has no selectable PTY handle, keep the non-blocking read loop there
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        fd = session.master_fd
+        while self.running and fd is not None and session.master_fd == fd: # a restart swaps master_fd; this loop belongs to the old one
+            try: data_bytes = os.read(fd, 1024)
+            except BlockingIOError: data_bytes = b""
             except OSError as e:
-                if e.errno == os.errno.EIO: print("PTY master got EIO. Shell likely exited.")
-                elif e.errno == os.errno.EBADF: print("Reader thread got EBADF.")
-                else: print(f"OSError during read in reader: {e}")
+                if e.errno == errno.EBADF: print("Reader thread got EBADF on Windows read.")
+                else: print(f"OSError during Windows read: {e}")
                 break
-            except Exception as e: print(f"[!] Unexpected error in read_shell_output loop: {e}"); break
-        print("[+] Shell output reader thread finished.")
-        if self.terminal_output and self.terminal_output.winfo_exists(): self.output_queue.put("\n[Shell process ended]\n"); self.root.after_idle(self.start_polling_output)
-        self._cleanup_shell_resources_light()
-
-    def filter_ansi(self, data):
-        clear_detected = False; ansi_escape_pattern = re.compile(r'\x1b\[[0-?]*[ -/]*[\@-~]'); osc_escape_pattern = re.compile(r'\x1b\].*?(\x07|\x1b\\)'); other_escape_pattern = re.compile(r'\x1b[<=>NM78HPZ=c()]')
-        if '\x1b[2J' in data: clear_detected = True; data = data.replace('\x1b[H\x1b[2J', '').replace('\x1b[2J\x1b[H', '').replace('\x1b[H', '').replace('\x1b[2J', '')
-        data = data.replace('\r', ''); data = ansi_escape_pattern.sub('', data); data = osc_escape_pattern.sub('', data); data = other_escape_pattern.sub('', data); data = data.replace('\x1b', '')
-        allowed_chars = set(string.printable); allowed_chars.discard('\r'); final_filtered_data = ''.join(c for c in data if c in allowed_chars)
-        return final_filtered_data, clear_detected
+            if data_bytes:
+                if session.recorder is not None: session.recorder.write(data_bytes)
+                self._handle_shell_text(session, decoder.decode(data_bytes))
+            else: time.sleep(0.005)
+        if session.master_fd == fd: self._post_output("\n[Shell process ended]\n", session)
 
     def start_polling_output(self):
-        if self._poll_id is None and self.running: self._poll_id = self.root.after(10, self.poll_shell_output)
+        """Schedules a render frame if output is pending and the terminal is on screen."""
+        if self._terminal_visible and (self.session.output_buffer.pending or (self.session.screen is not None and self.session.screen.damaged)): self._schedule_render_frame()
 
     def stop_polling_output(self):
         if self._poll_id is not None: self.root.after_cancel(self._poll_id); self._poll_id = None
 
+    def _on_output_ready(self):
+        # Tk thread, woken by the I/O loop. Only the shown session renders, at most one frame per _render_frame_ms;
+        # the others (and a hidden terminal) just update their unread markers.
+        if self._ended_shells: self._close_ended_shells()
+        if self._unread_job_id is None and (not self._terminal_visible or len(self.sessions) > 1): self._unread_job_id = self.root.after(250, self._update_unread_indicator)
+        if not self._terminal_visible: return
+        since_last_ms = (time.monotonic() - self._last_frame_time) * 1000
+        self._schedule_render_frame(max(0, int(self._render_frame_ms - since_last_ms)))
+
+    def _update_unread_indicator(self):
+        self._unread_job_id = None
+        self._update_session_labels()
+        if not (hasattr(self, 'unread_label') and self.unread_label.winfo_exists()): return
+        unseen = 0 if self._terminal_visible else sum(session.output_buffer.unseen_chars for session in self.sessions)
+        if unseen: self.unread_label.config(text=f"\u2022 {format_size(unseen)}"); self.unread_label.pack(side=tk.RIGHT, padx=5)
+        elif self.unread_label.winfo_ismapped(): self.unread_label.pack_forget()
+
+    def _schedule_render_frame(self, delay_ms=0):
+        if self._poll_id is not None or not self._terminal_visible: return
+        self._poll_id = self.root.after(delay_ms, self.poll_shell_output) if delay_ms else self.root.after_idle(self.poll_shell_output)
+
     def poll_shell_output(self):
-        if not self.running: self.stop_polling_output(); return
+        """Renders one frame of pending output (up to _render_max_chars) as a single insert. The first frame after the terminal
+        is shown flushes everything buffered in the background."""
+        self._poll_id = None
+        if not self._terminal_visible or self._history_view is not None or not (self.terminal_output and self.terminal_output.winfo_exists()): return
+        flush = self._flush_on_show; self._flush_on_show = False
+        if METRICS.enabled: METRICS.gauge("terminal.pending_chars", sum(s.output_buffer.pending_chars for s in self.sessions))
+        frame = self.session.output_buffer.take(None if flush else self._render_max_chars)
+        self.session.output_buffer.mark_seen()
+        screen_damaged = self.session.screen is not None and self.session.screen.damaged
+        if frame is None and not screen_damaged: return
+        self._last_frame_time = time.monotonic()
         try:
-            while True:
-                message = self.output_queue.get_nowait()
-                if self.terminal_output and self.terminal_output.winfo_exists() and self.terminal_container and self.terminal_container.winfo_ismapped():
-                     self.terminal_output.configure(state='normal'); self.terminal_output.insert(tk.END, message); self.terminal_output.configure(state='disabled'); self.terminal_output.see(tk.END)
-        except queue.Empty: pass
-        except tk.TclError: print("[!] TclError during poll. Widget destroyed?"); self.stop_polling_output()
-        except Exception as e: print(f"[!] Error processing shell output queue: {e}")
-        if self.running: self._poll_id = self.root.after(10, self.poll_shell_output)
-        else: self.stop_polling_output()
+            t0 = time.perf_counter()
+            self.terminal_output.configure(state='normal')
+            if frame is not None: self._render_history(frame)
+            if screen_damaged: self._render_screen()
+            self.terminal_output.configure(state='disabled')
+            if self._find_current is None: self.terminal_output.see(tk.END) # stay on a match the user jumped to
+            METRICS.observe("terminal.render", time.perf_counter() - t0)
+        except tk.TclError: print("[!] TclError during render. Widget destroyed?"); self.stop_polling_output(); return
+        except Exception as e: print(f"[!] Error rendering shell output: {e}")
+        if self.session.output_buffer.pending: self._schedule_render_frame(self._render_frame_ms) # more than one frame's worth pending
+
+    def _render_history(self, frame):
+        reset_line, text = frame.reset_line, frame.text
+        max_chars = max(self.config["scrollback_bytes"], 16 * 1024)
+        if len(text) > max_chars: # only the newest part is worth inserting
+            cut = text.find("\n", len(text) - max_chars) + 1
+            if cut > 0: reset_line = frame.start_line + text.count("\n", 0, cut); text = text[cut:]
+        if reset_line is not None: self.terminal_output.delete("1.0", self._history_end()); self._widget_chars = 0; self._widget_first_line = reset_line
+        if self.session.screen is not None and text and not text.endswith("\n"): text += "\n" # the screen rows start on a line of their own
+        if text: self._insert_history(self._history_end(), text); self._widget_chars += len(text); self._trim_terminal_widget()
+        self.render_stats.record_frame(len(text), frame.chunks); self.render_stats.dropped += frame.dropped
+
+    def _history_end(self): return "screen_start" if self.session.screen is not None else "end-1c"
+
+    def _insert_history(self, index, text):
+        """Inserts history text at index; in emulation mode it always lands above the screen rows."""
+        if self.session.screen is None: self.terminal_output.insert(index, text); return
+        self.terminal_output.mark_gravity("screen_start", "right")
+        try: self.terminal_output.insert(index, text)
+        finally: self.terminal_output.mark_gravity("screen_start", "left")
+
+    def _render_screen(self):
+        """Redraws the screen rows that changed since the last frame, one delete/insert per row; a scroll moves the rows instead."""
+        widget = self.terminal_output
+        full, scrolled, damage, cursor = self.session.screen.take_damage()
+        if not full and self._screen_rows_drawn != len(self.session.screen.grid): self.session.screen.mark_all_dirty(); full, scrolled, damage, cursor = self.session.screen.take_damage()
+        base = int(widget.index("screen_start").split(".")[0])
+        if scrolled: # on the main screen those rows already came in above as history
+            widget.delete("screen_start", f"{base + scrolled}.0"); widget.insert("end-1c", "\n" * scrolled)
+        if full:
+            widget.delete("screen_start", "end-1c")
+            args = []
+            for y in range(len(damage)):
+                if y: args += ("\n", "")
+                for text, attr in damage[y]: args += (text, self._sgr_tag(attr))
+            if args: widget.insert("screen_start", *args)
+            self._screen_rows_drawn = len(damage)
+        else:
+            for y, runs in damage.items():
+                widget.delete(f"{base + y}.0", f"{base + y}.end")
+                args = [a for text, attr in runs for a in (text, self._sgr_tag(attr))]
+                if args: widget.insert(f"{base + y}.0", *args)
+        widget.tag_remove("term_cursor", "screen_start", tk.END)
+        if cursor: widget.tag_add("term_cursor", f"{base + cursor[0]}.{cursor[1]}")
+
+    def _sgr_tag(self, attr):
+        """Tk tag for a screen attribute id, created on first use."""
+        if not attr: return ""
+        tag = self._sgr_tags.get(attr)
+        if tag is not None: return tag
+        fg, bg, flags = self.session.screen.attr_table[attr]
+        fg = TerminalScreen.color_hex(fg) if fg is not None else None; bg = TerminalScreen.color_hex(bg) if bg is not None else None
+        if flags & TerminalScreen.REVERSE: fg, bg = bg or self.config["term_bg"], fg or self.config["term_fg"]
+        options = {"foreground": fg, "background": bg, "underline": bool(flags & TerminalScreen.UNDERLINE)}
+        style = " ".join(name for bit, name in ((TerminalScreen.BOLD, "bold"), (TerminalScreen.ITALIC, "italic")) if flags & bit)
+        if style: options["font"] = ('Monospace', 10, style)
+        tag = self._sgr_tags[attr] = f"sgr{attr}"
+        self.terminal_output.tag_configure(tag, **{k: v for k, v in options.items() if v is not None})
+        self.terminal_output.tag_raise("term_cursor")
+        return tag
+
+    def _on_terminal_configure(self, event=None):
+        if self._resize_job_id is not None: self.root.after_cancel(self._resize_job_id)
+        self._resize_job_id = self.root.after(100, self._resize_screen) # one resize after the user stops dragging
+
+    def _resize_screen(self):
+        """Fits every session's screen model and PTY window size to the widget; the kernel sends each shell SIGWINCH."""
+        self._resize_job_id = None
+        if not (self.terminal_output and self.terminal_output.winfo_exists()): return
+        font = tkfont.Font(font=self.terminal_output.cget("font"))
+        inset = 2 * sum(int(self.terminal_output.cget(option)) for option in ("padx", "borderwidth", "highlightthickness"))
+        width, height = self.terminal_output.winfo_width() - inset, self.terminal_output.winfo_height() - inset
+        cols, rows = max(width // max(font.measure("0"), 1), 20), max(height // max(font.metrics("linespace"), 1), 5)
+        if (rows, cols) == self._term_size: return
+        self._term_size = (rows, cols)
+        for session in self.sessions:
+            if session.screen is None: continue
+            out = []; session.screen.resize(rows, cols, out)
+            for item in out: session.output_buffer.put(item)
+            if session.recorder is not None: session.recorder.meta({"resize": [rows, cols]})
+            self._set_pty_size(session.master_fd, width, height)
+        self.start_polling_output()
+
+    def _set_pty_size(self, fd, width=0, height=0):
+        if fd is None or not self.config["terminal_emulation"] or sys.platform == "win32": return
+        try: fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", *self._term_size, width, height))
+        except OSError as e: print(f"[-] Could not set terminal size: {e}")
+
+    def _trim_terminal_widget(self):
+        """Drops the oldest widget lines once past the scrollback limits, in chunks of ~10% so trimming is amortized."""
+        max_lines = max(self.config["scrollback_lines"], 100); max_chars = max(self.config["scrollback_bytes"], 16 * 1024)
+        lines = int(self.terminal_output.index(self._history_end()).split(".")[0])
+        excess_lines = lines - max_lines; excess_chars = self._widget_chars - max_chars
+        if excess_lines < max(max_lines // 10, 100) and excess_chars < max_chars // 10: return
+        cut = max(excess_lines, 0)
+        if excess_chars > 0: cut = max(cut, lines * excess_chars // max(self._widget_chars, 1) + 1)
+        cut = min(cut, lines - 1)
+        if cut <= 0: return
+        counted = self.terminal_output.count("1.0", f"{cut + 1}.0", "chars")
+        removed = counted[0] if isinstance(counted, tuple) else (counted or 0)
+        self.terminal_output.delete("1.0", f"{cut + 1}.0")
+        self._widget_chars = max(0, self._widget_chars - removed); self._widget_first_line += cut
+
+    def page_in_scrollback(self, event=None):
+        """Ctrl+PageUp: loads the next page of older output from the scrollback history into the widget."""
+        if not (self.terminal_output and self.terminal_output.winfo_exists()) or self._history_view is not None: return "break"
+        start = max(self.session.scrollback.first_line, self._widget_first_line - self._page_in_lines)
+        lines = self.session.scrollback.get_lines(start, self._widget_first_line)
+        if not lines: print("[-] No older scrollback available."); return "break"
+        text = "\n".join(lines) + "\n"
+        try:
+            self.terminal_output.configure(state='normal'); self._insert_history("1.0", text); self.terminal_output.configure(state='disabled')
+            self.terminal_output.see("1.0")
+        except tk.TclError: return "break"
+        self._widget_first_line = start; self._widget_chars += len(text)
+        return "break"
+
+    # scrollback find
+    def show_find_bar(self, event=None):
+        """Ctrl+Shift+F in the terminal: opens the find bar over the shown session's whole history."""
+        if self.terminal_container is None: return "break"
+        if self.find_bar is None: self._build_find_bar()
+        if not self.find_bar.winfo_ismapped(): self.find_bar.pack(fill=tk.X, padx=5, pady=(5, 0), before=self.input_frame)
+        self.find_entry.focus(); self.find_entry.select_range(0, tk.END)
+        if self._find_regex is None and self.var_find.get(): self._start_find()
+        return "break"
+
+    def _build_find_bar(self):
+        bar = self.find_bar = ttk.Frame(self.terminal_container)
+        self.find_worker = ScrollbackSearchWorker(self.root, self._on_find_result)
+        self.var_find = tk.StringVar(); self.var_find_regex = tk.BooleanVar(value=False); self.var_find_case = tk.BooleanVar(value=False)
+        ttk.Label(bar, text="Find:").pack(side=tk.LEFT, padx=(0, 5))
+        self.find_entry = ttk.Entry(bar, textvariable=self.var_find, font=('Monospace', 10), width=32)
+        self.find_entry.pack(side=tk.LEFT)
+        ttk.Button(bar, text="\u25b2", width=2, command=lambda: self.find_step(-1)).pack(side=tk.LEFT, padx=(5, 0)) # older
+        ttk.Button(bar, text="\u25bc", width=2, command=lambda: self.find_step(1)).pack(side=tk.LEFT) # newer
+        ttk.Checkbutton(bar, text="Regex", variable=self.var_find_regex, command=self._start_find).pack(side=tk.LEFT, padx=(8, 0))
+        ttk.Checkbutton(bar, text="Match case", variable=self.var_find_case, command=self._start_find).pack(side=tk.LEFT, padx=(5, 0))
+        self.find_status = ttk.Label(bar, text="", foreground="grey")
+        self.find_status.pack(side=tk.LEFT, padx=8)
+        ttk.Button(bar, text="\u00d7", width=2, command=self.hide_find_bar).pack(side=tk.RIGHT)
+        self.var_find.trace_add("write", lambda *args: self._schedule_find())
+        self.find_entry.bind("<Return>", lambda e: self.find_step(-1)); self.find_entry.bind("<Up>", lambda e: self.find_step(-1))
+        self.find_entry.bind("<Shift-Return>", lambda e: self.find_step(1)); self.find_entry.bind("<Down>", lambda e: self.find_step(1))
+        self.find_entry.bind("<Escape>", self.hide_find_bar)
+        self.terminal_output.tag_configure("find_match", background="#fff2a8", foreground="#000000")
+        self.terminal_output.tag_configure("find_current", background="#ff9632", foreground="#000000")
+        self.terminal_output.configure(yscrollcommand=self._on_terminal_yscroll) # matches are highlighted as they scroll into view
+
+    def hide_find_bar(self, event=None):
+        """Escape: closes the find bar and returns to the live output."""
+        if self.find_bar is None: return "break"
+        self.find_bar.pack_forget(); self.find_worker.cancel()
+        if self._find_job_id is not None: self.root.after_cancel(self._find_job_id); self._find_job_id = None
+        self._find_regex = self._find_line_regex = self._find_current = None; self._find_lines = array('Q')
+        self.terminal_output.tag_remove("find_match", "1.0", tk.END); self.terminal_output.tag_remove("find_current", "1.0", tk.END)
+        self._leave_history_view(); self.terminal_output.see(tk.END); self.terminal_input.focus()
+        return "break"
+
+    def _schedule_find(self):
+        if self._find_job_id is not None: self.root.after_cancel(self._find_job_id)
+        self._find_job_id = self.root.after(150, self._start_find) # once typing pauses
+
+    def _compile_find(self):
+        """(index regex, fold case, line regex) for the find bar text, or None when empty. Raises re.error.
+        Without "Match case" the index is searched in lowercased text, which is much faster than re.IGNORECASE."""
+        query = self.var_find.get()
+        if not query: return None
+        regex = self.var_find_regex.get()
+        pattern = query if regex else re.escape(query)
+        if self.var_find_case.get(): rx = re.compile(pattern, re.M); return rx, False, rx
+        line_rx = re.compile(pattern, re.M | re.I)
+        if regex and query != query.lower(): return line_rx, False, line_rx
+        return re.compile(query.lower() if regex else re.escape(query.lower()), re.M), True, line_rx
+
+    def _start_find(self):
+        """Starts indexing the shown session's history for the find bar text."""
+        self._find_job_id = None
+        if self.find_bar is None: return
+        self._find_current = None; self._find_lines = array('Q'); self._find_indexed_end = 0
+        self.terminal_output.tag_remove("find_current", "1.0", tk.END)
+        try: compiled = self._compile_find()
+        except re.error as e: compiled = None; self.find_status.config(text=f"Bad pattern: {e}")
+        else:
+            if compiled is None: self.find_status.config(text="")
+        if compiled is None: self._find_regex = self._find_line_regex = None; self.find_worker.cancel(); self._find_searching = False; self._highlight_visible_matches(); return
+        self._find_regex, self._find_fold, self._find_line_regex = compiled
+        end = self.session.scrollback.line_count
+        self.find_worker.submit(self.session.scrollback, self._find_regex, self._find_fold, 0, end); self._find_searching = True
+        self.find_status.config(text="Searching...")
+        self._highlight_visible_matches()
+
+    def _on_find_result(self, scrollback, lines, start, end, elapsed_ms):
+        if scrollback is not self.session.scrollback or self._find_regex is None: return
+        if start == 0: self._find_lines = lines
+        else: self._find_lines.extend(lines)
+        self._find_indexed_end = end; self._find_searching = False
+        if self._find_current is None: self.find_status.config(text=f"{self._find_match_count()} matching lines ({elapsed_ms:.0f} ms)")
+
+    def _extend_find_index(self):
+        """Brings the index up to the newest history line: small tails inline, big ones on the worker."""
+        scrollback = self.session.scrollback; end = scrollback.line_count
+        if self._find_searching or end <= self._find_indexed_end: return
+        if end - self._find_indexed_end > 20000:
+            self.find_worker.submit(scrollback, self._find_regex, self._find_fold, self._find_indexed_end, end); self._find_searching = True; return
+        self._find_lines.extend(scrollback.search(self._find_regex, self._find_indexed_end, end, fold_case=self._find_fold)); self._find_indexed_end = end
+
+    def _find_live_lines(self):
+        """(absolute line, texts) of what is shown below the history: the screen rows, or the unfinished last line."""
+        scrollback = self.session.scrollback
+        if self.session.screen is not None: return scrollback.line_count, self.session.screen.text().split("\n")
+        return scrollback.line_count, [scrollback.partial]
+
+    def _find_match_count(self, live_matches=()):
+        first = bisect.bisect_left(self._find_lines, self.session.scrollback.first_line)
+        return len(self._find_lines) - first + len(live_matches)
+
+    def _find_line_after(self, line, direction, live_matches):
+        """The nearest matching line after (direction 1) or before (-1) line, or None."""
+        lines = self._find_lines
+        if direction > 0:
+            i = bisect.bisect_right(lines, line)
+            if i < len(lines): return lines[i]
+            return next((n for n in live_matches if n > line), None)
+        older = [n for n in live_matches if n < line]
+        if older: return older[-1]
+        i = bisect.bisect_left(lines, line)
+        return lines[i - 1] if i and lines[i - 1] >= self.session.scrollback.first_line else None
+
+    def find_step(self, direction):
+        """Shows the next older (-1) or newer (1) match, wrapping around; the first step goes to the newest."""
+        if self._find_job_id is not None: self.root.after_cancel(self._find_job_id); self._start_find()
+        if self._find_regex is None: return "break"
+        self._extend_find_index()
+        rx = self._find_line_regex; scrollback = self.session.scrollback
+        live_first, live = self._find_live_lines()
+        live_matches = [live_first + i for i, text in enumerate(live) if rx.search(text)]
+        def line_text(n): return live[n - live_first] if n >= live_first else (scrollback.get_lines(n, n + 1) or [""])[0]
+        target = None; wrapped = False
+        if self._find_current is not None:
+            line, col, _ = self._find_current
+            spans = [m.span() for m in rx.finditer(line_text(line)) if (m.start() > col if direction > 0 else m.start() < col)]
+            if spans: target = (line, *(spans[0] if direction > 0 else spans[-1]))
+        else: line = 1 << 62 # nothing shown yet: start below the newest line
+        if target is None:
+            found = self._find_line_after(line, direction, live_matches)
+            if found is None and self._find_current is not None: found = self._find_line_after(-1 if direction > 0 else 1 << 62, direction, live_matches); wrapped = True
+            if found is None: self.find_status.config(text="No matches" + (" yet, searching..." if self._find_searching else "")); return "break"
+            spans = [m.span() for m in rx.finditer(line_text(found))] or [(0, 0)]
+            target = (found, *(spans[0] if direction > 0 else spans[-1]))
+        self._show_find_match(*target, live_first)
+        line = target[0]; total = self._find_match_count(live_matches)
+        k = total - len(live_matches) + live_matches.index(line) + 1 if line >= live_first else bisect.bisect_left(self._find_lines, line) - bisect.bisect_left(self._find_lines, scrollback.first_line) + 1
+        status = f"{k} of {total} lines" + (" (wrapped)" if wrapped else "") + (", searching..." if self._find_searching else "")
+        if self._history_view is not None: status += " \u2014 history view, Esc for live output"
+        self.find_status.config(text=status)
+        return "break"
+
+    def _show_find_match(self, line, start, end, live_first):
+        """Scrolls the match into view, paging a history window into the widget when it is older than the widget."""
+        widget = self.terminal_output
+        if line >= self._widget_first_line: # the live widget has it
+            self._leave_history_view()
+            if line >= live_first and self.session.screen is not None: lineno = int(widget.index(f"screen_start + {line - live_first} lines").split(".")[0])
+            else: lineno = line - self._widget_first_line + 1
+        else:
+            if self._history_view is None or not self._history_view[0] <= line < self._history_view[1]: self._enter_history_view(line)
+            lineno = line - self._history_view[0] + 1
+        self._find_current = (line, start, end)
+        widget.tag_remove("find_current", "1.0", tk.END); widget.tag_add("find_current", f"{lineno}.{start}", f"{lineno}.{end}")
+        widget.see(f"{lineno}.{start}"); self._highlight_visible_matches()
+
+    def _enter_history_view(self, line):
+        """Replaces the widget contents with the history around line; rendering pauses until _leave_history_view."""
+        scrollback = self.session.scrollback; widget = self.terminal_output
+        max_lines = max(self.config["scrollback_lines"], 100)
+        first = max(scrollback.first_line, line - max_lines // 2)
+        lines = scrollback.get_lines(first, first + max_lines)
+        self.stop_polling_output()
+        widget.configure(state='normal'); widget.delete("1.0", tk.END); widget.insert("1.0", "\n".join(lines)); widget.configure(state='disabled')
+        self._history_view = (first, first + len(lines))
+
+    def _leave_history_view(self):
+        """Back to the live output after _enter_history_view; what arrived meanwhile renders in one frame."""
+        if self._history_view is None: return
+        self._history_view = None; self.session.view_first_line = self._widget_first_line
+        self._reload_terminal_widget(); self._flush_on_show = True
+        self.stop_polling_output(); self.poll_shell_output() # now, so the screen rows are back before a match on them is shown
+
+    def _on_terminal_yscroll(self, first, last):
+        self.terminal_output.vbar.set(first, last)
+        if self._find_line_regex is not None and self._find_highlight_job is None: self._find_highlight_job = self.root.after(30, self._highlight_visible_matches)
+
+    def _highlight_visible_matches(self):
+        """Tags the matches in the lines on screen only, so highlighting costs the same at any history size."""
+        self._find_highlight_job = None
+        widget = self.terminal_output
+        if not (widget and widget.winfo_exists()): return
+        widget.tag_remove("find_match", "1.0", tk.END)
+        if self._find_line_regex is None: return
+        first = int(widget.index("@0,0").split(".")[0]); last = int(widget.index(f"@0,{widget.winfo_height()}").split(".")[0])
+        for n, text in enumerate(widget.get(f"{first}.0", f"{last}.end").split("\n"), first):
+            for m in self._find_line_regex.finditer(text):
+                if m.end() > m.start(): widget.tag_add("find_match", f"{n}.{m.start()}", f"{n}.{m.end()}")
+        widget.tag_raise("find_match"); widget.tag_raise("find_current") # above the colour tags
 
     def clear_terminal_display(self):
-        if self.terminal_output and self.terminal_output.winfo_exists(): self.terminal_output.configure(state='normal'); self.terminal_output.delete("1.0", tk.END); self.terminal_output.configure(state='disabled')
+        if self.terminal_output and self.terminal_output.winfo_exists(): self.terminal_output.configure(state='normal'); self.terminal_output.delete("1.0", self._history_end()); self.terminal_output.configure(state='disabled')
+        if self.session.screen is not None: self.session.screen.feed("\x1b[H\x1b[2J"); self.start_polling_output()
+        self._widget_first_line = self.session.scrollback.line_count; self._widget_chars = 0
 
     def execute_command(self, event=None):
         cmd = self.terminal_input.get()
         if cmd.strip():
-            if not self.command_history or (self.command_history[-1].strip() != cmd.strip()): self.command_history.append(cmd)
-        self.history_index = len(self.command_history); self.current_input_buffer = ""
+            if not self.session.command_history or (self.session.command_history[-1].strip() != cmd.strip()): self.session.command_history.append(cmd)
+        self.session.history_index = len(self.session.command_history); self.session.current_input_buffer = ""
         self.terminal_input.delete(0, tk.END); cmd_bytes = (cmd + "\n").encode('utf-8', errors='ignore')
-        if self.master_fd is not None and self.shell_process and self.shell_process.poll() is None:
-            try:
-                if sys.platform != "win32": _, w, _ = select.select([], [self.master_fd], [], 0.05); os.write(self.master_fd, cmd_bytes) if w else self._queue_error_message("\n[Shell write busy]\n")
-                else: os.write(self.master_fd, cmd_bytes)
-            except OSError as e: print(f"[!] Error writing: {e}"); self._queue_error_message(f"\n[Write Error: {e}]\n")
-            except Exception as e: print(f"[!] Unexpected write error: {e}"); self._queue_error_message(f"\n[Write Error: {e}]\n")
+        if self.session.master_fd is not None and self.session.process and self.session.process.poll() is None: self._write_to_shell(cmd_bytes, "Write")
         else: self._queue_error_message("\nShell not running]\n")
         return "break"
 
+    def _write_to_shell(self, data, what, force=False):
+        """Queues bytes for the shown session's PTY behind any input still pending; the I/O thread writes them as the shell takes them.
+        force queues them even past the input queue limit."""
+        fd = self.session.master_fd
+        try:
+            if self.io_loop is None: os.write(fd, data); return True
+            if not self.io_loop.write(fd, data, force=force):
+                print(f"[-] {what}: input queue full, {len(data)} bytes not sent."); self._queue_error_message(f"\n[Input queue full: {format_size(self.io_loop.queued(fd))} not yet taken by the shell]\n"); return False
+        except OSError as e: print(f"[!] {what} error: {e}"); self._queue_error_message(f"\n[{what} Error: {e}]\n"); return False
+        except Exception as e: print(f"[!] Unexpected {what} error: {e}"); self._queue_error_message(f"\n[{what} Error: {e}]\n"); return False
+        if self._input_queue_job_id is None: self._input_queue_job_id = self.root.after(200, self._update_input_queue_status) # small writes drain before anything shows
+        return True
+
+    def _update_input_queue_status(self):
+        """Shows the input the shown session's PTY has yet to take, rechecked every 200 ms until it has all gone."""
+        self._input_queue_job_id = None
+        fd = self.session.master_fd
+        pending = self.io_loop.queued(fd) if self.io_loop is not None and fd is not None else 0
+        if METRICS.enabled: METRICS.gauge("pty.write_queued", pending)
+        label = self.input_queue_label
+        if label is not None and label.winfo_exists():
+            if pending: label.configure(text=f"{format_size(pending)} queued \u2192"); label.winfo_ismapped() or label.pack(side=tk.RIGHT, padx=(5, 0), before=self.terminal_input)
+            else: label.pack_forget()
+        if pending: self._input_queue_job_id = self.root.after(200, self._update_input_queue_status)
+
     def navigate_history_up(self, event=None):
-        if not self.command_history: return "break"
-        if self.history_index == len(self.command_history): self.current_input_buffer = self.terminal_input.get()
+        if not self.session.command_history: return "break"
+        if self.session.history_index == len(self.session.command_history): self.session.current_input_buffer = self.terminal_input.get()
         target_index = -1
-        if self.history_index > 0: target_index = self.history_index - 1
-        elif self.history_index == -1 and self.command_history: target_index = len(self.command_history) - 1
-        if target_index != -1: self.history_index = target_index; self.terminal_input.delete(0, tk.END); self.terminal_input.insert(0, self.command_history[self.history_index])
+        if self.session.history_index > 0: target_index = self.session.history_index - 1
+        elif self.session.history_index == -1 and self.session.command_history: target_index = len(self.session.command_history) - 1
+        if target_index != -1: self.session.history_index = target_index; self.terminal_input.delete(0, tk.END); self.terminal_input.insert(0, self.session.command_history[self.session.history_index])
         return "break"
 
     def navigate_history_down(self, event=None):
-        if not self.command_history or self.history_index == -1: return "break"
+        if not self.session.command_history or self.session.history_index == -1: return "break"
         target_index = -1; target_text = ""
-        if self.history_index < len(self.command_history) - 1: target_index = self.history_index + 1; target_text = self.command_history[target_index]
-        elif self.history_index == len(self.command_history) - 1: target_index = len(self.command_history); target_text = self.current_input_buffer; self.current_input_buffer = ""
-        if target_index != -1: self.history_index = target_index; self.terminal_input.delete(0, tk.END); self.terminal_input.insert(0, target_text)
+        if self.session.history_index < len(self.session.command_history) - 1: target_index = self.session.history_index + 1; target_text = self.session.command_history[target_index]
+        elif self.session.history_index == len(self.session.command_history) - 1: target_index = len(self.session.command_history); target_text = self.session.current_input_buffer; self.session.current_input_buffer = ""
+        if target_index != -1: self.session.history_index = target_index; self.terminal_input.delete(0, tk.END); self.terminal_input.insert(0, target_text)
         return "break"
 
     def handle_tab_complete(self, event=None):
-        if self.master_fd is not None and self.shell_process and self.shell_process.poll() is None:
-            try: os.write(self.master_fd, b'\t') # Send a literal tab character. upgrading would require extensive rework.
-            except OSError as e: print(f"[!] Error writing Tab: {e}"); self._queue_error_message(f"\n[Tab Error: {e}]\n")
-            except Exception as e: print(f"[!] Unexpected Tab error: {e}"); self._queue_error_message(f"\n[Tab Error: {e}]\n")
+        if self.session.master_fd is not None and self.session.process and self.session.process.poll() is None:
+            self._write_to_shell(b'\t', "Tab") # Send a literal tab character. upgrading would require extensive rework.
         return "break"
 
     def send_eot(self, event=None): # Ctrl+D handler
-        if self.master_fd is not None and self.shell_process and self.shell_process.poll() is None:
-            try: os.write(self.master_fd, b'\x04')
-            except OSError as e: print(f"[!] OSError writing Ctrl+D byte: {e}"); self._queue_error_message(f"\n[Ctrl+D Error: {e}]\n")
-            except Exception as e: print(f"[!] Unexpected error writing Ctrl+D byte: {e}"); self._queue_error_message(f"\n[Ctrl+D Error: {e}]\n")
+        if self.session.master_fd is not None and self.session.process and self.session.process.poll() is None:
+            self._write_to_shell(b'\x04', "Ctrl+D", force=True) # queued behind pending input, like the other keys, but never refused
         else: print("[!] Ctrl+D pressed but shell is not running or PTY unavailable.")
         return "break"
 
     def send_interrupt(self, event=None): # Ctrl+C handler
-        if self.master_fd is not None and self.shell_process and self.shell_process.poll() is None:
-            try: os.write(self.master_fd, b'\x03'); self.root.after_idle(self._display_interrupt_feedback)
-            except OSError as e: print(f"[!] OSError writing Ctrl+C byte to shell: {e}"); self._queue_error_message(f"\n[Interrupt Error: {e}]\n")
-            except Exception as e: print(f"[!] Unexpected error writing Ctrl+C byte: {e}"); self._queue_error_message(f"\n[Interrupt Error: {e}]\n")
+        if self.session.master_fd is not None and self.session.process and self.session.process.poll() is None:
+            if self._write_to_shell(b'\x03', "Interrupt", force=True): self.root.after_idle(self._display_interrupt_feedback) # a full queue is when it is needed most
         else: print("[!] Ctrl+C pressed but shell is not running or PTY unavailable.")
         return "break"
 
     def _queue_error_message(self, message):
-        if self.terminal_output and self.terminal_output.winfo_exists(): self.output_queue.put(message); self.root.after_idle(self.start_polling_output)
-        else: print(f"[-] Terminal not ready, error message: {message}")
+        self._post_output(message) # kept in output_buffer until the terminal is shown
 
     def _queue_message(self, message):
-        if self.terminal_output and self.terminal_output.winfo_exists(): self.output_queue.put(message); self.root.after_idle(self.start_polling_output)
+        self._post_output(message)
 
     def _display_interrupt_feedback(self):
+        if self.session.screen is not None: return # the PTY echoes ^C onto the screen itself
         if self.terminal_output and self.terminal_output.winfo_exists():
             try: self.terminal_output.configure(state='normal'); self.terminal_output.insert(tk.END, "^C\n"); self.terminal_output.configure(state='disabled'); self.terminal_output.see(tk.END)
             except tk.TclError: pass
@@ -602,69 +3837,161 @@ class NoteShellApp:
         return "break"
 
     def restart_shell(self):
-        print("[+] Restarting shell...")
-        self._cleanup_shell_resources_full()
-        self.root.after(100, self.start_shell)
+        print(f"[+] Restarting shell in session {self.session.name}...")
+        self._retire_shell(self.session)
+        self.start_shell(self.session)
+
+    def _retire_shell(self, session):
+        """Detaches the session's shell and leaves its teardown to the supervisor, without waiting for it."""
+        self._stop_recorder(session)
+        if session.process is None and session.master_fd is None: return
+        spawned = ShellSession(session.process, session.master_fd, session.slave_fd)
+        if self.io_loop is not None and session.master_fd is not None: self.io_loop.remove(session.master_fd, on_removed=lambda: self.shell_supervisor.retire(spawned)) # closed only once the loop let go of it
+        else: self.shell_supervisor.retire(spawned, session.reader_thread)
+        session.process = session.master_fd = session.slave_fd = session.reader_thread = None
+
+    def new_session(self, event=None):
+        """Ctrl+Shift+T: opens another shell session and shows it."""
+        session = self._new_session()
+        self._show_session(session); self._rebuild_session_bar()
+        self.start_shell(session)
+        return "break"
+
+    def close_session(self, event=None):
+        """Ctrl+Shift+W: terminates the shown session's shell and drops the session. The last one stays."""
+        session = self.session
+        if len(self.sessions) == 1: print("[-] Not closing the last session; double F11 restarts it."); return "break"
+        if session.alive and not messagebox.askyesno("Close Session", f"Terminate the shell in session {session.name}?"): return "break"
+        index = self.sessions.index(session)
+        self._retire_shell(session); self.sessions.remove(session)
+        self._show_session(self.sessions[min(index, len(self.sessions) - 1)])
+        session.scrollback.close(); self._rebuild_session_bar()
+        return "break"
+
+    def cycle_session(self, delta):
+        if len(self.sessions) > 1: self._show_session(self.sessions[(self.sessions.index(self.session) + delta) % len(self.sessions)])
+        return "break"
+
+    def _show_session(self, session):
+        """Puts a session in the terminal view; the widget is rebuilt from its history and screen."""
+        old = self.session
+        if old is session: return
+        old.view_first_line = self._widget_first_line; self._history_view = None
+        if self.terminal_input is not None: old.input_text = self.terminal_input.get(); self.terminal_input.delete(0, tk.END); self.terminal_input.insert(0, session.input_text)
+        self.session = session
+        if self.terminal_output is not None: self._reload_terminal_widget()
+        self._flush_on_show = True; session.output_buffer.mark_seen()
+        self._update_session_labels(); self.start_polling_output()
+        if self._find_regex is not None: self._start_find() # the index belongs to the session shown
+
+    def _reload_terminal_widget(self):
+        """Refills the widget with the newest scrollback_lines of the shown session's history."""
+        session = self.session; widget = self.terminal_output
+        max_lines = max(self.config["scrollback_lines"], 100)
+        self._widget_first_line = max(session.view_first_line, session.scrollback.first_line, session.scrollback.line_count - max_lines)
+        lines = session.scrollback.get_lines(self._widget_first_line, session.scrollback.line_count)
+        text = "\n".join(lines) + "\n" if lines else ""
+        if session.screen is None: text += session.scrollback.partial
+        widget.configure(state='normal'); widget.delete("1.0", tk.END)
+        for tag in self._sgr_tags.values(): widget.tag_delete(tag) # attribute ids are per screen
+        self._sgr_tags.clear()
+        if session.screen is not None: widget.mark_set("screen_start", "1.0"); self._screen_rows_drawn = 0; session.screen.mark_all_dirty()
+        if text: self._insert_history(self._history_end(), text)
+        widget.configure(state='disabled'); widget.see(tk.END)
+        self._widget_chars = len(text)
+
+    def _rebuild_session_bar(self):
+        """The session switcher above the terminal output, shown once there is more than one session."""
+        if self.session_bar is None: return
+        for child in self.session_bar.winfo_children(): child.destroy()
+        self._session_buttons = {}
+        if len(self.sessions) < 2: self.session_bar.pack_forget(); return
+        for session in self.sessions:
+            button = ttk.Radiobutton(self.session_bar, style="Toolbutton", variable=self.var_session, value=session.sid, command=lambda s=session: self._show_session(s))
+            button.pack(side=tk.LEFT, padx=(0, 2)); self._session_buttons[session.sid] = button
+        ttk.Button(self.session_bar, text="+", width=2, command=self.new_session).pack(side=tk.LEFT, padx=(4, 0))
+        ttk.Button(self.session_bar, text="\u00d7", width=2, command=self.close_session).pack(side=tk.LEFT)
+        if not self.session_bar.winfo_ismapped(): self.session_bar.pack(fill=tk.X, padx=5, pady=(5, 0), before=self.terminal_output.master)
+        self._update_session_labels()
+
+    def _update_session_labels(self):
+        buttons = getattr(self, "_session_buttons", None)
+        if not buttons: return
+        self.var_session.set(self.session.sid)
+        for session in self.sessions:
+            button = buttons.get(session.sid)
+            unread = session is not self.session and (session.output_buffer.unseen_chars or (session.screen is not None and session.screen.damaged))
+            if button is not None: button.configure(text=session.label() + (" \u2022" if unread else ""))
 
 
     def toggle_terminal(self, event=None):
         """Toggles the visibility of the terminal container."""
+        self._ensure_terminal()
         if not (self.terminal_container and self.terminal_input and self.terminal_output): print("Error: Terminal UI elements not initialized for toggle."); return
 
         if self.terminal_container.winfo_ismapped():
             self.terminal_container.pack_forget()
             if self.notebook and not self.notebook.winfo_ismapped(): self.notebook.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
             if self.text_editor and self.text_editor.winfo_exists(): self.text_editor.focus()
-            self.stop_polling_output()
+            self._terminal_visible = False; self.stop_polling_output() # output keeps accumulating in output_buffer
+            self.session.output_buffer.mark_seen()
         else:
             if self.notebook and self.notebook.winfo_ismapped(): self.notebook.pack_forget()
             self.terminal_container.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
             self.terminal_input.focus()
-            if not self.shell_process or self.shell_process.poll() is not None: self.start_shell()
+            self._terminal_visible = True; self._flush_on_show = True
+            self._update_unread_indicator()
+            if not self.session.process or self.session.process.poll() is not None: self.start_shell()
             self.start_polling_output()
 
     def new_note(self, confirm_discard=True):
         if confirm_discard and self.is_dirty:
             if not messagebox.askyesno("Unsaved Changes", "Discard unsaved changes and create new?"): return
+        self._discard_journal(); self._cancel_note_load(); self._leave_partial_note(); self._large_note_bytes = 0
         self.text_editor.delete("1.0", tk.END); self.current_note = None; self.notes_list.selection_clear(0, tk.END)
         self.is_dirty = False; self._update_save_status(); self.update_live_preview(); self.text_editor.edit_reset(); self.text_editor.edit_modified(False)
 
     def save_note(self):
+        if self._note_loader: messagebox.showinfo("Save", "The note is still loading."); return
+        if self._note_partial: messagebox.showinfo("Save", "Only part of this note was loaded before it changed on disk; open it again to edit it."); return
         if not self.current_note: self.save_note_as(); return
         content = self.text_editor.get("1.0", tk.END).strip()
         path = os.path.join(self.notes_dir, self.current_note)
         try:
-            os.makedirs(self.notes_dir, exist_ok=True);
-            with open(path, "w", encoding='utf-8') as f: f.write(content + "\n")
+            os.makedirs(self.notes_dir, exist_ok=True); self._cancel_autosave_jobs()
+            with METRICS.time("note.save"): self.autosave.write_now(self.current_note, path, content + "\n", self._edit_generation)
+            self._note_disk_sig = self.autosave.written.get(path)
             print(f"[+] Note saved as {self.current_note}")
+            self.note_index.update(self.current_note, content, os.stat(path))
             self.is_dirty = False; self._update_save_status(); self.text_editor.edit_modified(False)
         except Exception as e: messagebox.showerror("Save Error", f"Failed to save note:\n{e}")
 
     def save_note_as(self):
+        if self._note_loader: messagebox.showinfo("Save As", "The note is still loading."); return
+        if self._note_partial: messagebox.showinfo("Save As", "Only part of this note was loaded before it changed on disk; open it again to edit it."); return
         content = self.text_editor.get("1.0", tk.END).strip()
         initial_filename = self.current_note if self.current_note else "Untitled.md"
         save_path = filedialog.asksaveasfilename(initialfile=initial_filename, defaultextension=".md", filetypes=[("Markdown Files", "*.md"), ("All Files", "*.*")], initialdir=self.notes_dir)
         if not save_path: return
         try:
-            save_dir = os.path.dirname(save_path); os.makedirs(save_dir, exist_ok=True)
-            with open(save_path, "w", encoding='utf-8') as f: f.write(content + "\n")
+            save_dir = os.path.dirname(save_path); os.makedirs(save_dir, exist_ok=True); self._cancel_autosave_jobs()
+            self.autosave.write_now(self._journal_key(), save_path, content + "\n", self._edit_generation)
             print(f"[+] Note saved as {save_path}")
             abs_save_path = os.path.abspath(save_path); abs_notes_dir = os.path.abspath(self.notes_dir)
             if abs_save_path.startswith(abs_notes_dir):
-                 filename = os.path.basename(save_path); self.load_notes()
-                 try: idx = list(self.notes_list.get(0, tk.END)).index(filename); self.notes_list.selection_clear(0, tk.END); self.notes_list.selection_set(idx); self.notes_list.activate(idx)
-                 except ValueError: pass
-                 self.current_note = filename; self.is_dirty = False; self._update_save_status(); self.text_editor.edit_modified(False)
+                 filename = os.path.basename(save_path); self._notes_dir_cache.invalidate(); self.load_notes()
+                 if os.path.dirname(abs_save_path) == abs_notes_dir: self.note_index.update(filename, content, os.stat(save_path))
+                 self.notes_list.select_item(filename)
+                 self.current_note = filename; self._note_disk_sig = self.autosave.written.get(save_path); self.is_dirty = False; self._update_save_status(); self.text_editor.edit_modified(False)
             else: messagebox.showinfo("Save As", f"Note successfully saved to {save_path}")
         except Exception as e: messagebox.showerror("Save As Error", f"Failed to save note as {os.path.basename(save_path) if save_path else 'file'}:\n{e}")
 
     def load_notes(self):
         """Loads the list of notes from the notes directory and updates internal list."""
-        self._all_notes = []
         os.makedirs(self.notes_dir, exist_ok=True)
         try:
-            note_files = sorted([fname for fname in os.listdir(self.notes_dir) if fname.endswith(".md") and os.path.isfile(os.path.join(self.notes_dir, fname))])
-            self._all_notes = note_files
+            note_files, changed = self._notes_dir_cache.scan()
+            if changed or not self._all_notes: self._all_notes = note_files
             self.filter_notes()
             self._update_delete_button_state()
         except Exception as e: messagebox.showerror("Load Error", f"Failed to load notes list:\n{e}")
@@ -672,94 +3999,186 @@ class NoteShellApp:
     def load_note_content(self, event=None):
         selection = self.notes_list.curselection()
         if not selection:
-            if self.current_note is None or self.current_note not in self._all_notes: self.new_note(confirm_discard=False)
+            if self.current_note is None or self.current_note not in self._all_notes_lookup(): self.new_note(confirm_discard=False)
             self._update_delete_button_state()
             return
-        fname = self.notes_list.get(selection[0]); path = os.path.join(self.notes_dir, fname)
+        fname = self.notes_list.get(selection[0])
         is_loading_different_note = (self.current_note is None or self.current_note != fname)
         if is_loading_different_note and self.is_dirty:
             if not messagebox.askyesno("Unsaved Changes", "Discard unsaved changes and load selected?"):
-                if self.current_note and self.current_note in self._all_notes:
-                     try:
-                          filtered_list_items = list(self.notes_list.get(0, tk.END))
-                          if self.current_note in filtered_list_items: idx = filtered_list_items.index(self.current_note); self.notes_list.selection_clear(0, tk.END); self.notes_list.selection_set(idx); self.notes_list.activate(idx)
-                          else: self.notes_list.selection_clear(0, tk.END)
-                     except ValueError: self.notes_list.selection_clear(0, tk.END)
+                if self.current_note: self.notes_list.select_item(self.current_note)
                 else: self.notes_list.selection_clear(0, tk.END)
                 return
+            self._discard_journal()
+        if not is_loading_different_note and self._note_loader: return # already streaming this note in
+        self._open_note(fname)
+
+    def _open_note(self, fname):
+        """Replaces the editor text with the note from disk, whatever the sidebar shows."""
+        path = os.path.join(self.notes_dir, fname)
+        self._cancel_note_load(); self._leave_partial_note()
         try:
-            with open(path, "r", encoding='utf-8') as f: content = f.read()
-            self.text_editor.delete("1.0", tk.END); self.text_editor.insert("1.0", content)
-            self.current_note = fname; self.is_dirty = False; self._update_save_status(); self.update_live_preview(); self.text_editor.edit_reset(); self.text_editor.edit_modified(False)
-        except Exception as e: messagebox.showerror("Load Error", f"Failed to load note content:\n{e}"); self.current_note = None; self.text_editor.delete("1.0", tk.END); self.is_dirty = False; self._update_save_status(); self.update_live_preview(); self.text_editor.edit_modified(False)
+            size = os.path.getsize(path)
+            if size >= self.config.get("large_note_bytes", 2 * 1024 * 1024): self._load_large_note(fname, path, size)
+            else:
+                t0 = time.perf_counter()
+                with open(path, "r", encoding='utf-8') as f: st = os.fstat(f.fileno()); content = f.read()
+                self._large_note_bytes = 0; self._note_disk_sig = (st.st_mtime_ns, st.st_size)
+                self.text_editor.delete("1.0", tk.END); self.text_editor.insert("1.0", content)
+                self.current_note = fname; self.is_dirty = False; self._update_save_status(); self.update_live_preview(); self.text_editor.edit_reset(); self.text_editor.edit_modified(False)
+                METRICS.observe("note.load", time.perf_counter() - t0)
+        except Exception as e: self._cancel_note_load(); messagebox.showerror("Load Error", f"Failed to load note content:\n{e}"); self._large_note_bytes = 0; self.current_note = None; self.text_editor.delete("1.0", tk.END); self.is_dirty = False; self._update_save_status(); self.update_live_preview(); self.text_editor.edit_modified(False)
         self._update_delete_button_state()
 
-    def _cleanup_shell_resources_light(self):
-        if self.master_fd is not None:
-            try: os.close(self.master_fd)
+    def _load_large_note(self, fname, path, size):
+        """Streams a note over large_note_bytes into the editor; the first screenful and a region-only preview show at once."""
+        print(f"[+] Loading large note {fname} ({format_size(size)}) in chunks")
+        self.text_editor.delete("1.0", tk.END)
+        self.current_note = fname; self.is_dirty = False; self._large_note_bytes = size; self._update_save_status()
+        st = os.stat(path); self._note_disk_sig = (st.st_mtime_ns, st.st_size)
+        self._note_loader = ChunkedTextLoader(self.text_editor, path, on_progress=self._on_note_load_progress, on_done=self._on_note_load_done)
+        self._note_load_t0 = time.perf_counter(); self.load_progress.config(value=0); self.load_progress.pack(side=tk.RIGHT, padx=5)
+        self._note_loader.start()
+        if self._note_loader: self.text_editor.mark_set(tk.INSERT, "1.0"); self.update_live_preview()
+
+    def _on_note_load_progress(self, done_bytes, total_bytes):
+        self.load_progress.config(value=100.0 * done_bytes / max(1, total_bytes))
+
+    def _on_note_load_done(self, error):
+        self._note_loader = None; self.load_progress.pack_forget()
+        if error:
+            messagebox.showerror("Load Error", f"Failed to load note content:\n{error}")
+            self.new_note(confirm_discard=False); self._update_delete_button_state(); return
+        METRICS.observe("note.load_large", time.perf_counter() - self._note_load_t0)
+        self.text_editor.edit_modified(False); self.update_live_preview()
+
+    def _on_notes_changed(self, events):
+        """Applies a batch of notes-directory events: patches _all_notes in place of a rescan, keeps the index current, and flags outside changes to the open note."""
+        touched = set(); renamed = {}
+        for kind, name, old_name in events:
+            if kind == "rescan":
+                self._notes_dir_cache.invalidate(); self.load_notes(); self.note_index.sync(self.notes_dir)
+                if self.current_note: touched.add(self.current_note)
+                continue
+            touched.add(name)
+            if kind == "renamed": touched.add(old_name); renamed[old_name] = name
+        if not touched: return
+        present = {}
+        for name in touched:
+            try: st = os.stat(os.path.join(self.notes_dir, name)); present[name] = (st.st_mtime_ns, st.st_size)
+            except OSError: pass
+        known = self._all_notes_lookup()
+        added = sorted(name for name in present if name not in known); removed = {name for name in touched if name not in present and name in known}
+        if added or removed:
+            notes = [name for name in self._all_notes if name not in removed] if removed else list(self._all_notes)
+            for name in added: bisect.insort(notes, name)
+            self._all_notes = notes; self.filter_notes()
+            print(f"[+] Notes directory changed: {len(added)} added, {len(removed)} removed")
+        own_writes = set(self.autosave.written.values())
+        for name in touched:
+            if name not in present: self.note_index.remove(name)
+            elif present[name] not in own_writes: self.note_index.refresh(os.path.join(self.notes_dir, name), name)
+        current = self.current_note
+        if current in renamed and renamed[current] in present: # follow the open note to its new name
+            self.current_note = renamed[current]; self._update_save_status(); self.notes_list.select_item(self.current_note)
+            print(f"[+] Open note renamed on disk: {current} -> {self.current_note}")
+        elif current in touched:
+            sig = present.get(current)
+            if sig is not None and sig in (self._note_disk_sig, self.autosave.written.get(os.path.join(self.notes_dir, current))): return # our own write
+            self._on_open_note_changed_on_disk(current, sig)
+
+    def _on_open_note_changed_on_disk(self, name, sig):
+        if self._note_loader: # never keep reading a mapped file that is being rewritten; what was read must not be saved over it
+            self._cancel_note_load(); self._note_partial = True; self.text_editor.config(state=tk.DISABLED)
+        self._note_disk_sig = sig
+        if self._note_partial and sig is not None: print(f"[+] {name} changed on disk while loading; reloading."); self._reload_note(name); return # no edits to lose
+        if self._disk_prompt_open: return
+        self._disk_prompt_open = True
+        try:
+            if sig is None:
+                if self._note_partial: messagebox.showwarning("Note Deleted", f"'{name}' was deleted on disk while it was loading.\n\nThe part that was loaded stays visible, read-only."); return
+                self.is_dirty = True; self._update_save_status()
+                messagebox.showwarning("Note Deleted", f"'{name}' was deleted on disk.\n\nThe editor keeps its text; Save writes it back.")
+                return
+            question = f"'{name}' was changed on disk.\n\nReload it" + (" and discard your unsaved changes?" if self.is_dirty else "?")
+            if messagebox.askyesno("Note Changed on Disk", question): self._reload_note(name)
+            else: self.is_dirty = True; self._update_save_status() # the editor no longer matches the file
+        finally: self._disk_prompt_open = False
+
+    def _leave_partial_note(self):
+        if self._note_partial: self._note_partial = False; self.text_editor.config(state=tk.NORMAL)
+
+    def _reload_note(self, name):
+        self._discard_journal(); self.is_dirty = False; self.current_note = None
+        self.notes_list.select_item(name) # False while the search filter hides it; the note is reloaded either way
+        self._open_note(name); self._update_delete_button_state()
+
+    def _cancel_note_load(self):
+        if self._note_loader: self._note_loader.cancel(); self._note_loader = None; self.load_progress.pack_forget()
+
+    def _cleanup_shell_resources_light(self, session):
+        if session.master_fd is not None:
+            try: os.close(session.master_fd)
             except OSError: pass
             except Exception as e: print(f"[!] Unexpected error closing master_fd (light cleanup): {e}")
-            self.master_fd = None
-        if self.slave_fd is not None:
-            try: os.close(self.slave_fd)
+            session.master_fd = None
+        if session.slave_fd is not None:
+            try: os.close(session.slave_fd)
             except OSError: pass
             except Exception as e: print(f"[!] Unexpected error closing slave_fd (light cleanup): {e}")
-            self.slave_fd = None
+            session.slave_fd = None
 
-    def _cleanup_shell_resources_full(self):
-        print("[+] Performing full shell resource cleanup...")
-        self.running = False; self.stop_polling_output()
-        if self.reader_thread and self.reader_thread.is_alive():
-            print("[+] Waiting for reader thread...");
-            try:
-                self.reader_thread.join(timeout=0.5)
-                if self.reader_thread.is_alive():
-                    print("[-] Reader thread did not join, attempting to close master_fd...")
-                    if self.master_fd is not None:
-                        try: os.close(self.master_fd)
-                        except OSError as e: print(f"[!] Error closing master_fd during join attempt: {e}")
-                    self.reader_thread.join(timeout=1.0)
-                    if self.reader_thread.is_alive(): print("[-] Reader thread still alive after closing master_fd.")
-                else: print("[+] Reader thread joined successfully.")
-            except RuntimeError as e: print(f"[!] RuntimeError during thread join: {e}")
-            except Exception as e: print(f"[!] Unexpected error during thread join: {e}")
-            finally:
-                if self.reader_thread and not self.reader_thread.is_alive(): del self.reader_thread; self.reader_thread = None
-                elif self.reader_thread: print("[-] Warning: Reader thread reference not cleared.")
-        if self.shell_process and self.shell_process.poll() is None:
-            print(f"[+] Terminating shell process group (PID: {self.shell_process.pid})...")
-            try:
-                if sys.platform != "win32": os.killpg(os.getpgid(self.shell_process.pid), signal.SIGTERM)
-                else: self.shell_process.terminate()
-                self.shell_process.wait(timeout=0.5)
-            except (ProcessLookupError, PermissionError, OSError): pass
-            except subprocess.TimeoutExpired:
-                print("[-] Shell process unresponsive, sending SIGKILL.")
-                try:
-                    if sys.platform != "win32": os.killpg(os.getpgid(self.shell_process.pid), signal.SIGKILL)
-                    else: self.shell_process.kill()
-                    self.shell_process.wait(timeout=0.5)
-                except Exception as kill_e: print(f"[!] Error sending SIGKILL: {kill_e}")
-            except Exception as e: print(f"[!] Error terminating shell process: {e}")
-            finally: self.shell_process = None
-        if self.master_fd is not None:
-             try: os.close(self.master_fd)
-             except OSError: pass
-             self.master_fd = None
-        if self.slave_fd is not None:
-             try: os.close(self.slave_fd)
-             except OSError: pass
-             self.slave_fd = None
+    def _cleanup_shell_resources_full(self, session):
+        """Terminates the session's shell and closes its PTY, waiting for both. The I/O loop must be stopped already."""
+        if session.process is not None and session.process.poll() is None: print(f"[+] Terminating shell process group (PID: {session.process.pid})...")
+        ShellSupervisor._teardown(ShellSession(session.process, session.master_fd, session.slave_fd), session.reader_thread)
+        session.process = session.master_fd = session.slave_fd = session.reader_thread = None
 
 
     def on_close(self):
         print("[+] Close requested...")
         if self.is_dirty:
              if not messagebox.askyesno("Unsaved Changes", "Quit without saving?"): return
-        self._cleanup_shell_resources_full(); self.root.destroy()
+             self._discard_journal()
+        self._cancel_autosave_jobs(); self._cancel_note_load(); self.autosave.close()
+        if self.notes_watcher: self.notes_watcher.close()
+        print("[+] Performing full shell resource cleanup...")
+        self.running = False; self.stop_polling_output()
+        if self.io_loop is not None: self.io_loop.close()
+        for session in self.sessions: self._cleanup_shell_resources_full(session); self._stop_recorder(session, wait=True)
+        print(f"[+] Terminal render stats: {self.render_stats.snapshot()}, dropped while hidden: {sum(session.output_buffer.dropped_chars for session in self.sessions)} chars")
+        for session in self.sessions: session.scrollback.close()
+        if self.find_worker is not None: self.find_worker.close()
+        self._output_wakeup.close(); self.preview_worker.close(); self.note_index.close(); self._meta_wakeup.close(); self._search_wakeup.close(); self.shell_supervisor.close(); self.root.destroy()
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="NotesShell: Markdown notes with an embedded shell.")
+    parser.add_argument("--export", metavar="DIR", help="render all notes to static HTML in DIR and exit (no window)")
+    parser.add_argument("--notes-dir", default=os.path.expanduser("~/.notesshell/notes"), help="notes tree to export (default: %(default)s)")
+    parser.add_argument("--jobs", type=int, default=None, help="export worker processes (default: one per core)")
+    parser.add_argument("--force", action="store_true", help="re-render notes even if unchanged since the last export")
+    parser.add_argument("--profile-startup", action="store_true", help="print a per-phase startup timing breakdown")
+    parser.add_argument("--replay", metavar="FILE", help="play a recorded session (.nsrec) back to stdout and exit")
+    parser.add_argument("--search", metavar="REGEX", help="with --replay FILE: print matching output lines with their time instead of replaying")
+    parser.add_argument("--from", dest="start", type=float, default=0.0, metavar="SECONDS", help="start --replay/--search this far into the recording")
+    parser.add_argument("--speed", type=float, default=1.0, help="--replay speed factor, 0 for no delays (default: %(default)s)")
+    args = parser.parse_args()
+    if args.replay:
+        try:
+            if args.search:
+                for t, line in SessionRecording(args.replay).search(args.search, start=args.start): print(f"[{int(t // 3600):02d}:{int(t // 60 % 60):02d}:{t % 60:06.3f}] {line}")
+            else: replay_recording(args.replay, start=args.start, speed=args.speed)
+        except (OSError, re.error) as e: print(f"[!] {e}", file=sys.stderr); sys.exit(1)
+        except KeyboardInterrupt: pass
+        sys.exit(0)
+    if args.export:
+        try:
+            with open(os.path.expanduser("~/.notesshell/config.json"), "r") as f: font_size = int(json.load(f).get("editor_font_size", 11))
+        except (OSError, ValueError, TypeError, AttributeError): font_size = 11
+        written, unchanged, failed = export_notes(args.notes_dir, args.export, jobs=args.jobs, font_size=font_size, force=args.force)
+        sys.exit(1 if failed else 0)
     root = tk.Tk()
     style = ttk.Style(root)
-    app = NoteShellApp(root)
+    app = NoteShellApp(root, profile=StartupProfile(enabled=args.profile_startup))
     root.mainloop()
@@ -0,0 +1,32 @@
+"""AnsiStripper, the escape-sequence filter for the plain terminal."""
+from notesshell import CLEAR_SCREEN, AnsiStripper
+
+
+def test_stripper_removes_sequences_and_controls():
+    stripper = AnsiStripper()
+    assert stripper.feed("\x1b[1;31mred\x1b[0m\r\n\x1b]0;title\x07tab\there\x08") == ["red\ntab\there"]
+
+
+def test_stripper_reports_clear_screen():
+    assert AnsiStripper().feed("before\x1b[2Jafter") == ["before", CLEAR_SCREEN, "after"]
+
+
+def test_stripper_holds_sequence_split_across_chunks():
+    stripper = AnsiStripper()
+    assert stripper.feed("abc\x1b[3") == ["abc"]
+    assert stripper.feed("1mdef") == ["def"]
+
+
+def test_stripper_holds_string_terminator_split_across_chunks():
+    stripper = AnsiStripper()
+    assert stripper.feed("a\x1b]0;title\x1b") == ["a"]
+    assert stripper.feed("\\b") == ["b"]
+
+
+def test_stripper_gives_up_on_an_unterminated_sequence():
+    text = "a" * (AnsiStripper.MAX_PENDING + 10)
+    assert AnsiStripper().feed("x\x1b]" + text) == ["x" + text] # passed on; on its own, ESC ] is dropped as a two-byte escape
+
+
+def test_stripper_keeps_non_ascii_text():
+    assert AnsiStripper().feed("héllo ☃\x1b[K\x07") == ["héllo ☃"]
@@ -0,0 +1,85 @@
+"""AutosaveJournal: edit journal replay, checkpoints and discarded autosaves."""
+import json, os, threading, time, tkinter as tk
+
+import pytest
+
+from notesshell import AutosaveJournal, atomic_write, common_affix_lengths
+
+
+@pytest.mark.parametrize("old, new, expected", [
+    ("", "", (0, 0)),
+    ("abc", "abc", (3, 0)),
+    ("abcdef", "abXdef", (2, 3)),
+    ("aaaa", "aa", (2, 0)), # the suffix never overlaps the prefix
+    ("x" * 10000 + "A" + "y" * 9000, "x" * 10000 + "BB" + "y" * 9000, (10000, 9000)),
+])
+def test_common_affix_lengths(old, new, expected):
+    assert common_affix_lengths(old, new) == expected
+
+
+def test_atomic_write_replaces_the_file_and_leaves_no_temp_file(tmp_path):
+    path = tmp_path / "note.md"; path.write_text("old")
+    atomic_write(str(path), "new")
+    assert path.read_text() == "new" and os.listdir(tmp_path) == ["note.md"]
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = AutosaveJournal(tk.Tcl(), str(tmp_path / "journal"), on_saved=lambda *args: None)
+    yield journal
+    journal.close()
+
+
+def test_journal_replays_edits(journal):
+    for text in ["hello", "hello world", "hi world", "", "hi there world!\nmore"]: journal.record("note.md", "note.md", text)
+    journal.close()
+    assert [(key, note, text) for key, note, text, mtime in journal.recover()] == [("note.md", "note.md", "hi there world!\nmore")]
+
+
+def test_journal_ignores_a_torn_final_record(journal):
+    journal.record("a.md", "a.md", "one"); journal.record("a.md", "a.md", "one two")
+    journal.close()
+    with open(journal._journal_path("a.md"), "a", encoding="utf-8") as f: f.write(json.dumps({"op": "edit", "s": 0, "e": 3, "text": "X"})[:-5])
+    assert journal.recover()[0][2] == "one two"
+
+
+def test_checkpoint_removes_the_journal(journal):
+    journal.record("b.md", "b.md", "text"); journal.checkpoint("b.md")
+    journal.close()
+    assert journal.recover() == []
+
+
+def test_queued_autosaves_coalesce(journal, tmp_path):
+    path = str(tmp_path / "c.md")
+    with journal._write_lock: # the worker blocks in the first save; the next two queue behind it
+        journal.save("c.md", path, "one", 1); wait_for(lambda: not journal._jobs)
+        journal.save("c.md", path, "two", 2); journal.save("c.md", path, "three", 3)
+        assert len(journal._jobs) == 1
+    journal.close()
+    assert open(path).read() == "three"
+
+
+def test_discard_drops_queued_and_running_autosaves(journal, tmp_path):
+    running, queued = str(tmp_path / "running.md"), str(tmp_path / "queued.md")
+    with journal._write_lock: # the worker has taken the save for running.md and waits for the write lock
+        journal.save("running.md", running, "discarded", 4); wait_for(lambda: not journal._jobs)
+        journal.save("queued.md", queued, "discarded", 7)
+        journal.discard("running.md", running, 4); journal.discard("queued.md", queued, 7)
+    journal.close()
+    assert not os.path.exists(running) and not os.path.exists(queued)
+
+
+def test_manual_save_wins_over_an_older_autosave(journal, tmp_path):
+    path = str(tmp_path / "d.md")
+    with journal._write_lock:
+        journal.save("d.md", path, "autosave", 1); wait_for(lambda: not journal._jobs)
+        manual = threading.Thread(target=journal.write_now, args=("d.md", path, "manual", 2)); manual.start() # either may take the lock first
+    manual.join(); journal.close()
+    assert open(path).read() == "manual"
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.001)
@@ -0,0 +1,54 @@
+"""export_notes: incremental static HTML export of a notes tree."""
+import json, os, shutil
+
+import pytest
+
+from notesshell import EXPORT_MANIFEST, export_notes
+
+
+@pytest.fixture
+def tree(tmp_path):
+    notes = tmp_path / "notes"
+    (notes / "sub").mkdir(parents=True); (notes / ".hidden").mkdir()
+    (notes / "a.md").write_text("# A\n\nfirst note")
+    (notes / "sub" / "b.md").write_text("*b*")
+    (notes / ".hidden" / "c.md").write_text("skipped")
+    (notes / "readme.txt").write_text("not a note")
+    return notes, tmp_path / "out"
+
+
+def export(notes, out, **kwargs): return export_notes(str(notes), str(out), jobs=2, progress_interval=3600, **kwargs)
+
+
+def manifest(out): return json.loads((out / EXPORT_MANIFEST).read_text())
+
+
+def test_export_renders_notes_and_skips_unchanged_ones(tree):
+    notes, out = tree
+    assert export(notes, out) == (2, 0, 0)
+    assert "<h1>A</h1>" in (out / "a.html").read_text() and (out / "sub" / "b.html").exists()
+    assert sorted(manifest(out)) == ["a.md", os.path.join("sub", "b.md")]
+    assert export(notes, out) == (0, 2, 0)
+    assert export(notes, out, force=True) == (2, 0, 0)
+
+
+def test_changed_and_deleted_notes(tree):
+    notes, out = tree
+    export(notes, out)
+    (notes / "a.md").write_text("# A\n\nedited")
+    os.remove(notes / "sub" / "b.md")
+    assert export(notes, out) == (1, 0, 0)
+    assert "edited" in (out / "a.html").read_text()
+    assert not (out / "sub" / "b.html").exists() and list(manifest(out)) == ["a.md"]
+
+
+def test_failed_note_keeps_its_old_hash(tree):
+    notes, out = tree
+    export(notes, out)
+    old = manifest(out)
+    (notes / "a.md").write_text("# A\n\nedited")
+    os.remove(out / "a.html"); (out / "a.html").mkdir() # the HTML cannot be written
+    assert export(notes, out) == (0, 1, 1)
+    assert manifest(out) == old # retried next time
+    shutil.rmtree(out / "a.html")
+    assert export(notes, out) == (1, 1, 0)
@@ -0,0 +1,64 @@
+"""MarkdownHighlighter per-line fence states, on a withdrawn tk.Text. Needs a display."""
+import tkinter as tk
+
+import pytest
+
+from notesshell import MarkdownHighlighter
+
+
+@pytest.fixture
+def text():
+    try: root = tk.Tk()
+    except tk.TclError: pytest.skip("no display")
+    root.withdraw()
+    widget = tk.Text(root, height=40)
+    yield widget
+    root.destroy()
+
+
+def settle(highlighter):
+    highlighter.cancel() # no mainloop here: run the slices directly
+    assert not highlighter._work(float("inf"))
+
+
+def highlighted(widget, lines):
+    widget.insert("1.0", "\n".join(lines))
+    highlighter = MarkdownHighlighter(widget, ("Monospace", 10))
+    settle(highlighter)
+    return highlighter
+
+
+def record_tagging(highlighter, monkeypatch):
+    tagged = set(); tag_lines = highlighter._tag_lines
+    def spy(a, b): tagged.update(range(a + 1, b + 1)); tag_lines(a, b)
+    monkeypatch.setattr(highlighter, "_tag_lines", spy)
+    return tagged
+
+
+def tags(widget, index): return set(widget.tag_names(index))
+
+
+def test_opening_a_fence_retags_only_down_to_the_next_state_match(text, monkeypatch):
+    highlighter = highlighted(text, ["plain *a*", "plain", "plain", "```python", "code", "```"] + ["after *b*"] * 10)
+    assert "md_fence" in tags(text, "4.0") and "md_code" in tags(text, "5.0")
+    tagged = record_tagging(highlighter, monkeypatch)
+    text.insert("2.0", "```\n") # "```python" below is now inside the new fence, and the old closing fence closes it
+    settle(highlighter)
+    assert tagged == {2, 3, 4, 5}
+    assert "md_fence" in tags(text, "2.0")
+    for line in (3, 4, 5, 6): assert "md_code" in tags(text, f"{line}.0")
+    assert "md_fence" in tags(text, "7.0")
+    for line in range(8, 18): assert "md_italic" in tags(text, f"{line}.6") and "md_code" not in tags(text, f"{line}.0")
+
+
+def test_closing_a_fence_restores_the_lines_below(text):
+    highlighter = highlighted(text, ["# Title"] + ["text *x*"] * 11)
+    text.insert("3.0", "```\n")
+    settle(highlighter)
+    assert "md_heading" in tags(text, "1.0")
+    for line in range(4, 14): assert "md_code" in tags(text, f"{line}.0") and "md_italic" not in tags(text, f"{line}.6")
+    text.insert("6.0", "```\n")
+    settle(highlighter)
+    assert "md_code" in tags(text, "4.0") and "md_code" in tags(text, "5.0")
+    assert "md_fence" in tags(text, "6.0")
+    for line in range(7, 15): assert "md_italic" in tags(text, f"{line}.6") and "md_code" not in tags(text, f"{line}.0")
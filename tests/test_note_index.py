@@ -0,0 +1,82 @@
+"""NoteIndex: query building, search and incremental sync."""
+import os, threading
+
+import pytest
+
+from notesshell import NoteIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = NoteIndex(str(tmp_path / "index.db"))
+    if not index.available: pytest.skip("SQLite has no FTS5")
+    yield index
+    index.close()
+
+
+def write(directory, name, text, mtime=None):
+    path = directory / name
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None: os.utime(path, (mtime, mtime))
+
+
+@pytest.mark.parametrize("text, query", [
+    ("drake", '"drake"*'),
+    ("Drake equation", '"Drake"* "equation"*'),
+    ('"noble gases" argon', '"noble gases" "argon"*'),
+    ('foo "bar', '"foo"* "bar"*'), # an unclosed quote is just punctuation
+    ("c++ foo-bar", '"c"* "foo"* "bar"*'),
+    ("", None),
+    ("?!. -- ***", None), # punctuation only: nothing to search for
+    ('"   "', None),
+])
+def test_build_query(text, query):
+    assert NoteIndex.build_query(text) == query
+
+
+def test_search_ranks_and_matches_prefixes(index, tmp_path):
+    notes = tmp_path / "notes"; notes.mkdir()
+    write(notes, "fib.md", "Fibonacci numbers grow like the golden ratio.")
+    write(notes, "drake.md", "The Drake equation estimates civilizations. Drake, drake, drake.")
+    write(notes, "other.md", "Mentions drake once.")
+    write(notes, "skip.txt", "drake drake")
+    index._sync(str(notes))
+    assert index.search("drake") == ["drake.md", "other.md"]
+    assert index.search("fibon") == ["fib.md"] # prefix
+    assert index.search('"golden ratio"') == ["fib.md"]
+    assert index.search('"ratio golden"') == []
+    assert index.search("!!!") == []
+
+
+def test_sync_reindexes_only_changed_notes(index, tmp_path, monkeypatch):
+    notes = tmp_path / "notes"; notes.mkdir()
+    for i in range(5): write(notes, f"n{i}.md", f"note {i} text", mtime=1_000_000 + i)
+    index._sync(str(notes))
+    updated = []; update = index._update
+    monkeypatch.setattr(index, "_update", lambda name, text, st: (updated.append(name), update(name, text, st)))
+    index._sync(str(notes))
+    assert updated == []
+    write(notes, "n1.md", "note one rewritten with zebra", mtime=2_000_000)
+    write(notes, "n5.md", "a new zebra note")
+    os.remove(notes / "n3.md")
+    index._sync(str(notes))
+    assert sorted(updated) == ["n1.md", "n5.md"]
+    assert sorted(index.search("zebra")) == ["n1.md", "n5.md"]
+    assert index.search("note 3") == []
+
+
+def test_search_async_answers_only_the_newest_request(tmp_path):
+    results = []; done = threading.Event()
+    index = NoteIndex(str(tmp_path / "index.db"), on_search=lambda generation, names: (results.append((generation, names)), done.set()))
+    if not index.available: pytest.skip("SQLite has no FTS5")
+    try:
+        notes = tmp_path / "notes"; notes.mkdir()
+        write(notes, "a.md", "apple"); write(notes, "b.md", "banana")
+        index._sync(str(notes))
+        with index._cond: # the index thread cannot pick up the first request before the second replaces it
+            index.search_async("apple"); newest = index.search_async("banana")
+        assert done.wait(5)
+        assert results == [(newest, ["b.md"])]
+        done.clear(); index.search_async("apple"); index.cancel_search()
+        assert not done.wait(0.3)
+    finally: index.close()
@@ -0,0 +1,115 @@
+"""NotesWatcher's inotify event mapping, and how the app applies a batch of events."""
+import os, struct, sys, time, tkinter as tk
+from types import SimpleNamespace
+
+import pytest
+
+from notesshell import NotesWatcher, NoteShellApp
+
+W = NotesWatcher
+
+
+def record(mask, name, cookie=0):
+    raw = name.encode() + b"\0" * (16 - len(name) % 16)
+    return struct.pack("iIII", 1, mask, cookie, len(raw)) + raw
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    watcher = NotesWatcher(tk.Tcl(), str(tmp_path), on_events=lambda events: None)
+    yield watcher
+    watcher.close()
+
+
+# event mapping
+def test_records_map_to_events(watcher):
+    buf = b"".join([record(W.IN_CREATE, "a.md"), record(W.IN_CLOSE_WRITE, "a.md"), record(W.IN_DELETE, "b.md"),
+                    record(W.IN_CREATE, "c.txt"), record(W.IN_CREATE | W.IN_ISDIR, "d.md"),
+                    record(W.IN_MOVED_FROM, "old.md", 7), record(W.IN_MOVED_TO, "new.md", 7)])
+    assert watcher._parse_events(buf, {}, 0.0) == ([("created", "a.md", None), ("modified", "a.md", None), ("deleted", "b.md", None), ("renamed", "new.md", "old.md")], False)
+
+
+def test_rename_split_across_reads_is_still_a_rename(watcher):
+    moved_from = {}
+    assert watcher._parse_events(record(W.IN_MOVED_FROM, "old.md", 9), moved_from, 0.0) == ([], False)
+    assert watcher._parse_events(record(W.IN_MOVED_TO, "new.md", 9), moved_from, 0.05) == ([("renamed", "new.md", "old.md")], False)
+    assert moved_from == {}
+
+
+def test_unpaired_move_becomes_a_delete_after_the_pairing_window(watcher):
+    moved_from = {}
+    watcher._parse_events(record(W.IN_MOVED_FROM, "gone.md", 3), moved_from, 0.0)
+    assert watcher._parse_events(b"", moved_from, W.MOVE_PAIR_SECONDS / 2) == ([], False)
+    assert watcher._parse_events(b"", moved_from, W.MOVE_PAIR_SECONDS) == ([("deleted", "gone.md", None)], False)
+    assert watcher._parse_events(record(W.IN_MOVED_TO, "in.md", 4), moved_from, 1.0) == ([("created", "in.md", None)], False) # moved in from elsewhere
+
+
+def test_overflow_and_directory_loss(watcher):
+    assert watcher._parse_events(record(W.IN_Q_OVERFLOW, ""), {}, 0.0) == ([("rescan", None, None)], False)
+    assert watcher._parse_events(record(W.IN_DELETE_SELF, ""), {}, 0.0) == ([], True)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_inotify_reports_real_changes(watcher, tmp_path):
+    if watcher.backend != "inotify": pytest.skip("inotify unavailable")
+    (tmp_path / "a.md").write_text("one")
+    os.rename(tmp_path / "a.md", tmp_path / "b.md")
+    os.remove(tmp_path / "b.md")
+    expected = [("created", "a.md", None), ("modified", "a.md", None), ("renamed", "b.md", "a.md"), ("deleted", "b.md", None)]
+    end = time.monotonic() + 5
+    while len(watcher._events) < len(expected) and time.monotonic() < end: time.sleep(0.01)
+    assert list(watcher._events) == expected
+
+
+# NoteShellApp._on_notes_changed
+class Recorder:
+    def __init__(self): self.calls = []
+    def __getattr__(self, name): return lambda *args: self.calls.append((name,) + args)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = NoteShellApp.__new__(NoteShellApp)
+    app.notes_dir = str(tmp_path)
+    for name in ("a.md", "b.md", "open.md"): (tmp_path / name).write_text(name)
+    app._all_notes = ["a.md", "b.md", "open.md"]
+    app.current_note = "open.md"; app._note_disk_sig = None
+    app.note_index = Recorder(); app.notes_list = Recorder()
+    app.autosave = SimpleNamespace(written={})
+    app.filtered = 0; app.filter_notes = lambda: setattr(app, "filtered", app.filtered + 1)
+    app._update_save_status = lambda: None
+    app.disk_changes = []; app._on_open_note_changed_on_disk = lambda name, sig: app.disk_changes.append((name, sig))
+    return app
+
+
+def sig(path): st = os.stat(path); return (st.st_mtime_ns, st.st_size)
+
+
+def test_created_and_deleted_notes_patch_the_list(app, tmp_path):
+    (tmp_path / "c.md").write_text("new"); os.remove(tmp_path / "a.md")
+    app._on_notes_changed([("created", "c.md", None), ("deleted", "a.md", None)])
+    assert app._all_notes == ["b.md", "c.md", "open.md"] and app.filtered == 1
+    assert sorted(app.note_index.calls) == [("refresh", str(tmp_path / "c.md"), "c.md"), ("remove", "a.md")]
+    assert app.disk_changes == []
+
+
+def test_own_writes_are_not_reindexed_or_reported(app, tmp_path):
+    app.autosave.written[str(tmp_path / "open.md")] = app._note_disk_sig = sig(tmp_path / "open.md")
+    app._on_notes_changed([("modified", "open.md", None)])
+    assert app.note_index.calls == [] and app.disk_changes == []
+
+
+def test_outside_change_to_the_open_note_is_reported(app, tmp_path):
+    (tmp_path / "open.md").write_text("changed elsewhere")
+    app._on_notes_changed([("modified", "open.md", None)])
+    assert app.disk_changes == [("open.md", sig(tmp_path / "open.md"))]
+    os.remove(tmp_path / "open.md")
+    app._on_notes_changed([("deleted", "open.md", None)])
+    assert app.disk_changes[-1] == ("open.md", None)
+
+
+def test_open_note_follows_a_rename(app, tmp_path):
+    os.rename(tmp_path / "open.md", tmp_path / "renamed.md")
+    app._on_notes_changed([("renamed", "renamed.md", "open.md")])
+    assert app.current_note == "renamed.md" and app._all_notes == ["a.md", "b.md", "renamed.md"]
+    assert ("select_item", "renamed.md") in app.notes_list.calls and app.disk_changes == []
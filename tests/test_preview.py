@@ -0,0 +1,37 @@
+"""MarkdownPreviewEngine: block-wise rendering must match a whole-document convert."""
+import re
+
+import markdown2
+import pytest
+
+from notesshell import MARKDOWN_EXTRAS, MarkdownPreviewEngine
+
+
+def whole(text): return markdown2.Markdown(extras=list(MARKDOWN_EXTRAS)).convert(text)
+
+
+def normalized(html): return re.sub(r"\s+", " ", html).strip()
+
+
+@pytest.mark.parametrize("text", [
+    "# Title\n\nSome *text*.\n\n- one\n- two\n\n  more of two\n\n```\ncode\n\nstill code\n```\n\nend",
+    "before\n\n<div>\n\nx\n\n</div>\n\nafter",
+    "<div class=\"outer\">\n<div>\n\ninner\n\n</div>\n\nstill outer\n</div>\n\n**after**",
+    "intro\n\n<!-- a comment\n\nspanning blank lines -->\n\n*after*",
+    "<details>\n<summary>More</summary>\n\nhidden *text*\n\n</details>\n\n# Next",
+    "<table>\n<tr><td>a</td></tr>\n\n<tr><td>b</td></tr>\n</table>\n\ntail",
+])
+def test_render_matches_whole_document(text):
+    assert normalized(MarkdownPreviewEngine().render(text)) == normalized(whole(text))
+
+
+def test_raw_html_block_is_one_block():
+    blocks = MarkdownPreviewEngine().split_blocks("a\n\n<div>\n<div>\n\nx\n\n</div>\n\ny\n</div>\n\nb")
+    assert blocks == ["a", "<div>\n<div>\n\nx\n\n</div>\n\ny\n</div>", "b"]
+
+
+def test_edit_re_renders_only_the_touched_block():
+    engine = MarkdownPreviewEngine()
+    engine.render("one\n\ntwo\n\nthree")
+    engine.render("one\n\ntwo, edited\n\nthree")
+    assert engine.last_stats == {"blocks": 3, "rendered": 1}
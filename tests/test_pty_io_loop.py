@@ -0,0 +1,82 @@
+"""PtyIOLoop input queue: FIFO writes, partial-write tails and the queue limit, against a pipe nobody reads yet."""
+import os, time
+
+import pytest
+
+from notesshell import PtyIOLoop
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.001)
+
+
+def settle(loop):
+    """Waits until the loop has stopped writing, i.e. the pipe is full."""
+    previous = -1
+    while loop.bytes_written != previous: previous = loop.bytes_written; time.sleep(0.05)
+
+
+def fill(fd):
+    """Writes into fd until it would block; returns what went in."""
+    written = []
+    try:
+        while True: written.append(b"." * os.write(fd, b"." * 4096))
+    except BlockingIOError: return b"".join(written)
+
+
+def drain(fd, n):
+    out = bytearray()
+    while len(out) < n:
+        try: out += os.read(fd, 1 << 16)
+        except BlockingIOError: time.sleep(0.001)
+    return bytes(out)
+
+
+@pytest.fixture
+def pipe():
+    r, w = os.pipe()
+    os.set_blocking(r, False); os.set_blocking(w, False)
+    loop = PtyIOLoop()
+    loop.add(w, on_data=lambda text: None) # the write end never becomes readable; only the input queue is exercised
+    yield loop, r, w
+    loop.close()
+    os.close(r); os.close(w)
+
+
+def test_writes_reach_the_peer_in_order_across_partial_writes(pipe):
+    loop, r, w = pipe
+    chunks = [bytes([65 + i % 26]) * 10000 for i in range(30)] # 10000 does not divide the pipe size, so some write is cut short
+    for chunk in chunks: assert loop.write(w, chunk)
+    total = sum(map(len, chunks))
+    settle(loop)
+    assert 0 < loop.queued(w) < total # stalled on the full pipe
+    assert loop.bytes_written % 10000 # mid-chunk: the unwritten tail waits at the head of the queue
+    assert drain(r, total) == b"".join(chunks)
+    wait_for(lambda: loop.queued(w) == 0)
+
+
+def test_full_queue_refuses_writes_whole(pipe):
+    loop, r, w = pipe
+    loop.WRITE_QUEUE_MAX = 1000
+    stuffed = fill(w)
+    assert not loop.write(w, b"x" * 1001) # refused while the queue is empty too
+    assert loop.queued(w) == 0
+    assert loop.write(w, b"a" * 600)
+    assert not loop.write(w, b"b" * 401)
+    assert loop.write(w, b"c" * 400) # exactly at the limit
+    assert loop.queued(w) == 1000
+    assert drain(r, len(stuffed) + 1000) == stuffed + b"a" * 600 + b"c" * 400
+
+
+def test_forced_control_bytes_bypass_the_limit_but_keep_their_place(pipe):
+    loop, r, w = pipe
+    loop.WRITE_QUEUE_MAX = 100
+    stuffed = fill(w)
+    assert loop.write(w, b"sleep 100\n" * 10)
+    assert not loop.write(w, b"\x03")
+    assert loop.write(w, b"\x03", force=True) and loop.write(w, b"\x04", force=True)
+    assert loop.queued(w) == 102
+    assert drain(r, len(stuffed) + 102) == stuffed + b"sleep 100\n" * 10 + b"\x03\x04"
@@ -0,0 +1,82 @@
+"""SessionRecorder and SessionRecording: the compressed, seekable session transcripts."""
+import os, stat, time
+
+import pytest
+
+from notesshell import SessionRecorder, SessionRecording
+
+
+def record(path, chunks, **kwargs):
+    recorder = SessionRecorder(str(path), meta={"shell": "sh"}, **kwargs)
+    for chunk in chunks: recorder.write(chunk)
+    recorder.close(wait=True)
+    return recorder
+
+
+def output(recording, start=0.0): return b"".join(data for t, kind, data in recording.records(start) if kind == SessionRecorder.OUTPUT)
+
+
+def test_round_trip(tmp_path):
+    chunks = [b"$ ls\r\n", b"\x1b[34mdir\x1b[0m  file\r\n", "café\r\n".encode()]
+    record(tmp_path / "s.nsrec", chunks)
+    recording = SessionRecording(str(tmp_path / "s.nsrec"))
+    assert output(recording) == b"".join(chunks)
+    meta = recording.meta()
+    assert meta["shell"] == "sh" and meta["format"] == 1
+
+
+def test_files_are_private(tmp_path):
+    record(tmp_path / "rec" / "s.nsrec", [b"secret\n"])
+    assert stat.S_IMODE(os.stat(tmp_path / "rec").st_mode) == 0o700
+    for name in ("s.nsrec", "s.nsrec.idx"): assert stat.S_IMODE(os.stat(tmp_path / "rec" / name).st_mode) == 0o600
+
+
+def test_never_overwrites_an_existing_recording(tmp_path):
+    record(tmp_path / "s.nsrec", [b"first"])
+    with pytest.raises(FileExistsError): SessionRecorder(str(tmp_path / "s.nsrec"))
+
+
+def test_index_lets_reading_start_mid_recording(tmp_path, monkeypatch):
+    monkeypatch.setattr(SessionRecorder, "FRAME_BYTES", 64)
+    recorder = SessionRecorder(str(tmp_path / "s.nsrec"))
+    for i in range(20): recorder.write(b"chunk %02d " % i + b"x" * 40); time.sleep(0.002)
+    recorder.close(wait=True)
+    recording = SessionRecording(str(tmp_path / "s.nsrec"))
+    assert len(recording.frames) > 5
+    t = recording.frames[5][0]
+    records = list(recording.records(t))
+    assert records[0][0] >= t and records[0][2].startswith(b"chunk")
+    assert output(recording, t) == output(recording)[-len(output(recording, t)):]
+
+
+def test_truncated_last_frame_is_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(SessionRecorder, "FRAME_BYTES", 64)
+    path = tmp_path / "s.nsrec"
+    recorder = SessionRecorder(str(path))
+    for i in range(10): recorder.write(b"line %d\n" % i + b"." * 60)
+    recorder.close(wait=True)
+    whole = output(SessionRecording(str(path)))
+    with open(path, "r+b") as f: f.truncate(os.path.getsize(path) - 10) # a crash mid-write
+    partial = output(SessionRecording(str(path)))
+    assert partial and whole.startswith(partial) and len(partial) < len(whole)
+
+
+def test_missing_index_reads_from_the_start(tmp_path):
+    record(tmp_path / "s.nsrec", [b"one\r\n", b"two\r\n"])
+    os.remove(tmp_path / "s.nsrec.idx")
+    assert output(SessionRecording(str(tmp_path / "s.nsrec"))) == b"one\r\ntwo\r\n"
+
+
+def test_overflow_becomes_a_gap_record(tmp_path):
+    recorder = SessionRecorder(str(tmp_path / "s.nsrec"), max_pending=10)
+    with recorder._cond: recorder.write(b"12345678"); recorder.write(b"dropped!") # the writer cannot drain the queue in between
+    recorder.close(wait=True)
+    assert recorder.dropped == 8
+    gaps = [data for t, kind, data in SessionRecording(str(tmp_path / "s.nsrec")).records() if kind == SessionRecorder.GAP]
+    assert gaps == [(8).to_bytes(8, "little")]
+
+
+def test_search_strips_escapes_and_joins_split_lines(tmp_path):
+    record(tmp_path / "s.nsrec", [b"\x1b[31mred err", b"or\x1b[0m here\r\n", b"fine\r\n", b"last error"])
+    hits = [line for t, line in SessionRecording(str(tmp_path / "s.nsrec")).search("error")]
+    assert hits == ["red error here", "last error"]
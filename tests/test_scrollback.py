@@ -0,0 +1,121 @@
+"""ScrollbackBuffer (in memory and spilled to disk) and OutputBuffer."""
+import os, re, stat
+
+import pytest
+
+from notesshell import CLEAR_SCREEN, OutputBuffer, ScrollbackBuffer
+
+BLOCK = ScrollbackBuffer.BLOCK_LINES
+
+
+def filled(buffer, n):
+    buffer.append("".join(f"line {i}\n" for i in range(n)))
+    return buffer
+
+
+@pytest.fixture
+def spilled(tmp_path):
+    buffer = filled(ScrollbackBuffer(4 * 1024, spill_path=str(tmp_path / "spill" / "scrollback")), 10 * BLOCK + 5)
+    yield buffer
+    buffer.close()
+
+
+# ScrollbackBuffer
+def test_partial_line_waits_for_its_newline():
+    buffer = ScrollbackBuffer(1 << 20)
+    buffer.append("one\ntw"); buffer.append("o\nthr")
+    assert buffer.line_count == 2
+    assert buffer.get_lines(0, 10) == ["one", "two"]
+
+
+def test_get_lines_across_blocks():
+    buffer = filled(ScrollbackBuffer(1 << 20), 3 * BLOCK + 10)
+    assert buffer.get_lines(BLOCK - 2, BLOCK + 2) == [f"line {i}" for i in range(BLOCK - 2, BLOCK + 2)]
+    assert buffer.get_lines(3 * BLOCK + 8, 10 ** 6) == ["line 776", "line 777"] # clipped to the lines there are
+
+
+def test_memory_limit_drops_oldest_blocks():
+    buffer = filled(ScrollbackBuffer(4 * 1024), 10 * BLOCK)
+    assert buffer.first_line > 0 and buffer.first_line % BLOCK == 0
+    assert buffer.get_lines(0, 2) == [] # gone without a spill file
+    assert buffer.get_lines(buffer.first_line, buffer.first_line + 1) == [f"line {buffer.first_line}"]
+
+
+def test_search_in_memory():
+    buffer = filled(ScrollbackBuffer(1 << 20), 2 * BLOCK + 3)
+    assert list(buffer.search(re.compile(r"line 1\d$", re.M))) == list(range(10, 20))
+    assert list(buffer.search(re.compile("line 5"), start=100, end=515)) == list(range(500, 515))
+
+
+def test_search_fold_case_and_cancel():
+    buffer = ScrollbackBuffer(1 << 20)
+    buffer.append("Error one\nok\nERROR two\n")
+    assert list(buffer.search(re.compile("error"), fold_case=True)) == [0, 2]
+    assert buffer.search(re.compile("error"), cancelled=lambda: True) is None
+
+
+def test_spill_keeps_dropped_lines_readable(spilled):
+    assert spilled.first_line == 0
+    assert spilled.get_lines(0, 3) == ["line 0", "line 1", "line 2"]
+    assert spilled.get_lines(5 * BLOCK - 1, 5 * BLOCK + 1) == [f"line {5 * BLOCK - 1}", f"line {5 * BLOCK}"]
+    assert spilled.get_lines(10 * BLOCK + 3, 10 * BLOCK + 10) == [f"line {10 * BLOCK + 3}", f"line {10 * BLOCK + 4}"]
+
+
+def test_spill_search_matches_in_memory_search(spilled):
+    regex = re.compile(r"line \d*7$", re.M)
+    expected = [i for i in range(10 * BLOCK + 5) if str(i).endswith("7")]
+    assert list(spilled.search(regex)) == expected
+    assert list(spilled.search(regex, start=300, end=1000)) == [i for i in expected if 300 <= i < 1000]
+
+
+def test_spill_file_is_private_and_not_left_on_disk(spilled):
+    directory = os.path.dirname(spilled.spill_path)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    assert os.listdir(directory) == []
+
+
+# OutputBuffer
+def test_take_moves_text_into_history():
+    history = ScrollbackBuffer(1 << 20); buffer = OutputBuffer(history, 1 << 20)
+    buffer.put("a\nb"); buffer.put("c\n")
+    frame = buffer.take()
+    assert frame.text == "a\nbc\n" and frame.reset_line is None and frame.start_line == 0
+    assert history.get_lines(0, 5) == ["a", "bc"]
+    assert buffer.take() is None
+
+
+def test_take_respects_max_chars():
+    buffer = OutputBuffer(ScrollbackBuffer(1 << 20), 1 << 20)
+    for _ in range(3): buffer.put("x" * OutputBuffer.SEGMENT_CHARS)
+    assert len(buffer.take(10).text) == OutputBuffer.SEGMENT_CHARS
+    assert buffer.pending_chars == 2 * OutputBuffer.SEGMENT_CHARS
+
+
+def test_clear_screen_resets_the_frame():
+    history = ScrollbackBuffer(1 << 20); buffer = OutputBuffer(history, 1 << 20)
+    buffer.put("old\n"); buffer.put(CLEAR_SCREEN); buffer.put("new\n")
+    frame = buffer.take()
+    assert frame.text == "new\n" and frame.dropped == 1
+    assert frame.reset_line == frame.start_line == 1 # the widget restarts after "old"
+
+
+def test_tail_overflow_drops_oldest_output():
+    history = ScrollbackBuffer(1 << 20); buffer = OutputBuffer(history, OutputBuffer.SEGMENT_CHARS, overflow="tail")
+    for i in range(4): buffer.put(f"{i}\n" * (OutputBuffer.SEGMENT_CHARS // 2))
+    assert buffer.dropped_chars == 3 * OutputBuffer.SEGMENT_CHARS # only the newest segment fits
+    frame = buffer.take()
+    assert "output dropped" in frame.text and frame.reset_line is not None
+    assert frame.text.split("...]\n", 1)[1].startswith("3\n")
+
+
+def test_spill_overflow_moves_oldest_output_to_history():
+    history = ScrollbackBuffer(1 << 20); buffer = OutputBuffer(history, OutputBuffer.SEGMENT_CHARS, overflow="spill")
+    for i in range(4): buffer.put(f"{i}\n" * (OutputBuffer.SEGMENT_CHARS // 2))
+    assert buffer.dropped_chars == 0
+    frame = buffer.take()
+    assert "moved to scrollback" in frame.text
+    assert history.get_lines(0, 1) == ["0"] # nothing lost, only kept out of the widget
+
+
+def test_unknown_overflow_policy_falls_back_to_tail():
+    assert OutputBuffer(ScrollbackBuffer(1024), 1024, overflow="bogus").overflow == "tail"
@@ -0,0 +1,194 @@
+"""TerminalScreen (the emulation screen model) and split_incomplete_escape."""
+import pytest
+
+from notesshell import CLEAR_SCREEN, TerminalScreen, split_incomplete_escape
+
+
+def history(items): return "".join(item for item in items if item is not CLEAR_SCREEN)
+
+
+def rows(screen): return screen.text().split("\n")
+
+
+# split_incomplete_escape
+@pytest.mark.parametrize("data, complete, tail", [
+    ("plain", "plain", ""),
+    ("text\x1b[1;3", "text", "\x1b[1;3"),
+    ("text\x1b[1;31m", "text\x1b[1;31m", ""),
+    ("t\x1b]0;title", "t", "\x1b]0;title"),
+    ("t\x1b]0;title\x1b", "t", "\x1b]0;title\x1b"), # cut between ESC and the backslash of ST
+    ("t\x1b", "t", "\x1b"),
+])
+def test_split_incomplete_escape(data, complete, tail):
+    assert split_incomplete_escape(data) == (complete, tail)
+
+
+def test_split_incomplete_escape_gives_up_beyond_max_pending():
+    data = "x\x1b]" + "a" * 100
+    assert split_incomplete_escape(data, max_pending=50) == (data, "")
+
+
+# TerminalScreen: text, cursor, CSI
+def test_print_and_cursor_movement():
+    screen = TerminalScreen(4, 10)
+    screen.feed("hello\r\nworld\x1b[1;3HX\x1b[2;8HY")
+    assert rows(screen) == ["heXlo", "world  Y", "", ""]
+    assert (screen.y, screen.x) == (1, 8)
+
+
+def test_autowrap_marks_wrapped_row():
+    screen = TerminalScreen(3, 5)
+    screen.feed("abcdefg")
+    assert rows(screen) == ["abcde", "fg", ""]
+    assert screen.grid[0][2] and not screen.grid[1][2]
+
+
+def test_erase_in_line_and_display():
+    screen = TerminalScreen(3, 6)
+    screen.feed("aaaaaa\r\nbbbbbb\r\ncccccc\x1b[2;3H\x1b[K")
+    assert rows(screen) == ["aaaaaa", "bb", "cccccc"]
+    screen.feed("\x1b[1J")
+    assert rows(screen) == ["", "", "cccccc"]
+    screen.feed("\x1b[2J")
+    assert rows(screen) == ["", "", ""]
+
+
+def test_insert_and_delete_characters():
+    screen = TerminalScreen(2, 8)
+    screen.feed("abcdef\x1b[1;3H\x1b[2@")
+    assert rows(screen)[0] == "ab  cdef"
+    screen.feed("\x1b[3P")
+    assert rows(screen)[0] == "abdef"
+
+
+def test_cursor_position_report_is_queued_as_reply():
+    screen = TerminalScreen(5, 10)
+    screen.feed("\x1b[3;4H\x1b[6n")
+    assert screen.replies == ["\x1b[3;4R"]
+
+
+# SGR
+def test_sgr_attributes_are_interned():
+    screen = TerminalScreen(2, 10)
+    screen.feed("\x1b[1;31mR\x1b[0mn\x1b[38;5;200mP\x1b[48;2;1;2;3mT")
+    attrs = screen.grid[0][1]
+    assert screen.attr_table[attrs[0]] == (1, None, TerminalScreen.BOLD)
+    assert attrs[1] == 0
+    assert screen.attr_table[attrs[2]] == (200, None, 0)
+    assert screen.attr_table[attrs[3]] == (200, "#010203", 0)
+    screen.feed("\x1b[0;1;31mR")
+    assert screen.grid[0][1][4] == attrs[0] # same attributes, same id
+
+
+def test_erase_keeps_background_colour():
+    screen = TerminalScreen(2, 4)
+    screen.feed("\x1b[44m\x1b[2J")
+    assert screen.attr_table[screen.grid[0][1][0]] == (None, 4, 0)
+
+
+# scrolling and history
+def test_lines_scrolled_off_become_history():
+    screen = TerminalScreen(3, 10)
+    out = screen.feed("".join(f"line{i}   \r\n" for i in range(5)))
+    assert history(out) == "line0\nline1\nline2\n" # trailing blanks trimmed
+    assert rows(screen) == ["line3", "line4", ""]
+
+
+def test_wrapped_lines_are_rejoined_in_history():
+    screen = TerminalScreen(2, 4)
+    out = screen.feed("abcdefghij\r\nk\r\n")
+    assert history(out) == "abcdefghij\n"
+    assert rows(screen) == ["k", ""]
+
+
+def test_bulk_lines_match_line_by_line_feeding():
+    text = "".join(f"{i} " + "x" * (i % 13) + "\r\n" for i in range(200))
+    bulk, single = TerminalScreen(5, 8), TerminalScreen(5, 8)
+    bulk_out = history(bulk.feed(text))
+    single_out = "".join(history(single.feed(c)) for c in text)
+    assert bulk_out == single_out
+    assert bulk.text() == single.text() and (bulk.y, bulk.x) == (single.y, single.x)
+    assert [row[2] for row in bulk.grid] == [row[2] for row in single.grid]
+
+
+def test_scroll_region_keeps_rows_outside_and_writes_no_history():
+    screen = TerminalScreen(5, 10)
+    out = screen.feed("top\x1b[5;1Hbottom\x1b[2;4r\x1b[2;1Ha\r\nb\r\nc\r\nd\r\ne")
+    assert rows(screen) == ["top", "c", "d", "e", "bottom"]
+    assert history(out) == ""
+    screen.feed("\x1b[r\x1b[5;1H\r\n")
+    assert rows(screen)[0] == "c"
+
+
+def test_reverse_index_scrolls_down_at_top():
+    screen = TerminalScreen(3, 5)
+    screen.feed("a\r\nb\r\nc\x1b[H\x1bM")
+    assert rows(screen) == ["", "a", "b"]
+
+
+def test_clear_scrollback_emits_clear_screen():
+    screen = TerminalScreen(2, 5)
+    assert screen.feed("\x1b[3J") == [CLEAR_SCREEN]
+
+
+# alternate screen
+def test_alternate_screen_restores_main_screen_and_cursor():
+    screen = TerminalScreen(3, 10)
+    screen.feed("shell$ ls")
+    out = screen.feed("\x1b[?1049h\x1b[Hfull\r\nscreen\r\n\r\n\r\napp")
+    assert history(out) == "" # nothing from the alternate screen reaches the history
+    assert rows(screen)[-1] == "app"
+    screen.feed("\x1b[?1049l")
+    assert rows(screen) == ["shell$ ls", "", ""]
+    assert (screen.y, screen.x) == (0, 9)
+
+
+# damage
+def test_take_damage_reports_changed_rows_only():
+    screen = TerminalScreen(4, 10)
+    full, scrolled, damage, cursor = screen.take_damage()
+    assert full and len(damage) == 4
+    screen.feed("\x1b[3;1Hhi")
+    full, scrolled, damage, cursor = screen.take_damage()
+    assert not full and scrolled == 0
+    assert damage[2] == [("hi ", 0)] # padded up to the cursor
+    assert set(damage) == {0, 2} # row 0: where the cursor was drawn
+    assert cursor == (2, 2)
+
+
+def test_scroll_is_counted_instead_of_redrawing_every_row():
+    screen = TerminalScreen(10, 20)
+    screen.feed("\x1b[10;1H"); screen.take_damage()
+    screen.feed("a\r\nb\r\n")
+    full, scrolled, damage, cursor = screen.take_damage()
+    assert not full and scrolled == 2
+    assert set(damage) == {7, 8, 9} # "a" moved up to row 7, "b" on row 8, the new bottom row
+    assert damage[7] == [("a", 0)] and damage[8] == [("b", 0)]
+
+
+def test_scrolling_a_whole_screen_asks_for_a_full_redraw():
+    screen = TerminalScreen(3, 10)
+    screen.take_damage()
+    screen.feed("x\r\n" * 5)
+    full, scrolled, damage, cursor = screen.take_damage()
+    assert full and scrolled == 0 and len(damage) == 3
+
+
+# resize
+def test_resize_pushes_rows_above_cursor_into_history():
+    screen = TerminalScreen(4, 10)
+    screen.feed("one\r\ntwo\r\nthree\r\nfour")
+    out = []
+    screen.resize(2, 10, out)
+    assert history(out) == "one\ntwo\n"
+    assert rows(screen) == ["three", "four"]
+    assert (screen.rows, screen.y) == (2, 1)
+
+
+def test_resize_truncates_and_pads_columns():
+    screen = TerminalScreen(2, 8)
+    screen.feed("abcdefgh")
+    screen.resize(2, 4)
+    assert rows(screen)[0] == "abcd" and screen.x == 3
+    screen.resize(3, 6)
+    assert rows(screen) == ["abcd", "", ""] and all(len(row[0]) == 6 for row in screen.grid)